@@ -0,0 +1,24 @@
+"""
+Core package shared by the API and the Celery worker.
+
+The worker imports the same models, schemas, engine factory and the
+ingestion / rollup functions as the API instead of keeping its own copies.
+Submodules are imported on first attribute access, so `import app` stays
+cheap and a process only loads what it actually uses.
+"""
+import importlib
+
+_SUBMODULES = {
+    "advanced", "async_crud", "batch", "buffer", "cache", "charts", "crud", "database", "events",
+    "export", "ingest", "instrumentation", "migrations", "models", "responses", "retention", "rollups", "schemas", "staging",
+}
+
+
+def __getattr__(name):
+    if name in _SUBMODULES:
+        return importlib.import_module(f".{name}", __name__)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(set(globals()) | _SUBMODULES)
@@ -0,0 +1,196 @@
+"""
+Vectorized statistics over many sensor series at once.
+
+`load_series` fetches every reading of a (fields x sensor types x time range)
+slice in one query ordered by series and time, and turns the result into
+flat NumPy columns plus the start offset of each series. `compute` then
+derives every statistic for all series together with segment reductions
+(`ufunc.reduceat`), a single lexsort for percentiles and a searchsorted
+over a series-offset time key for the rolling windows, so no Python code
+runs per reading.
+"""
+import os
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from . import crud, models
+
+ADVANCED_MAX_ROWS = int(os.getenv("ADVANCED_ANALYTICS_MAX_ROWS", "5000000"))
+DEFAULT_PERCENTILES = (50.0, 90.0, 99.0)
+
+
+class TooManyRows(ValueError):
+    """The requested slice holds more readings than ADVANCED_MAX_ROWS."""
+
+
+@dataclass
+class SeriesArrays:
+    """Readings of several series, sorted by series and time, as flat columns."""
+    keys: List[Tuple[int, str]]
+    starts: np.ndarray
+    series: np.ndarray
+    seconds: np.ndarray
+    values: np.ndarray
+
+    @property
+    def counts(self) -> np.ndarray:
+        return np.diff(np.append(self.starts, len(self.values)))
+
+
+def load_series(
+    db: Session,
+    field_ids: Sequence[int],
+    sensor_types: Sequence[str],
+    start_time: datetime,
+    end_time: datetime,
+    max_rows: Optional[int] = None,
+) -> SeriesArrays:
+    """Fetch the readings of every (field, sensor type) pair in `[start_time, end_time]` in one query."""
+    max_rows = max_rows or ADVANCED_MAX_ROWS
+    reading = models.SensorReading
+    rows = db.execute(
+        select(
+            reading.field_id,
+            reading.sensor_type,
+            crud._epoch_seconds(db, reading.timestamp),
+            reading.value,
+        ).where(
+            reading.field_id.in_(field_ids),
+            reading.sensor_type.in_(sensor_types),
+            reading.timestamp >= start_time,
+            reading.timestamp <= end_time,
+        ).order_by(
+            reading.field_id, reading.sensor_type, reading.timestamp
+        ).limit(max_rows + 1)
+    ).all()
+    if len(rows) > max_rows:
+        raise TooManyRows(f"More than {max_rows} readings match; narrow the time range or the series.")
+    if not rows:
+        empty = np.empty(0)
+        return SeriesArrays([], empty.astype(np.int64), empty.astype(np.int64), empty, empty)
+
+    field_col, type_col, seconds, values = zip(*rows)
+    fields = np.array(field_col, dtype=np.int64)
+    types = np.array(type_col, dtype=object)
+    changed = (fields[1:] != fields[:-1]) | (types[1:] != types[:-1])
+    starts = np.concatenate(([0], np.flatnonzero(changed) + 1))
+    return SeriesArrays(
+        keys=list(zip(fields[starts].tolist(), types[starts].tolist())),
+        starts=starts,
+        series=np.concatenate(([0], np.cumsum(changed))),
+        seconds=np.array(seconds, dtype=np.float64),
+        values=np.array(values, dtype=np.float64),
+    )
+
+
+def percentiles(data: SeriesArrays, qs: Sequence[float]) -> np.ndarray:
+    """Linearly interpolated percentiles, shape `(series, len(qs))`."""
+    ordered = data.values[np.lexsort((data.values, data.series))]
+    positions = data.starts[:, None] + np.asarray(qs) / 100.0 * (data.counts[:, None] - 1)
+    low = np.floor(positions).astype(np.int64)
+    high = np.ceil(positions).astype(np.int64)
+    return ordered[low] + (ordered[high] - ordered[low]) * (positions - low)
+
+
+def rolling_means(data: SeriesArrays, window_seconds: float) -> np.ndarray:
+    """Mean of each reading's series over the trailing `(t - window_seconds, t]`."""
+    # Offset every series far enough apart on one time axis that a window never reaches into the previous one.
+    span = data.seconds.max() - data.seconds.min() + window_seconds + 1
+    key = data.series * span + (data.seconds - data.seconds.min())
+    first = np.searchsorted(key, key - window_seconds, side="right")
+    sums = np.concatenate(([0.0], np.cumsum(data.values)))
+    index = np.arange(len(data.values))
+    return (sums[index + 1] - sums[first]) / (index + 1 - first)
+
+
+def compute(
+    data: SeriesArrays,
+    qs: Sequence[float] = DEFAULT_PERCENTILES,
+    window_seconds: float = 3600,
+    above: Optional[float] = None,
+    below: Optional[float] = None,
+) -> List[dict]:
+    """
+    Per series: count, min, max, mean, population stddev, percentiles, the
+    least-squares trend and the steepest change between consecutive readings
+    (both per hour), and how often the trailing `window_seconds` mean went
+    above `above` or below `below`.
+    """
+    if not data.keys:
+        return []
+    n = len(data.keys)
+    counts = data.counts
+    means = np.add.reduceat(data.values, data.starts) / counts
+    deviations = data.values - means[data.series]
+    stddevs = np.sqrt(np.add.reduceat(deviations * deviations, data.starts) / counts)
+
+    centred = data.seconds - (np.add.reduceat(data.seconds, data.starts) / counts)[data.series]
+    spread = np.add.reduceat(centred * centred, data.starts)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        trends = np.where(spread > 0, np.add.reduceat(centred * deviations, data.starts) / spread * 3600, np.nan)
+
+    same = data.series[1:] == data.series[:-1]
+    elapsed = np.diff(data.seconds)
+    pairs = same & (elapsed > 0)
+    max_rates = np.full(n, np.nan)
+    np.fmax.at(max_rates, data.series[1:][pairs], np.abs(np.diff(data.values)[pairs] / elapsed[pairs]) * 3600)
+
+    breach_counts = np.zeros(n, dtype=np.int64)
+    last_breach = np.full(n, np.nan)
+    if above is not None or below is not None:
+        rolling = rolling_means(data, window_seconds)
+        breached = np.zeros(len(rolling), dtype=bool)
+        if above is not None:
+            breached |= rolling > above
+        if below is not None:
+            breached |= rolling < below
+        breach_counts = np.bincount(data.series[breached], minlength=n)
+        np.fmax.at(last_breach, data.series[breached], data.seconds[breached])
+
+    quantiles = percentiles(data, qs)
+    minimums = np.minimum.reduceat(data.values, data.starts)
+    maximums = np.maximum.reduceat(data.values, data.starts)
+
+    def optional(value):
+        return None if np.isnan(value) else float(value)
+
+    return [
+        {
+            'field_id': field_id,
+            'sensor_type': sensor_type,
+            'count': int(counts[i]),
+            'min': float(minimums[i]),
+            'max': float(maximums[i]),
+            'avg': float(means[i]),
+            'stddev': float(stddevs[i]),
+            'percentiles': {f"p{q:g}": float(value) for q, value in zip(qs, quantiles[i])},
+            'trend_per_hour': optional(trends[i]),
+            'max_rate_per_hour': optional(max_rates[i]),
+            'breaches': {
+                'count': int(breach_counts[i]),
+                'last_at': crud.EPOCH + timedelta(seconds=float(last_breach[i])) if breach_counts[i] else None,
+            },
+        }
+        for i, (field_id, sensor_type) in enumerate(data.keys)
+    ]
+
+
+def get_advanced_analytics(
+    db: Session,
+    field_ids: Sequence[int],
+    sensor_types: Sequence[str],
+    start_time: datetime,
+    end_time: datetime,
+    qs: Sequence[float] = DEFAULT_PERCENTILES,
+    window_seconds: float = 3600,
+    above: Optional[float] = None,
+    below: Optional[float] = None,
+) -> List[dict]:
+    """Load a slice of series and compute their statistics (see `compute`)."""
+    data = load_series(db, field_ids, sensor_types, start_time, end_time)
+    return compute(data, qs, window_seconds, above, below)
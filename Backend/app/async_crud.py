@@ -0,0 +1,89 @@
+"""
+Async counterparts of the functions in `crud`, for use with `database.get_async_db`.
+
+Simple reads are written against the async session directly. Functions with
+more involved query planning run the sync implementation through
+`AsyncSession.run_sync`, which still performs its I/O through the async driver,
+so there is only one copy of that logic.
+"""
+from datetime import datetime
+from typing import Sequence
+
+import anyio
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import charts, crud, ingest, models, schemas
+
+
+async def get_sensor_reading(db: AsyncSession, reading_id: int):
+    """Fetch a single sensor reading by its ID."""
+    return await db.get(models.SensorReading, reading_id)
+
+async def get_sensor_readings(db: AsyncSession, skip: int = 0, limit: int = 100):
+    """Fetch a paginated list of sensor readings."""
+    result = await db.execute(select(models.SensorReading).offset(skip).limit(limit))
+    return result.scalars().all()
+
+async def get_readings_page(
+    db: AsyncSession,
+    field_id: int = None,
+    sensor_type: str = None,
+    start_time: datetime = None,
+    end_time: datetime = None,
+    after: tuple = None,
+    limit: int = 100
+):
+    """Fetch one keyset page of readings (see `crud.get_readings_page`)."""
+    return await db.run_sync(
+        lambda session: crud.get_readings_page(
+            session, field_id, sensor_type, start_time, end_time, after=after, limit=limit
+        ).all()
+    )
+
+async def create_sensor_reading(db: AsyncSession, reading: schemas.SensorReadingCreate):
+    """
+    Create a new sensor reading record, upserting its field in the same
+    transaction. Cache invalidation and stream publishing can be Redis round
+    trips, so they run in a worker thread instead of on the event loop.
+    """
+    def insert(session):
+        ingest.upsert_fields(session, [reading.field_id])
+        return crud.insert_sensor_reading(session, reading)
+
+    db_reading = await db.run_sync(insert)
+    await anyio.to_thread.run_sync(crud.notify_readings, [crud.reading_row(db_reading)])
+    return db_reading
+
+async def get_analytics(db: AsyncSession, field_id: int, sensor_type: str, start_time: datetime, end_time: datetime):
+    """Fetch aggregated analytics for a specific field and sensor type within a time range."""
+    return await db.run_sync(crud.get_analytics, field_id, sensor_type, start_time, end_time)
+
+async def get_readings_for_chart(db: AsyncSession, field_id: int, sensor_type: str, start_time: datetime, end_time: datetime):
+    """Fetch a list of sensor readings for a chart, ordered by time."""
+    result = await db.execute(
+        select(
+            models.SensorReading.timestamp,
+            models.SensorReading.value
+        ).where(
+            models.SensorReading.field_id == field_id,
+            models.SensorReading.sensor_type == sensor_type,
+            models.SensorReading.timestamp >= start_time,
+            models.SensorReading.timestamp <= end_time
+        ).order_by(
+            models.SensorReading.timestamp.asc()
+        )
+    )
+    return result.all()
+
+async def get_chart_data(
+    db: AsyncSession, field_id: int, sensor_types: Sequence[str], start_time: datetime, end_time: datetime, width: int
+):
+    """Build bucketed chart rows (see `charts.get_chart_data`)."""
+    return await db.run_sync(charts.get_chart_data, field_id, sensor_types, start_time, end_time, width)
+
+async def get_chart_columns(
+    db: AsyncSession, field_id: int, sensor_types: Sequence[str], start_time: datetime, end_time: datetime, width: int
+):
+    """Build bucketed chart columns (see `charts.get_chart_columns`)."""
+    return await db.run_sync(charts.get_chart_columns, field_id, sensor_types, start_time, end_time, width)
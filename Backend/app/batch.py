@@ -0,0 +1,41 @@
+import os
+from collections import defaultdict
+from typing import Any, Dict, List, Sequence, Tuple
+
+from pydantic import TypeAdapter, ValidationError
+
+from . import schemas
+from .ingest import reading_to_row
+
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "10000"))
+
+_bulk_adapter = TypeAdapter(schemas.SensorReadingBulk)
+
+
+def validate_readings(items: Sequence[Any]) -> Tuple[List[Dict], List[schemas.BatchItemError]]:
+    """
+    Validate a batch of raw readings against `SensorReadingBulk` in bulk.
+
+    Returns the column dicts of the valid items and one error per invalid
+    item, keyed by its index in `items`. The whole batch is validated in one
+    pass; only when some items fail is the remainder validated again.
+    """
+    try:
+        bulk = _bulk_adapter.validate_python({'readings': items})
+        return [reading_to_row(reading) for reading in bulk.readings], []
+    except ValidationError as exc:
+        problems = defaultdict(list)
+        for error in exc.errors():
+            loc = error['loc']
+            if len(loc) < 2 or loc[0] != 'readings' or not isinstance(loc[1], int):
+                raise
+            field = '.'.join(str(part) for part in loc[2:]) or 'reading'
+            problems[loc[1]].append(f"{field}: {error['msg']}")
+
+    valid = [item for index, item in enumerate(items) if index not in problems]
+    bulk = _bulk_adapter.validate_python({'readings': valid})
+    errors = [
+        schemas.BatchItemError(index=index, detail='; '.join(messages))
+        for index, messages in sorted(problems.items())
+    ]
+    return [reading_to_row(reading) for reading in bulk.readings], errors
@@ -0,0 +1,140 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, Optional
+
+from sqlalchemy.orm import Session
+
+from . import ingest
+
+logger = logging.getLogger(__name__)
+
+WRITE_BEHIND = os.getenv("WRITE_BEHIND", "0") == "1"
+WRITE_BEHIND_MAX_ROWS = int(os.getenv("WRITE_BEHIND_MAX_ROWS", "50000"))
+WRITE_BEHIND_FLUSH_ROWS = int(os.getenv("WRITE_BEHIND_FLUSH_ROWS", "1000"))
+WRITE_BEHIND_FLUSH_SECONDS = float(os.getenv("WRITE_BEHIND_FLUSH_SECONDS", "1.0"))
+
+
+class WriteBehindBuffer:
+    """
+    Bounded in-process buffer of validated readings that a background thread
+    writes to the database in bulk.
+
+    A flush is triggered once `flush_rows` readings are waiting or every
+    `flush_seconds`, whichever comes first. When `max_rows` readings are
+    waiting or being flushed, `offer` refuses new ones so callers can apply
+    backpressure. Readings from a failed flush are put back and retried on
+    the next one, so a flush never writes more than `max_rows`.
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable[[], Session],
+        max_rows: int = WRITE_BEHIND_MAX_ROWS,
+        flush_rows: int = WRITE_BEHIND_FLUSH_ROWS,
+        flush_seconds: float = WRITE_BEHIND_FLUSH_SECONDS,
+    ):
+        self.session_factory = session_factory
+        self.max_rows = max_rows
+        self.flush_rows = flush_rows
+        self.flush_seconds = flush_seconds
+        self._rows = deque()
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        self.accepted = 0
+        self.rejected = 0
+        self.flushes = 0
+        self.failed_flushes = 0
+        self.flushed_rows = 0
+        self.last_flush_seconds = 0.0
+        self.max_flush_seconds = 0.0
+        self.total_flush_seconds = 0.0
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the flusher thread and write out everything still buffered."""
+        self._stopping.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def offer(self, row: Dict) -> bool:
+        """Queue a parsed reading; returns False when the buffer is full."""
+        with self._lock:
+            if len(self._rows) + self._in_flight >= self.max_rows:
+                self.rejected += 1
+                return False
+            self._rows.append(row)
+            self.accepted += 1
+            depth = len(self._rows)
+        if depth >= self.flush_rows:
+            self._wakeup.set()
+        return True
+
+    def _run(self) -> None:
+        while not self._stopping.is_set():
+            self._wakeup.wait(self.flush_seconds)
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self) -> int:
+        """Write every buffered reading in one transaction and return how many were written."""
+        with self._flush_lock:
+            with self._lock:
+                rows = list(self._rows)
+                self._rows.clear()
+                self._in_flight = len(rows)
+            if not rows:
+                return 0
+            started = time.perf_counter()
+            try:
+                with self.session_factory() as db:
+                    ingest.write_batch(db, rows)
+            except Exception:
+                logger.exception("Write-behind flush of %d readings failed", len(rows))
+                self.failed_flushes += 1
+                with self._lock:
+                    self._rows.extendleft(reversed(rows))
+                    self._in_flight = 0
+                return 0
+            with self._lock:
+                self._in_flight = 0
+            elapsed = time.perf_counter() - started
+            self.flushes += 1
+            self.flushed_rows += len(rows)
+            self.last_flush_seconds = elapsed
+            self.max_flush_seconds = max(self.max_flush_seconds, elapsed)
+            self.total_flush_seconds += elapsed
+            return len(rows)
+
+    def depth(self) -> int:
+        return len(self._rows)
+
+    def stats(self) -> Dict:
+        return {
+            "depth": self.depth(),
+            "in_flight": self._in_flight,
+            "max_rows": self.max_rows,
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "flushes": self.flushes,
+            "failed_flushes": self.failed_flushes,
+            "flushed_rows": self.flushed_rows,
+            "last_flush_seconds": round(self.last_flush_seconds, 6),
+            "max_flush_seconds": round(self.max_flush_seconds, 6),
+            "avg_flush_seconds": round(self.total_flush_seconds / self.flushes, 6) if self.flushes else None,
+        }
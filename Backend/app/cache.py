@@ -0,0 +1,251 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, Iterable, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory")
+CACHE_TTL_SECONDS = int(os.getenv("CACHE_TTL_SECONDS", "60"))
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "1024"))
+CACHE_WINDOW_SECONDS = int(os.getenv("CACHE_WINDOW_SECONDS", "60"))
+CACHE_REDIS_URL = os.getenv("CACHE_REDIS_URL", "redis://redis:6379/1")
+
+_MISSING = object()
+
+
+def window_end(now: Optional[datetime] = None) -> datetime:
+    """
+    Round `now` (default: utcnow) up to the next CACHE_WINDOW_SECONDS boundary,
+    so that polls within the same window share a cache key.
+    """
+    now = now or datetime.utcnow()
+    epoch = datetime(1970, 1, 1)
+    seconds = (now - epoch).total_seconds()
+    return epoch + timedelta(seconds=-(-seconds // CACHE_WINDOW_SECONDS) * CACHE_WINDOW_SECONDS)
+
+
+class MemoryBackend:
+    """In-process LRU store with per-entry expiry."""
+
+    blocking = False
+
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[float, object]]" = OrderedDict()
+        self._generations: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return _MISSING
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return _MISSING
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value, ttl: int) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def generations(self, names: Sequence[str]) -> Sequence[int]:
+        with self._lock:
+            return [self._generations.get(name, 0) for name in names]
+
+    def bump(self, names: Iterable[str]) -> None:
+        with self._lock:
+            for name in names:
+                self._generations[name] = self._generations.get(name, 0) + 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._generations.clear()
+
+    def size(self) -> int:
+        return len(self._entries)
+
+
+class RedisBackend:
+    """Redis store shared by every API and worker process; values are JSON encoded."""
+
+    prefix = "field_insights:cache:"
+    blocking = True
+
+    def __init__(self, url: str = CACHE_REDIS_URL):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+
+    def get(self, key: str):
+        raw = self.client.get(self.prefix + key)
+        return _MISSING if raw is None else json.loads(raw)
+
+    def set(self, key: str, value, ttl: int) -> None:
+        self.client.set(self.prefix + key, json.dumps(value), ex=ttl)
+
+    def generations(self, names: Sequence[str]) -> Sequence[int]:
+        values = self.client.mget([self.prefix + "gen:" + name for name in names])
+        return [int(v) if v is not None else 0 for v in values]
+
+    def bump(self, names: Iterable[str]) -> None:
+        pipe = self.client.pipeline(transaction=False)
+        for name in names:
+            pipe.incr(self.prefix + "gen:" + name)
+        pipe.execute()
+
+    def clear(self) -> None:
+        keys = list(self.client.scan_iter(self.prefix + "*"))
+        if keys:
+            self.client.delete(*keys)
+
+    def size(self) -> int:
+        return None
+
+
+class ResponseCache:
+    """
+    Read-through cache for aggregate read endpoints.
+
+    Keys combine the endpoint, field, sensor types and request parameters
+    with a generation counter per (field_id, sensor_type). Writes bump the
+    counters of the series they touch, which invalidates every cached
+    response for those series without having to find the keys.
+    """
+
+    def __init__(self, backend, ttl: int = CACHE_TTL_SECONDS):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.errors = 0
+
+    @staticmethod
+    def _series(field_id: int, sensor_type: str) -> str:
+        return f"{field_id}:{sensor_type}"
+
+    def _lookup(self, endpoint: str, field_id: int, sensor_types: Sequence[str], params: Tuple):
+        """Return `(key, value)`, with `value` `_MISSING` on a miss and `key` None if the backend failed."""
+        try:
+            series = [self._series(field_id, sensor_type) for sensor_type in sensor_types]
+            generations = self.backend.generations(series)
+            key = f"{endpoint}:{field_id}:{','.join(sensor_types)}:{params}:{generations}"
+            value = self.backend.get(key)
+        except Exception:
+            logger.exception("Cache lookup failed")
+            self.errors += 1
+            return None, _MISSING
+        if value is _MISSING:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return key, value
+
+    def _store(self, key: str, value) -> None:
+        try:
+            self.backend.set(key, value, self.ttl)
+        except Exception:
+            logger.exception("Cache store failed")
+            self.errors += 1
+
+    def get_or_compute(
+        self,
+        endpoint: str,
+        field_id: int,
+        sensor_types: Sequence[str],
+        params: Tuple,
+        compute: Callable[[], object],
+    ):
+        """Return the cached value for this request or compute and store it."""
+        if self.backend is None:
+            return compute()
+        key, value = self._lookup(endpoint, field_id, sensor_types, params)
+        if value is not _MISSING:
+            return value
+        value = compute()
+        if key is not None:
+            self._store(key, value)
+        return value
+
+    async def aget_or_compute(
+        self,
+        endpoint: str,
+        field_id: int,
+        sensor_types: Sequence[str],
+        params: Tuple,
+        compute: Callable[[], Awaitable[object]],
+    ):
+        """
+        Async variant of `get_or_compute` for an awaitable `compute`. Calls to a
+        network backend run in a worker thread so they don't block the event loop.
+        """
+        if self.backend is None:
+            return await compute()
+
+        async def call(fn, *args):
+            if self.backend.blocking:
+                import anyio
+
+                return await anyio.to_thread.run_sync(fn, *args)
+            return fn(*args)
+
+        key, value = await call(self._lookup, endpoint, field_id, sensor_types, params)
+        if value is not _MISSING:
+            return value
+        value = await compute()
+        if key is not None:
+            await call(self._store, key, value)
+        return value
+
+    def invalidate(self, pairs: Iterable[Tuple[int, str]]) -> None:
+        """Invalidate cached responses for each `(field_id, sensor_type)` in `pairs`."""
+        if self.backend is None:
+            return
+        names = {self._series(field_id, sensor_type) for field_id, sensor_type in pairs}
+        if not names:
+            return
+        try:
+            self.backend.bump(names)
+            self.invalidations += len(names)
+        except Exception:
+            logger.exception("Cache invalidation failed")
+            self.errors += 1
+
+    def clear(self) -> None:
+        if self.backend is not None:
+            self.backend.clear()
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "backend": type(self.backend).__name__ if self.backend is not None else None,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+            "invalidations": self.invalidations,
+            "errors": self.errors,
+            "entries": self.backend.size() if self.backend is not None else 0,
+        }
+
+
+def _backend_from_env():
+    if CACHE_BACKEND == "redis":
+        return RedisBackend()
+    if CACHE_BACKEND == "memory":
+        return MemoryBackend()
+    return None
+
+
+cache = ResponseCache(_backend_from_env())
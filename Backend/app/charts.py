@@ -0,0 +1,130 @@
+import math
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy.orm import Session
+
+from . import crud, retention, rollups
+
+DEFAULT_MAX_POINTS = 1000
+DEFAULT_SENSOR_TYPES = ["temperature", "soil_moisture"]
+
+
+def bucket_seconds(hours: int, max_points: int = DEFAULT_MAX_POINTS, resolution: Optional[int] = None) -> int:
+    """
+    Width of a chart bucket in seconds: `resolution` when given, otherwise the
+    smallest width that fits the window into `max_points`, rounded up to whole
+    days, hours or minutes once it is that wide so the buckets can be filled
+    from the matching rollup tier.
+    """
+    if resolution:
+        return resolution
+    width = max(1, math.ceil(hours * 3600 / max_points))
+    for tier in reversed(rollups.TIERS):
+        unit = int(tier.width.total_seconds())
+        if width >= unit:
+            return math.ceil(width / unit) * unit
+    return width
+
+
+def _bucket_stats(
+    db: Session,
+    field_id: int,
+    sensor_types: Sequence[str],
+    start_time: datetime,
+    end_time: datetime,
+    width: int,
+) -> Tuple[datetime, Dict[int, Dict[str, list]]]:
+    """
+    Return the bucket origin and `[sum, count, min, max]` per bucket index and
+    sensor type.
+
+    When `width` is a whole number of minutes, hours or days, buckets are
+    aligned to the coarsest such rollup tier and filled from up-to-date
+    rollup rows, with raw readings only for the edges and dirty hours (see
+    `rollups.plan_ranges`). Each source is one query over all sensor types.
+    """
+    start_time, end_time = rollups.naive_utc(start_time), rollups.naive_utc(end_time)
+    tier = rollups.tier_for_width(width)
+    if tier is None:
+        origin, ranges, raw_intervals = start_time, {}, [(start_time, end_time, True)]
+    else:
+        origin = rollups.floor_to(start_time, tier.width)
+        watermarks = rollups.get_watermarks(db)
+        dirty = rollups.dirty_hours(db, field_id, sensor_types, start_time, end_time) if any(watermarks.values()) else set()
+        tiers = rollups.TIERS[:rollups.TIERS.index(tier) + 1]
+        ranges, raw_intervals = rollups.plan_ranges(
+            start_time, end_time, watermarks, dirty, tiers, horizons=retention.rollup_horizons()
+        )
+
+    queries = [
+        crud.get_bucketed_rollups_for_chart(db, tier, field_id, sensor_types, origin, width, ranges[tier.name])
+        for tier in rollups.TIERS if ranges.get(tier.name)
+    ]
+    if raw_intervals:
+        queries.append(crud.get_bucketed_readings_for_chart(db, field_id, sensor_types, origin, width, raw_intervals))
+
+    buckets: Dict[int, Dict[str, list]] = {}
+    for query in queries:
+        for bucket, sensor_type, total, count, min_value, max_value in query:
+            stats = buckets.setdefault(bucket, {}).get(sensor_type)
+            if stats is None:
+                buckets[bucket][sensor_type] = [total, count, min_value, max_value]
+            else:
+                stats[0] += total
+                stats[1] += count
+                stats[2] = min(stats[2], min_value)
+                stats[3] = max(stats[3], max_value)
+    return origin, buckets
+
+
+def get_chart_data(
+    db: Session,
+    field_id: int,
+    sensor_types: Sequence[str],
+    start_time: datetime,
+    end_time: datetime,
+    width: int,
+) -> List[Dict]:
+    """
+    Build chart rows with one point per time bucket, ordered by bucket start.
+    Each row carries the bucket average under the sensor type name plus
+    `<sensor_type>_min` / `<sensor_type>_max`.
+    """
+    origin, buckets = _bucket_stats(db, field_id, sensor_types, start_time, end_time, width)
+    chart_data = []
+    for bucket in sorted(buckets):
+        ts = origin + timedelta(seconds=bucket * width)
+        point = {'time': ts.strftime('%H:%M'), 'timestamp': ts.isoformat()}
+        for sensor_type in sorted(buckets[bucket]):
+            total, count, min_value, max_value = buckets[bucket][sensor_type]
+            point[sensor_type] = total / count
+            point[f'{sensor_type}_min'] = min_value
+            point[f'{sensor_type}_max'] = max_value
+        chart_data.append(point)
+    return chart_data
+
+
+def get_chart_columns(
+    db: Session,
+    field_id: int,
+    sensor_types: Sequence[str],
+    start_time: datetime,
+    end_time: datetime,
+    width: int,
+) -> Dict[str, list]:
+    """
+    Columnar variant of `get_chart_data`: `t` holds the bucket starts in Unix
+    seconds, and `<sensor_type>`, `<sensor_type>_min` and `<sensor_type>_max`
+    one value per bucket, None where that sensor has no readings.
+    """
+    origin, buckets = _bucket_stats(db, field_id, sensor_types, start_time, end_time, width)
+    order = sorted(buckets)
+    offset = int((origin - crud.EPOCH).total_seconds())
+    columns = {'t': [offset + bucket * width for bucket in order]}
+    for sensor_type in sorted({sensor_type for stats in buckets.values() for sensor_type in stats}):
+        series = [buckets[bucket].get(sensor_type) for bucket in order]
+        columns[sensor_type] = [stats[0] / stats[1] if stats else None for stats in series]
+        columns[f'{sensor_type}_min'] = [stats[2] if stats else None for stats in series]
+        columns[f'{sensor_type}_max'] = [stats[3] if stats else None for stats in series]
+    return columns
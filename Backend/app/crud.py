@@ -1,8 +1,13 @@
 
+import base64
+import json
+import math
 from sqlalchemy.orm import Session
-from sqlalchemy import func
-from . import models, schemas
+from sqlalchemy import func, and_, or_, cast, case, literal, select, union_all, Integer
+from . import events, models, retention, rollups, schemas
+from .cache import cache
 from datetime import datetime
+from typing import Iterator, Optional, Sequence, Tuple
 
 def get_sensor_reading(db: Session, reading_id: int):
     """Fetch a single sensor reading by its ID."""
@@ -12,8 +17,8 @@ def get_sensor_readings(db: Session, skip: int = 0, limit: int = 100):
     """Fetch a paginated list of sensor readings."""
     return db.query(models.SensorReading).offset(skip).limit(limit).all()
 
-def create_sensor_reading(db: Session, reading: schemas.SensorReadingCreate):
-    """Create a new sensor reading record in the database."""
+def insert_sensor_reading(db: Session, reading: schemas.SensorReadingCreate):
+    """Insert a sensor reading and mark its hour dirty for re-rollup, in one commit."""
     db_reading = models.SensorReading(
         field_id=reading.field_id,
         sensor_type=reading.sensor_type,
@@ -22,30 +27,216 @@ def create_sensor_reading(db: Session, reading: schemas.SensorReadingCreate):
         timestamp=reading.timestamp if reading.timestamp else datetime.utcnow()
     )
     db.add(db_reading)
+    rollups.mark_dirty(db, [(db_reading.field_id, db_reading.sensor_type, rollups.floor_hour(db_reading.timestamp))])
     db.commit()
     db.refresh(db_reading)
     return db_reading
 
-def get_analytics(db: Session, field_id: int, sensor_type: str, start_time: datetime, end_time: datetime):
+def reading_row(db_reading: models.SensorReading) -> dict:
+    """Column dict of a stored reading, as published to stream subscribers."""
+    return {
+        'field_id': db_reading.field_id,
+        'sensor_type': db_reading.sensor_type,
+        'value': db_reading.value,
+        'unit': db_reading.unit,
+        'timestamp': db_reading.timestamp,
+    }
+
+def notify_readings(rows: Sequence[dict]) -> None:
+    """Invalidate cached responses for the series of `rows` and publish them to stream subscribers."""
+    cache.invalidate({(row['field_id'], row['sensor_type']) for row in rows})
+    events.publish_readings(rows)
+
+def create_sensor_reading(db: Session, reading: schemas.SensorReadingCreate):
+    """Create a new sensor reading record in the database."""
+    db_reading = insert_sensor_reading(db, reading)
+    notify_readings([reading_row(db_reading)])
+    return db_reading
+
+def _in_intervals(column, intervals):
+    """Filter matching `column` in any of the `(start, end, end_inclusive)` intervals."""
+    return or_(*(
+        and_(column >= start, column <= end if inclusive else column < end)
+        for start, end, inclusive in intervals
+    ))
+
+def _raw_aggregates(db: Session, field_id: int, sensor_type: str, intervals):
     """
-    Fetch aggregated analytics for a specific field and sensor type within a time range.
+    Aggregate raw readings over a list of `(start, end, end_inclusive)` intervals
+    in a single query, returning min, max, sum, count and sum of squares.
     """
-    result = db.query(
-        func.min(models.SensorReading.value).label("min"),
-        func.max(models.SensorReading.value).label("max"),
-        func.avg(models.SensorReading.value).label("avg"),
-        func.count(models.SensorReading.id).label("count")
+    value = models.SensorReading.value
+    row = db.query(
+        func.min(value).label("min"),
+        func.max(value).label("max"),
+        func.sum(value).label("sum"),
+        func.count(models.SensorReading.id).label("count"),
+        func.sum(value * value).label("sum_sq")
     ).filter(
         models.SensorReading.field_id == field_id,
         models.SensorReading.sensor_type == sensor_type,
-        models.SensorReading.timestamp >= start_time,
-        models.SensorReading.timestamp <= end_time
+        _in_intervals(models.SensorReading.timestamp, intervals)
     ).first()
+    return row.min, row.max, row.sum, row.count, row.sum_sq
 
-    if not result or result.count == 0:
+def _rollup_aggregates(db: Session, tier: rollups.Tier, field_id: int, sensor_type: str, ranges):
+    """
+    Combine the `tier` rollup rows in `[start, end)` bucket ranges in a single
+    query. The sum of squares is None if any row predates it.
+    """
+    rollup = tier.model
+    row = db.query(
+        func.min(rollup.min_value).label("min"),
+        func.max(rollup.max_value).label("max"),
+        func.sum(func.coalesce(rollup.sum_value, rollup.avg_value * rollup.reading_count)).label("sum"),
+        func.sum(rollup.reading_count).label("count"),
+        func.sum(rollup.sum_sq_value).label("sum_sq"),
+        func.count(rollup.sum_sq_value).label("sum_sq_rows"),
+        func.count(rollup.id).label("rows")
+    ).filter(
+        rollup.field_id == field_id,
+        rollup.sensor_type == sensor_type,
+        rollup.reading_count > 0,
+        _in_intervals(tier.bucket, [(start, end, False) for start, end in ranges])
+    ).first()
+    return row.min, row.max, row.sum, row.count, row.sum_sq if row.sum_sq_rows == row.rows else None
+
+def get_analytics(db: Session, field_id: int, sensor_type: str, start_time: datetime, end_time: datetime):
+    """
+    Fetch aggregated analytics for a specific field and sensor type within a time range.
+
+    The range is covered by up-to-date rollup buckets of the coarsest tier
+    that fits (days, then hours, then minutes; see `rollups.plan_ranges`), so
+    only the partial minutes at either edge and any dirty hours are
+    aggregated from raw readings.
+    """
+    start_time, end_time = rollups.naive_utc(start_time), rollups.naive_utc(end_time)
+    watermarks = rollups.get_watermarks(db)
+    dirty = rollups.dirty_hours(db, field_id, [sensor_type], start_time, end_time) if any(watermarks.values()) else set()
+    ranges, raw_intervals = rollups.plan_ranges(
+        start_time, end_time, watermarks, dirty, horizons=retention.rollup_horizons()
+    )
+
+    parts = [
+        _rollup_aggregates(db, tier, field_id, sensor_type, ranges[tier.name])
+        for tier in rollups.TIERS if ranges[tier.name]
+    ]
+    if raw_intervals:
+        parts.append(_raw_aggregates(db, field_id, sensor_type, raw_intervals))
+    parts = [part for part in parts if part[3]]
+
+    count = sum(part[3] for part in parts)
+    if count == 0:
         return None
-        
-    return result
+
+    total = sum(part[2] for part in parts)
+    avg = total / count
+    stddev = None
+    if all(part[4] is not None for part in parts):
+        stddev = math.sqrt(max(sum(part[4] for part in parts) / count - avg * avg, 0.0))
+    return schemas.AnalyticsData(
+        min=min(part[0] for part in parts),
+        max=max(part[1] for part in parts),
+        avg=avg,
+        stddev=stddev,
+        count=count
+    )
+
+def _series_filters(model, field_ids, sensor_types):
+    filters = []
+    if field_ids is not None:
+        filters.append(model.field_id.in_(field_ids))
+    if sensor_types is not None:
+        filters.append(model.sensor_type.in_(sensor_types))
+    return filters
+
+def get_fleet_analytics(
+    db: Session,
+    field_ids: Optional[Sequence[int]],
+    sensor_types: Optional[Sequence[str]],
+    start_time: datetime,
+    end_time: datetime,
+    yield_per: int = 1000
+) -> Iterator[schemas.SeriesAnalytics]:
+    """
+    Aggregate every (field_id, sensor_type) series of the given fields and
+    sensor types (None: all) within a time range, ordered by series.
+
+    The range is planned once for all series as in `get_analytics`, with the
+    dirty hours of any of them sent to raw readings. The rollup rows and raw
+    readings of every part are combined with UNION ALL and aggregated by a
+    single GROUP BY, whose rows are streamed.
+    """
+    start_time, end_time = rollups.naive_utc(start_time), rollups.naive_utc(end_time)
+    watermarks = rollups.get_watermarks(db)
+    dirty = (
+        rollups.fleet_dirty_hours(db, field_ids, sensor_types, start_time, end_time)
+        if any(watermarks.values()) else set()
+    )
+    ranges, raw_intervals = rollups.plan_ranges(
+        start_time, end_time, watermarks, dirty, horizons=retention.rollup_horizons()
+    )
+
+    parts = []
+    for tier in rollups.TIERS:
+        if not ranges[tier.name]:
+            continue
+        rollup = tier.model
+        parts.append(select(
+            rollup.field_id,
+            rollup.sensor_type,
+            rollup.min_value.label("min"),
+            rollup.max_value.label("max"),
+            func.coalesce(rollup.sum_value, rollup.avg_value * rollup.reading_count).label("sum"),
+            rollup.reading_count.label("count"),
+            rollup.sum_sq_value.label("sum_sq"),
+            case((rollup.sum_sq_value.is_(None), 0), else_=1).label("has_sum_sq")
+        ).where(
+            rollup.reading_count > 0,
+            _in_intervals(tier.bucket, [(start, end, False) for start, end in ranges[tier.name]]),
+            *_series_filters(rollup, field_ids, sensor_types)
+        ))
+    if raw_intervals:
+        reading = models.SensorReading
+        parts.append(select(
+            reading.field_id,
+            reading.sensor_type,
+            reading.value.label("min"),
+            reading.value.label("max"),
+            reading.value.label("sum"),
+            literal(1).label("count"),
+            (reading.value * reading.value).label("sum_sq"),
+            literal(1).label("has_sum_sq")
+        ).where(
+            _in_intervals(reading.timestamp, raw_intervals),
+            *_series_filters(reading, field_ids, sensor_types)
+        ))
+
+    if not parts:
+        return
+    combined = union_all(*parts).subquery() if len(parts) > 1 else parts[0].subquery()
+    stmt = select(
+        combined.c.field_id,
+        combined.c.sensor_type,
+        func.min(combined.c.min),
+        func.max(combined.c.max),
+        func.sum(combined.c.sum),
+        func.sum(combined.c.count),
+        func.sum(combined.c.sum_sq),
+        func.min(combined.c.has_sum_sq)
+    ).group_by(
+        combined.c.field_id, combined.c.sensor_type
+    ).order_by(
+        combined.c.field_id, combined.c.sensor_type
+    ).execution_options(yield_per=yield_per)
+
+    for field_id, sensor_type, min_value, max_value, total, count, sum_sq, has_sum_sq in db.execute(stmt):
+        avg = total / count
+        stddev = math.sqrt(max(sum_sq / count - avg * avg, 0.0)) if has_sum_sq else None
+        yield schemas.SeriesAnalytics(
+            field_id=field_id, sensor_type=sensor_type,
+            min=min_value, max=max_value, avg=avg, stddev=stddev, count=count
+        )
 
 def get_readings_for_chart(db: Session, field_id: int, sensor_type: str, start_time: datetime, end_time: datetime):
     """
@@ -62,3 +253,136 @@ def get_readings_for_chart(db: Session, field_id: int, sensor_type: str, start_t
     ).order_by(
         models.SensorReading.timestamp.asc()
     ).all()
+
+EPOCH = datetime(1970, 1, 1)
+
+def _epoch_seconds(db: Session, column):
+    """SQL expression for the seconds since the Unix epoch of a naive UTC timestamp column."""
+    dialect = db.get_bind().dialect.name
+    if dialect == 'postgresql':
+        return func.extract('epoch', column)
+    if dialect == 'sqlite':
+        # Whole seconds: julianday() arithmetic lands just below bucket boundaries.
+        return cast(func.strftime('%s', column), Integer)
+    return func.unix_timestamp(column)
+
+def _bucket_index(db: Session, column, start_time: datetime, bucket_seconds: int):
+    """SQL expression numbering `bucket_seconds`-wide buckets from `start_time` onwards."""
+    offset = (_epoch_seconds(db, column) - (start_time - EPOCH).total_seconds()) / bucket_seconds
+    if db.get_bind().dialect.name == 'sqlite':
+        return cast(offset, Integer)
+    return cast(func.floor(offset), Integer)
+
+def get_bucketed_readings_for_chart(
+    db: Session, field_id: int, sensor_types: Sequence[str], origin: datetime, bucket_seconds: int, intervals
+):
+    """
+    Fetch per-bucket sum, count, min and max of several sensors from raw readings
+    in `(start, end, end_inclusive)` intervals in one query, ordered by bucket and
+    then sensor type. Buckets are `bucket_seconds` wide and numbered from `origin`.
+    """
+    bucket = _bucket_index(db, models.SensorReading.timestamp, origin, bucket_seconds).label("bucket")
+    return db.query(
+        bucket,
+        models.SensorReading.sensor_type,
+        func.sum(models.SensorReading.value).label("sum"),
+        func.count(models.SensorReading.id).label("count"),
+        func.min(models.SensorReading.value).label("min"),
+        func.max(models.SensorReading.value).label("max")
+    ).filter(
+        models.SensorReading.field_id == field_id,
+        models.SensorReading.sensor_type.in_(sensor_types),
+        _in_intervals(models.SensorReading.timestamp, intervals)
+    ).group_by(
+        bucket,
+        models.SensorReading.sensor_type
+    ).order_by(
+        bucket,
+        models.SensorReading.sensor_type
+    )
+
+def get_bucketed_rollups_for_chart(
+    db: Session, tier: rollups.Tier, field_id: int, sensor_types: Sequence[str], origin: datetime, bucket_seconds: int, ranges
+):
+    """
+    Like `get_bucketed_readings_for_chart`, but combining the `tier` rollup rows
+    in `[start, end)` bucket ranges. `bucket_seconds` must be a multiple of the
+    tier width and `origin` aligned to it, so every rollup bucket falls in one
+    chart bucket.
+    """
+    rollup = tier.model
+    bucket = _bucket_index(db, tier.bucket, origin, bucket_seconds).label("bucket")
+    return db.query(
+        bucket,
+        rollup.sensor_type,
+        func.sum(func.coalesce(rollup.sum_value, rollup.avg_value * rollup.reading_count)).label("sum"),
+        func.sum(rollup.reading_count).label("count"),
+        func.min(rollup.min_value).label("min"),
+        func.max(rollup.max_value).label("max")
+    ).filter(
+        rollup.field_id == field_id,
+        rollup.sensor_type.in_(sensor_types),
+        rollup.reading_count > 0,
+        _in_intervals(tier.bucket, [(start, end, False) for start, end in ranges])
+    ).group_by(
+        bucket,
+        rollup.sensor_type
+    ).order_by(
+        bucket,
+        rollup.sensor_type
+    )
+
+def get_readings_page(
+    db: Session,
+    field_id: int = None,
+    sensor_type: str = None,
+    start_time: datetime = None,
+    end_time: datetime = None,
+    after: tuple = None,
+    limit: int = 100
+):
+    """
+    Fetch up to `limit` readings ordered by `(timestamp, id)`, optionally filtered
+    by field, sensor type and time range.
+
+    Pagination is by keyset: pass the `(timestamp, id)` of the last row of a page
+    as `after` to get the next one, so every page costs the same as the first.
+    """
+    reading = models.SensorReading
+    query = db.query(
+        reading.id,
+        reading.field_id,
+        reading.sensor_type,
+        reading.value,
+        reading.unit,
+        reading.timestamp
+    )
+    if field_id is not None:
+        query = query.filter(reading.field_id == field_id)
+    if sensor_type is not None:
+        query = query.filter(reading.sensor_type == sensor_type)
+    if start_time is not None:
+        query = query.filter(reading.timestamp >= start_time)
+    if end_time is not None:
+        query = query.filter(reading.timestamp <= end_time)
+    if after is not None:
+        after_timestamp, after_id = after
+        query = query.filter(or_(
+            reading.timestamp > after_timestamp,
+            and_(reading.timestamp == after_timestamp, reading.id > after_id)
+        ))
+    return query.order_by(reading.timestamp.asc(), reading.id.asc()).limit(limit)
+
+def encode_cursor(timestamp: datetime, reading_id: int) -> str:
+    """Encode a `(timestamp, id)` keyset position as an opaque URL-safe token."""
+    raw = json.dumps([timestamp.isoformat(), reading_id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """Decode a token from `encode_cursor`; raises ValueError if it is malformed."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        timestamp, reading_id = json.loads(raw)
+        return datetime.fromisoformat(timestamp), int(reading_id)
+    except (TypeError, ValueError) as e:
+        raise ValueError("Invalid cursor") from e
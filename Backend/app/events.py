@@ -0,0 +1,195 @@
+"""
+Push channel for dashboards: newly ingested readings and task progress.
+
+Writers publish JSON messages to a channel per field (`field:<id>`) or per
+Celery task (`task:<id>`), and `GET /api/v1/stream` relays them to browsers
+as Server-Sent Events. The Redis broker fans out across API and worker
+processes; the in-memory broker only reaches subscribers in the same
+process. Publishing never raises, so a broker outage can't fail an ingest.
+"""
+import asyncio
+import json
+import logging
+import os
+import threading
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from typing import Dict, Iterable, List, Optional, Sequence, Set
+
+logger = logging.getLogger(__name__)
+
+EVENTS_BACKEND = os.getenv("EVENTS_BACKEND", "memory")
+EVENTS_REDIS_URL = os.getenv("EVENTS_REDIS_URL", "redis://redis:6379/2")
+EVENTS_MAX_READINGS = int(os.getenv("EVENTS_MAX_READINGS", "100"))
+EVENTS_QUEUE_SIZE = int(os.getenv("EVENTS_QUEUE_SIZE", "1000"))
+EVENTS_HEARTBEAT_SECONDS = float(os.getenv("EVENTS_HEARTBEAT_SECONDS", "15"))
+
+
+def field_channel(field_id: int) -> str:
+    return f"field:{field_id}"
+
+
+def task_channel(task_id: str) -> str:
+    return f"task:{task_id}"
+
+
+class Subscription:
+    """
+    Bounded queue of messages for one stream client. When a slow client
+    falls EVENTS_QUEUE_SIZE messages behind, the oldest ones are dropped.
+    """
+
+    def __init__(self, queue_size: int = EVENTS_QUEUE_SIZE):
+        self.loop = asyncio.get_running_loop()
+        self.queue: "asyncio.Queue[Dict]" = asyncio.Queue(maxsize=queue_size)
+        self.dropped = 0
+
+    def put(self, message: Dict) -> None:
+        """Queue a message; must be called on the subscription's event loop."""
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(message)
+
+    async def get(self, timeout: float) -> Optional[Dict]:
+        """Wait up to `timeout` seconds for the next message; None on timeout."""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class MemoryBroker:
+    """In-process broker; `publish` may be called from any thread."""
+
+    def __init__(self):
+        self._subscriptions: Dict[str, Set[Subscription]] = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def publish(self, channel: str, message: Dict) -> None:
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(channel, ()))
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.put, message)
+            except RuntimeError:
+                pass  # the subscriber's loop has closed
+
+    @asynccontextmanager
+    async def subscribe(self, channels: Sequence[str]):
+        subscription = Subscription()
+        with self._lock:
+            for channel in channels:
+                self._subscriptions[channel].add(subscription)
+        try:
+            yield subscription
+        finally:
+            with self._lock:
+                for channel in channels:
+                    self._subscriptions[channel].discard(subscription)
+                    if not self._subscriptions[channel]:
+                        del self._subscriptions[channel]
+
+
+class RedisBroker:
+    """Redis pub/sub broker shared by every API and worker process."""
+
+    prefix = "field_insights:events:"
+
+    def __init__(self, url: str = EVENTS_REDIS_URL):
+        import redis
+
+        self.url = url
+        self.client = redis.Redis.from_url(url)
+
+    def publish(self, channel: str, message: Dict) -> None:
+        self.client.publish(self.prefix + channel, json.dumps(message))
+
+    @asynccontextmanager
+    async def subscribe(self, channels: Sequence[str]):
+        import redis.asyncio
+
+        client = redis.asyncio.Redis.from_url(self.url)
+        pubsub = client.pubsub(ignore_subscribe_messages=True)
+        await pubsub.subscribe(*(self.prefix + channel for channel in channels))
+        subscription = Subscription()
+
+        async def relay():
+            async for raw in pubsub.listen():
+                subscription.put(json.loads(raw["data"]))
+
+        relay_task = asyncio.create_task(relay())
+        try:
+            yield subscription
+        finally:
+            relay_task.cancel()
+            await pubsub.aclose()
+            await client.aclose()
+
+
+def publish(channel: str, message: Dict) -> None:
+    if broker is None:
+        return
+    try:
+        broker.publish(channel, message)
+    except Exception:
+        logger.exception("Publishing event to %s failed", channel)
+
+
+def publish_readings(rows: Iterable[Dict]) -> None:
+    """
+    Publish newly written readings to their field channels. Up to
+    EVENTS_MAX_READINGS readings per field are sent in full; larger writes
+    (bulk imports) send a summary so clients refetch instead.
+    """
+    if broker is None:
+        return
+    by_field: Dict[int, List[Dict]] = defaultdict(list)
+    for row in rows:
+        by_field[row['field_id']].append(row)
+    for field_id, field_rows in by_field.items():
+        if len(field_rows) <= EVENTS_MAX_READINGS:
+            message = {
+                "type": "readings",
+                "field_id": field_id,
+                "readings": [
+                    {
+                        "sensor_type": row['sensor_type'],
+                        "value": row['value'],
+                        "unit": row['unit'],
+                        "timestamp": row['timestamp'].isoformat(),
+                    }
+                    for row in field_rows
+                ],
+            }
+        else:
+            timestamps = [row['timestamp'] for row in field_rows]
+            message = {
+                "type": "readings_summary",
+                "field_id": field_id,
+                "count": len(field_rows),
+                "sensor_types": sorted({row['sensor_type'] for row in field_rows}),
+                "start": min(timestamps).isoformat(),
+                "end": max(timestamps).isoformat(),
+            }
+        publish(field_channel(field_id), message)
+
+
+def publish_task(task_id: str, state: str, meta: Optional[Dict] = None) -> None:
+    """Publish a Celery task state change (e.g. PROGRESS, SUCCESS) to its task channel."""
+    publish(task_channel(task_id), {"type": "task", "task_id": task_id, "state": state, "result": meta})
+
+
+def format_sse(message: Dict) -> str:
+    return f"event: {message['type']}\ndata: {json.dumps(message)}\n\n"
+
+
+def _broker_from_env():
+    if EVENTS_BACKEND == "redis":
+        return RedisBroker()
+    if EVENTS_BACKEND == "memory":
+        return MemoryBroker()
+    return None
+
+
+broker = _broker_from_env()
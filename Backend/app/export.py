@@ -0,0 +1,156 @@
+"""
+Streaming export of raw readings as CSV, Arrow IPC or Parquet.
+
+Readings are read in keyset pages (see `crud.get_readings_page`) and each
+page is encoded and sent before the next one is fetched, so memory use is
+bounded by EXPORT_PAGE_SIZE however large the export is. Arrow and Parquet
+need the optional `pyarrow` package.
+"""
+import csv
+import importlib.util
+import io
+import os
+from datetime import datetime
+from typing import Iterator, List, Optional
+
+from sqlalchemy.orm import Session
+
+from . import crud
+
+EXPORT_PAGE_SIZE = int(os.getenv("EXPORT_PAGE_SIZE", "10000"))
+
+COLUMNS = ("id", "field_id", "sensor_type", "value", "unit", "timestamp")
+
+
+def iter_pages(
+    db: Session,
+    field_id: int = None,
+    sensor_type: str = None,
+    start_time: datetime = None,
+    end_time: datetime = None,
+    page_size: Optional[int] = None
+) -> Iterator[List]:
+    """
+    Yield the matching readings page by page, ordered by `(timestamp, id)`.
+    Each page runs in its own short read transaction.
+    """
+    page_size = page_size or EXPORT_PAGE_SIZE
+    after = None
+    while True:
+        rows = crud.get_readings_page(
+            db, field_id, sensor_type, start_time, end_time, after=after, limit=page_size
+        ).all()
+        db.rollback()
+        if not rows:
+            return
+        yield rows
+        if len(rows) < page_size:
+            return
+        after = (rows[-1].timestamp, rows[-1].id)
+
+
+def iter_csv(pages: Iterator[List]) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMNS)
+    for rows in pages:
+        writer.writerows(
+            (row.id, row.field_id, row.sensor_type, row.value, row.unit, row.timestamp.isoformat())
+            for row in rows
+        )
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+class _ChunkSink:
+    """Write-only file object whose contents are handed out with `drain()`."""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def arrow_available() -> bool:
+    return importlib.util.find_spec("pyarrow") is not None
+
+
+def _arrow_schema():
+    import pyarrow as pa
+
+    return pa.schema([
+        ("id", pa.int64()),
+        ("field_id", pa.int64()),
+        ("sensor_type", pa.string()),
+        ("value", pa.float64()),
+        ("unit", pa.string()),
+        ("timestamp", pa.timestamp("us")),
+    ])
+
+
+def _record_batch(rows, schema):
+    import pyarrow as pa
+
+    columns = list(zip(*rows))
+    return pa.RecordBatch.from_arrays(
+        [pa.array(column, type=field.type) for column, field in zip(columns, schema)],
+        schema=schema,
+    )
+
+
+def iter_arrow(pages: Iterator[List]) -> Iterator[bytes]:
+    """Encode pages as an Arrow IPC stream, one record batch per page."""
+    import pyarrow as pa
+
+    schema = _arrow_schema()
+    sink = _ChunkSink()
+    with pa.ipc.new_stream(sink, schema) as writer:
+        for rows in pages:
+            writer.write_batch(_record_batch(rows, schema))
+            yield sink.drain()
+    yield sink.drain()
+
+
+def iter_parquet(pages: Iterator[List]) -> Iterator[bytes]:
+    """Encode pages as a Parquet file, one row group per page."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = _arrow_schema()
+    sink = _ChunkSink()
+    with pq.ParquetWriter(sink, schema, compression="zstd") as writer:
+        for rows in pages:
+            writer.write_table(pa.Table.from_batches([_record_batch(rows, schema)]))
+            yield sink.drain()
+    yield sink.drain()
+
+
+# format -> (media type, file extension, encoder, needs pyarrow)
+FORMATS = {
+    "csv": ("text/csv", "csv", iter_csv, False),
+    "arrow": ("application/vnd.apache.arrow.stream", "arrows", iter_arrow, True),
+    "parquet": ("application/vnd.apache.parquet", "parquet", iter_parquet, True),
+}
@@ -0,0 +1,349 @@
+import codecs
+import csv
+import io
+import logging
+import os
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from itertools import islice
+from typing import BinaryIO, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+from . import database, events, models, rollups, schemas
+from .cache import cache
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "5000"))
+USE_COPY = os.getenv("INGEST_USE_COPY", "1") == "1"
+PROGRESS_EVERY_ROWS = int(os.getenv("PROGRESS_EVERY_ROWS", "20000"))
+PROGRESS_EVERY_SECONDS = float(os.getenv("PROGRESS_EVERY_SECONDS", "2.0"))
+MAX_REPORTED_ERRORS = 100
+
+READING_COLUMNS = ("field_id", "sensor_type", "value", "unit", "timestamp")
+
+
+@dataclass
+class IngestResult:
+    """Summary of a single ingestion run."""
+    rows: int = 0
+    rejected: int = 0
+    batches: int = 0
+    elapsed: float = 0.0
+    errors: List[str] = field(default_factory=list)
+
+    @property
+    def rows_per_sec(self) -> float:
+        return self.rows / self.elapsed if self.elapsed > 0 else float(self.rows)
+
+    def reject(self, line: int, error: Exception) -> None:
+        self.rejected += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append(f"Row {line}: {error}")
+
+    def summary(self) -> Dict:
+        return {
+            'rows_accepted': self.rows,
+            'rows_rejected': self.rejected,
+            'rows_per_sec': round(self.rows_per_sec, 1),
+            'elapsed': round(self.elapsed, 3),
+            'errors': self.errors,
+        }
+
+
+class ByteCountingLines:
+    """
+    Iterate the decoded lines of a binary stream while counting the bytes
+    consumed, so progress can be reported from the file offset in one pass.
+    """
+
+    def __init__(self, stream: BinaryIO, encoding: str = 'utf-8-sig'):
+        self.stream = stream
+        self.bytes_read = 0
+        self._decoder = codecs.getincrementaldecoder(encoding)()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> str:
+        line = next(self.stream)
+        self.bytes_read += len(line)
+        return self._decoder.decode(line)
+
+
+class ByteRangeLines(ByteCountingLines):
+    """Iterate the lines that start inside `[start, end)` of a seekable binary stream."""
+
+    def __init__(self, stream: BinaryIO, start: int, end: int, encoding: str = 'utf-8-sig'):
+        super().__init__(stream, encoding)
+        self.remaining = end - start
+        stream.seek(start)
+
+    def __next__(self) -> str:
+        if self.bytes_read >= self.remaining:
+            raise StopIteration
+        return super().__next__()
+
+
+def _count_lines(f: BinaryIO, start: int, end: int, block_size: int = 1024 * 1024) -> int:
+    f.seek(start)
+    count = 0
+    remaining = end - start
+    while remaining > 0:
+        block = f.read(min(block_size, remaining))
+        if not block:
+            break
+        count += block.count(b'\n')
+        remaining -= len(block)
+    return count
+
+
+def plan_chunks(path: str, chunk_bytes: int) -> Tuple[List[str], List[Tuple[int, int, int]]]:
+    """
+    Split a CSV file into byte ranges of roughly `chunk_bytes`, each ending on
+    a line boundary, and return the header fieldnames alongside
+    `(start, end, first_line)` ranges, where `first_line` is the file line
+    number of the range's first row.
+
+    Quoted values spanning several lines are not supported across a boundary.
+    """
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        header = f.readline()
+        fieldnames = next(csv.reader([header.decode('utf-8-sig')]))
+        ranges = []
+        start = len(header)
+        line = 2
+        while start < size:
+            end = min(start + chunk_bytes, size)
+            if end < size:
+                f.seek(end)
+                f.readline()
+                end = f.tell()
+            ranges.append((start, end, line))
+            line += _count_lines(f, start, end)
+            start = end
+    return fieldnames, ranges
+
+
+class ProgressThrottle:
+    """Decide whether enough rows or time have passed to publish progress again."""
+
+    def __init__(self, every_rows: Optional[int] = None, every_seconds: Optional[float] = None):
+        self.every_rows = every_rows if every_rows is not None else PROGRESS_EVERY_ROWS
+        self.every_seconds = every_seconds if every_seconds is not None else PROGRESS_EVERY_SECONDS
+        self._last_rows = 0
+        self._last_time = time.monotonic()
+
+    def due(self, rows: int) -> bool:
+        now = time.monotonic()
+        if rows - self._last_rows >= self.every_rows or now - self._last_time >= self.every_seconds:
+            self._last_rows = rows
+            self._last_time = now
+            return True
+        return False
+
+
+def parse_row(row: Dict[str, str]) -> Dict:
+    """
+    Convert one CSV row into a column dict for `sensor_readings`.
+
+    The common case is handled without building a Pydantic model; anything
+    unusual (e.g. a non-ISO timestamp) falls back to `SensorReadingCreate`
+    so the accepted formats stay the same as the single-reading endpoint.
+    """
+    timestamp_val = row.get('timestamp')
+    try:
+        timestamp = (
+            datetime.fromisoformat(timestamp_val.replace('Z', '+00:00'))
+            if timestamp_val else datetime.utcnow()
+        )
+        if timestamp.tzinfo is not None:
+            timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+        return {
+            'field_id': int(row['field_id']),
+            'sensor_type': row['sensor_type'],
+            'value': float(row['value']),
+            'unit': row['unit'],
+            'timestamp': timestamp,
+        }
+    except (TypeError, ValueError, AttributeError):
+        return reading_to_row(schemas.SensorReadingCreate(**{k: v for k, v in row.items() if v}))
+
+
+def reading_to_row(reading: schemas.SensorReadingCreate) -> Dict:
+    """Column dict for a validated reading, defaulting and normalising its timestamp to naive UTC."""
+    reading_dict = reading.model_dump()
+    if reading_dict['timestamp'] is None:
+        reading_dict['timestamp'] = datetime.utcnow()
+    elif reading_dict['timestamp'].tzinfo is not None:
+        reading_dict['timestamp'] = reading_dict['timestamp'].astimezone(timezone.utc).replace(tzinfo=None)
+    return reading_dict
+
+
+def iter_batches(
+    rows: Iterable[Dict],
+    batch_size: int,
+    on_error: Optional[Callable[[int, Exception], None]] = None,
+    first_line: int = 2,
+) -> Iterator[List[Dict]]:
+    """
+    Yield parsed readings from `rows` in lists of at most `batch_size`.
+
+    Invalid rows raise `ValueError` unless `on_error` is given, in which case
+    it is called with the CSV line number and the row is skipped. Rows are
+    numbered from `first_line`, the line of the first row in the whole file.
+    """
+    iterator = iter(rows)
+    line = first_line - 1
+    while True:
+        chunk = list(islice(iterator, batch_size))
+        if not chunk:
+            return
+        batch = []
+        for row in chunk:
+            line += 1
+            try:
+                batch.append(parse_row(row))
+            except Exception as e:
+                if on_error is None:
+                    raise ValueError(f"Row {line}: {e}") from e
+                on_error(line, e)
+        yield batch
+
+
+def upsert_fields(db: Session, field_ids: Iterable[int]) -> None:
+    """Make sure every id in `field_ids` exists in `fields`, in one statement."""
+    values = [{'id': field_id, 'name': f"Field {field_id}"} for field_id in sorted(set(field_ids))]
+    if not values:
+        return
+    dialect_insert = database.dialect_insert(db.get_bind())
+    if dialect_insert is None:
+        existing = {
+            field_id for (field_id,) in
+            db.query(models.Field.id).filter(models.Field.id.in_([v['id'] for v in values]))
+        }
+        missing = [v for v in values if v['id'] not in existing]
+        if missing:
+            db.execute(insert(models.Field.__table__), missing)
+        return
+    db.execute(dialect_insert(models.Field.__table__).values(values).on_conflict_do_nothing())
+
+
+def _copy_readings(db: Session, rows: List[Dict]) -> None:
+    """Stream `rows` into `sensor_readings` with Postgres COPY."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([row['field_id'], row['sensor_type'], row['value'], row['unit'], row['timestamp'].isoformat()])
+    buffer.seek(0)
+    cursor = db.connection().connection.cursor()
+    try:
+        cursor.copy_expert(
+            f"COPY {models.SensorReading.__tablename__} ({', '.join(READING_COLUMNS)}) FROM STDIN WITH (FORMAT csv)",
+            buffer,
+        )
+    finally:
+        cursor.close()
+
+
+def insert_readings(db: Session, rows: List[Dict]) -> None:
+    """
+    Write a batch of parsed readings without building ORM objects.
+
+    Uses COPY when running on psycopg2, otherwise a multi-row INSERT.
+    """
+    if not rows:
+        return
+    bind = db.get_bind()
+    if USE_COPY and bind.dialect.name == 'postgresql' and bind.dialect.driver == 'psycopg2':
+        _copy_readings(db, rows)
+    else:
+        db.execute(insert(models.SensorReading.__table__), rows)
+
+
+def write_batch(db: Session, batch: List[Dict]) -> None:
+    """
+    Write parsed readings in one transaction: upsert their fields, bulk insert
+    the readings, mark touched closed hours for re-rollup, then commit and
+    invalidate cached responses for the affected series and publish the new
+    readings to stream subscribers.
+    """
+    upsert_fields(db, (row['field_id'] for row in batch))
+    insert_readings(db, batch)
+    rollups.mark_rows_dirty(db, batch)
+    db.commit()
+    cache.invalidate({(row['field_id'], row['sensor_type']) for row in batch})
+    events.publish_readings(batch)
+
+
+def ingest_rows(
+    db: Session,
+    rows: Iterable[Dict[str, str]],
+    batch_size: Optional[int] = None,
+    on_batch: Optional[Callable[[IngestResult], None]] = None,
+    skip_invalid: bool = False,
+    first_line: int = 2,
+) -> IngestResult:
+    """
+    Ingest raw CSV-style rows in batches, committing once per batch.
+
+    Each batch upserts its referenced fields in one statement and writes all
+    of its readings in one bulk insert (see `write_batch`). `on_batch` is
+    called with the running totals after every commit. With `skip_invalid`,
+    malformed rows are counted as rejected instead of aborting the run.
+    """
+    batch_size = batch_size or DEFAULT_BATCH_SIZE
+    result = IngestResult()
+    started = time.perf_counter()
+    try:
+        for batch in iter_batches(
+            rows, batch_size, on_error=result.reject if skip_invalid else None, first_line=first_line
+        ):
+            write_batch(db, batch)
+            result.rows += len(batch)
+            result.batches += 1
+            if on_batch:
+                result.elapsed = time.perf_counter() - started
+                on_batch(result)
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        result.elapsed = time.perf_counter() - started
+    logger.info(
+        "Ingested %d readings (%d rejected) in %d batches (%.0f rows/sec)",
+        result.rows, result.rejected, result.batches, result.rows_per_sec,
+    )
+    return result
+
+
+def iter_lines(stream: BinaryIO, encoding: str = 'utf-8-sig') -> Iterator[str]:
+    """Decode a binary stream line by line so large files are never read whole, dropping any BOM."""
+    return codecs.iterdecode(stream, encoding)
+
+
+def ingest_csv(
+    db: Session,
+    stream: Iterable[str],
+    batch_size: Optional[int] = None,
+    on_batch: Optional[Callable[[IngestResult], None]] = None,
+    skip_invalid: bool = False,
+    fieldnames: Optional[Sequence[str]] = None,
+    first_line: int = 2,
+) -> IngestResult:
+    """
+    Ingest CSV text with a `field_id,sensor_type,value,unit[,timestamp]` header.
+
+    `stream` can be any iterable of lines (a text file, `iter_lines(...)`),
+    and is consumed incrementally. Pass `fieldnames` when the stream is a
+    chunk of a larger file and does not start with the header, and
+    `first_line` so reported row numbers refer to the whole file.
+    """
+    return ingest_rows(
+        db, csv.DictReader(stream, fieldnames=fieldnames), batch_size=batch_size,
+        on_batch=on_batch, skip_invalid=skip_invalid, first_line=first_line
+    )
@@ -0,0 +1,191 @@
+"""
+Prometheus instrumentation shared by the API and the worker.
+
+* `MetricsMiddleware` records per-route request latency for the API.
+* `instrument_sqlalchemy` times every SQL statement run by any engine,
+  counts the rows DML statements affect, and logs statements slower than
+  SLOW_QUERY_SECONDS with their parameters to the `app.slow_query` logger.
+* The worker records task runtime and queue wait with Celery signals
+  (see `Worker/tasks.py`) using the task metrics defined here.
+
+`render` produces the Prometheus text format. When several processes serve
+metrics (prefork Celery workers, multiple API workers), point
+PROMETHEUS_MULTIPROC_DIR at an empty directory shared by them and the
+exposition aggregates every process.
+"""
+import logging
+import os
+import time
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+slow_query_logger = logging.getLogger("app.slow_query")
+
+SLOW_QUERY_SECONDS = float(os.getenv("SLOW_QUERY_SECONDS", "0.5") or 0)
+SLOW_QUERY_LOG_PARAMETERS = os.getenv("SLOW_QUERY_LOG_PARAMETERS", "1") == "1"
+SLOW_QUERY_MAX_CHARS = int(os.getenv("SLOW_QUERY_MAX_CHARS", "2000"))
+MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+TASK_BUCKETS = (0.01, 0.1, 0.5, 1, 5, 15, 30, 60, 300, 900, 3600)
+
+CONTENT_TYPE = CONTENT_TYPE_LATEST
+
+# Collectors reading in-process state (cache, pools); never aggregated across processes.
+PROCESS_REGISTRY = CollectorRegistry()
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "HTTP request latency, until the response body is sent.",
+    ["method", "route", "status"], buckets=LATENCY_BUCKETS,
+)
+HTTP_REQUESTS_IN_PROGRESS = Gauge(
+    "http_requests_in_progress", "HTTP requests being served.", ["method"], multiprocess_mode="livesum",
+)
+DB_STATEMENT_SECONDS = Histogram(
+    "db_statement_duration_seconds", "SQL statement execution time.", ["operation"], buckets=LATENCY_BUCKETS,
+)
+DB_ROWS_AFFECTED = Counter("db_rows_affected", "Rows affected by INSERT, UPDATE and DELETE statements.", ["operation"])
+DB_SLOW_STATEMENTS = Counter("db_slow_statements", "Statements slower than SLOW_QUERY_SECONDS.", ["operation"])
+TASK_RUNTIME_SECONDS = Histogram(
+    "celery_task_runtime_seconds", "Celery task run time.", ["task", "state"], buckets=TASK_BUCKETS,
+)
+TASK_QUEUE_WAIT_SECONDS = Histogram(
+    "celery_task_queue_wait_seconds", "Time from publishing a Celery task to a worker starting it.",
+    ["task"], buckets=TASK_BUCKETS,
+)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware observing the latency of every HTTP request, labelled by
+    the matched route template rather than the raw path to keep cardinality low.
+    Streaming responses are timed until their last chunk is sent.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        method = scope["method"]
+        status = "500"
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = str(message["status"])
+            await send(message)
+
+        HTTP_REQUESTS_IN_PROGRESS.labels(method).inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_REQUESTS_IN_PROGRESS.labels(method).dec()
+            route = scope.get("route")
+            HTTP_REQUEST_SECONDS.labels(
+                method, getattr(route, "path", "unmatched"), status
+            ).observe(time.perf_counter() - started)
+
+
+def _operation(statement: str) -> str:
+    words = statement.lstrip().split(None, 1)
+    return words[0].upper() if words else "OTHER"
+
+
+def _truncate(value) -> str:
+    text = str(value)
+    return text if len(text) <= SLOW_QUERY_MAX_CHARS else text[:SLOW_QUERY_MAX_CHARS] + "..."
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._metrics_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "_metrics_started", None)
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    operation = _operation(statement)
+    DB_STATEMENT_SECONDS.labels(operation).observe(elapsed)
+    if operation in ("INSERT", "UPDATE", "DELETE") and cursor.rowcount and cursor.rowcount > 0:
+        DB_ROWS_AFFECTED.labels(operation).inc(cursor.rowcount)
+    if SLOW_QUERY_SECONDS and elapsed >= SLOW_QUERY_SECONDS:
+        DB_SLOW_STATEMENTS.labels(operation).inc()
+        slow_query_logger.warning(
+            "Slow query (%.3fs): %s; parameters: %s",
+            elapsed,
+            _truncate(" ".join(statement.split())),
+            _truncate(parameters) if SLOW_QUERY_LOG_PARAMETERS else "<hidden>",
+        )
+
+
+def instrument_sqlalchemy() -> None:
+    """Time the statements of every engine in this process, including the async engine's. Idempotent."""
+    if not event.contains(Engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+
+
+class StatsCollector:
+    """
+    Expose a `stats()`-style dict of numbers (cache, pools, buffers) as
+    gauges, or counters for the keys in `counters`. Nested dicts are
+    flattened into `<prefix>_<key>_<subkey>`; non-numeric values are skipped.
+    """
+
+    def __init__(self, prefix: str, stats, counters=()):
+        self.prefix = prefix
+        self.stats = stats
+        self.counters = set(counters)
+
+    def _flatten(self, stats: dict, prefix: str):
+        for key, value in stats.items():
+            if isinstance(value, dict):
+                yield from self._flatten(value, f"{prefix}_{key}")
+            elif isinstance(value, (int, float)) and not isinstance(value, bool):
+                yield f"{prefix}_{key}", key, value
+
+    def collect(self):
+        for name, key, value in self._flatten(self.stats() or {}, self.prefix):
+            family = CounterMetricFamily if key in self.counters else GaugeMetricFamily
+            yield family(name, f"{name.replace('_', ' ')} (per process)", value=value)
+
+
+def registry() -> CollectorRegistry:
+    """The metrics registry: every process's metrics in multiprocess mode, else this process's."""
+    if MULTIPROC_DIR:
+        from prometheus_client import multiprocess
+
+        aggregated = CollectorRegistry()
+        multiprocess.MultiProcessCollector(aggregated)
+        return aggregated
+    return REGISTRY
+
+
+def render() -> bytes:
+    """All metrics, plus this process's collectors, in the Prometheus text format."""
+    return generate_latest(registry()) + generate_latest(PROCESS_REGISTRY)
+
+
+def clear_multiprocess_dir() -> None:
+    """Remove metrics left in PROMETHEUS_MULTIPROC_DIR by earlier runs; call before any process records."""
+    if not MULTIPROC_DIR:
+        return
+    os.makedirs(MULTIPROC_DIR, exist_ok=True)
+    for name in os.listdir(MULTIPROC_DIR):
+        if name.endswith(".db"):
+            os.remove(os.path.join(MULTIPROC_DIR, name))
+
+
+def start_metrics_server(port: int) -> None:
+    """Serve the metrics registry over HTTP on `port` from a background thread."""
+    from prometheus_client import start_http_server
+
+    start_http_server(port, registry=registry())
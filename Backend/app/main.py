@@ -1,22 +1,53 @@
 import os
 import datetime
-import csv
-import io
-from fastapi import FastAPI, Depends, HTTPException, Query, UploadFile, File
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Body, Depends, HTTPException, Query, Request, UploadFile, File
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from typing import List, Dict
+from typing import Any, List, Dict
 
-from . import crud, models, schemas, database
+from . import crud, async_crud, models, schemas, database, ingest, migrations, charts, batch, buffer, export, events, advanced, instrumentation, responses, rollups
+from .cache import cache, window_end
 
+instrumentation.instrument_sqlalchemy()
 models.Base.metadata.create_all(bind=database.engine)
+migrations.run_migrations(database.engine)
+
+write_behind = buffer.WriteBehindBuffer(database.SessionLocal) if buffer.WRITE_BEHIND else None
+
+instrumentation.PROCESS_REGISTRY.register(
+    instrumentation.StatsCollector("cache", cache.stats, counters=("hits", "misses", "invalidations", "errors"))
+)
+instrumentation.PROCESS_REGISTRY.register(
+    instrumentation.StatsCollector("db_pool", database.process_pool_stats, counters=("checkouts", "timeouts"))
+)
+if write_behind is not None:
+    instrumentation.PROCESS_REGISTRY.register(instrumentation.StatsCollector(
+        "write_behind", write_behind.stats,
+        counters=("accepted", "rejected", "flushes", "failed_flushes", "flushed_rows"),
+    ))
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if write_behind is not None:
+        write_behind.start()
+    yield
+    if write_behind is not None:
+        write_behind.stop()
+
 
 app = FastAPI(
     title="Field Insights API",
     description="API for ingesting and analyzing sensor data from agricultural fields.",
     version="0.1.0",
+    lifespan=lifespan,
 )
 
+app.add_middleware(instrumentation.MetricsMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["http://localhost:5173"],
@@ -27,104 +58,230 @@ app.add_middleware(
 
 
 @app.get("/api/v1/readings/chart", tags=["readings"])
-def get_chart_data(
-    db: Session = Depends(database.get_db),
+async def get_chart_data(
+    request: Request,
+    db: AsyncSession = Depends(database.get_async_db),
     field_id: int = Query(1, description="ID of the field for chart data"),
-    hours: int = Query(24, description="Number of past hours to retrieve data for")
+    hours: int = Query(24, description="Number of past hours to retrieve data for"),
+    max_points: int = Query(charts.DEFAULT_MAX_POINTS, ge=1, le=10000, description="Maximum number of points to return"),
+    resolution: int = Query(None, ge=1, description="Bucket width in seconds; overrides max_points"),
+    sensor_types: List[str] = Query(charts.DEFAULT_SENSOR_TYPES, description="Sensor types to include"),
+    format: str = Query("columns", description="columns (one list per series, t in Unix seconds) or rows (one object per bucket)")
 ):
-    end_time = datetime.datetime.utcnow()
+    if format not in responses.FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported format. Choose one of: {', '.join(responses.FORMATS)}.")
+    end_time = window_end()
     start_time = end_time - datetime.timedelta(hours=hours)
+    width = charts.bucket_seconds(hours, max_points, resolution)
+    build = async_crud.get_chart_columns if format == "columns" else async_crud.get_chart_data
 
-    temp_readings = crud.get_readings_for_chart(db, field_id, "temperature", start_time, end_time)
-    moisture_readings = crud.get_readings_for_chart(db, field_id, "soil_moisture", start_time, end_time)
+    chart_data = await cache.aget_or_compute(
+        "chart", field_id, sensor_types, (start_time.isoformat(), end_time.isoformat(), width, format),
+        lambda: build(db, field_id, sensor_types, start_time, end_time, width)
+    )
+    return responses.json_response(request, chart_data)
 
-    combined_data: Dict[str, Dict] = {}
 
-    for ts, value in temp_readings:
-        time_key = ts.isoformat()
-        if time_key not in combined_data:
-            combined_data[time_key] = {'time': ts.strftime('%H:%M')}
-        combined_data[time_key]['temperature'] = value
+@app.get("/api/v1/readings", response_model=schemas.SensorReadingPage, tags=["readings"])
+async def list_readings(
+    request: Request,
+    db: AsyncSession = Depends(database.get_async_db),
+    field_id: int = Query(None),
+    sensor_type: str = Query(None),
+    start: datetime.datetime = Query(None),
+    end: datetime.datetime = Query(None),
+    limit: int = Query(100, ge=1, le=1000, description="Maximum number of readings per page"),
+    cursor: str = Query(None, description="next_cursor of the previous page"),
+    format: str = Query("rows", description="rows (items of readings) or columns (one list per column, t in Unix seconds)")
+):
+    if format not in responses.FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported format. Choose one of: {', '.join(responses.FORMATS)}.")
+    try:
+        after = crud.decode_cursor(cursor) if cursor else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
+    start = rollups.naive_utc(start) if start else None
+    end = rollups.naive_utc(end) if end else None
+    rows = await async_crud.get_readings_page(db, field_id, sensor_type, start, end, after=after, limit=limit + 1)
+    next_cursor = crud.encode_cursor(rows[limit - 1].timestamp, rows[limit - 1].id) if len(rows) > limit else None
+    return responses.json_response(request, responses.readings_page(rows[:limit], next_cursor, format))
 
-    for ts, value in moisture_readings:
-        time_key = ts.isoformat()
-        if time_key not in combined_data:
-            combined_data[time_key] = {'time': ts.strftime('%H:%M')}
-        combined_data[time_key]['soil_moisture'] = value
-    
-    if not combined_data:
-        return []
 
-    sorted_keys = sorted(combined_data.keys())
-    sorted_chart_data = [combined_data[key] for key in sorted_keys]
-    
-    return sorted_chart_data
+@app.get("/api/v1/readings/export", tags=["readings"])
+def export_readings(
+    db: Session = Depends(database.get_db),
+    format: str = Query("csv", description="One of csv, arrow (Arrow IPC stream) or parquet"),
+    field_id: int = Query(None),
+    sensor_type: str = Query(None),
+    start: datetime.datetime = Query(None),
+    end: datetime.datetime = Query(None)
+):
+    if format not in export.FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported format. Choose one of: {', '.join(export.FORMATS)}.")
+    media_type, extension, encode, needs_arrow = export.FORMATS[format]
+    if needs_arrow and not export.arrow_available():
+        raise HTTPException(status_code=501, detail=f"The {format} format requires pyarrow on the server.")
+    start = rollups.naive_utc(start) if start else None
+    end = rollups.naive_utc(end) if end else None
+    pages = export.iter_pages(db, field_id, sensor_type, start, end)
+    return StreamingResponse(
+        encode(pages),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="readings.{extension}"'},
+    )
 
 
 @app.post("/api/v1/sensors/bulk", tags=["sensors"])
-async def create_bulk_sensor_readings(
+def create_bulk_sensor_readings(
     file: UploadFile = File(...), db: Session = Depends(database.get_db)
 ):
     if not file.filename.endswith('.csv'):
         raise HTTPException(status_code=400, detail="Invalid file type. Please upload a CSV.")
     try:
-        contents = await file.read()
-        buffer = io.StringIO(contents.decode('utf-8'))
-        csv_reader = csv.DictReader(buffer)
-        readings_to_create = []
-        checked_fields = set()
-        for row in csv_reader:
-            field_id = int(row['field_id'])
-            if field_id not in checked_fields:
-                db_field = db.query(models.Field).filter(models.Field.id == field_id).first()
-                if not db_field:
-                    db_field = models.Field(id=field_id, name=f"Field {field_id}")
-                    db.add(db_field)
-                    db.commit()
-                checked_fields.add(field_id)
-            reading_dict = {
-                'field_id': field_id,
-                'sensor_type': row['sensor_type'],
-                'value': float(row['value']),
-                'unit': row['unit'],
-            }
-            timestamp_val = row.get('timestamp')
-            if timestamp_val:
-                reading_dict['timestamp'] = timestamp_val
-            reading_data = schemas.SensorReadingCreate(**reading_dict)
-            crud.create_sensor_reading(db=db, reading=reading_data)
-            readings_to_create.append(reading_data)
+        result = ingest.ingest_csv(db, ingest.iter_lines(file.file))
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Error processing CSV file: {e}")
-    return {"message": f"Successfully ingested {len(readings_to_create)} readings from CSV."}
+    return {
+        "message": f"Successfully ingested {result.rows} readings from CSV.",
+        "rows_per_sec": round(result.rows_per_sec, 1),
+    }
+
+
+@app.post("/api/v1/sensors/batch", response_model=schemas.BatchIngestResult, tags=["sensors"])
+def create_sensor_readings_batch(
+    readings: List[Any] = Body(..., embed=True, description="Readings in the SensorReadingCreate format"),
+    db: Session = Depends(database.get_db)
+):
+    if len(readings) > batch.BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"A batch may contain at most {batch.BATCH_MAX_ITEMS} readings.")
+    rows, errors = batch.validate_readings(readings)
+    if rows:
+        ingest.write_batch(db, rows)
+    return schemas.BatchIngestResult(accepted=len(rows), rejected=len(errors), errors=errors)
 
 
-@app.post("/api/v1/sensors", response_model=schemas.SensorReading, tags=["sensors"])
-def create_sensor_reading(
-    reading: schemas.SensorReadingCreate, db: Session = Depends(database.get_db)
+@app.post(
+    "/api/v1/sensors",
+    response_model=schemas.SensorReading,
+    responses={202: {"description": "Accepted into the write-behind buffer"}, 429: {"description": "Write-behind buffer full"}},
+    tags=["sensors"],
+)
+async def create_sensor_reading(
+    reading: schemas.SensorReadingCreate, db: AsyncSession = Depends(database.get_async_db)
 ):
-    db_field = db.query(models.Field).filter(models.Field.id == reading.field_id).first()
-    if not db_field:
-        db_field = models.Field(id=reading.field_id, name=f"Field {reading.field_id}")
-        db.add(db_field)
-        db.commit()
-    return crud.create_sensor_reading(db=db, reading=reading)
+    if write_behind is not None:
+        row = ingest.reading_to_row(reading)
+        if not write_behind.offer(row):
+            raise HTTPException(status_code=429, detail="Ingest buffer is full, retry later.", headers={"Retry-After": "1"})
+        return JSONResponse(status_code=202, content=jsonable_encoder({"status": "accepted", **row}))
+
+    return await async_crud.create_sensor_reading(db, reading)
 
 
 @app.get("/api/v1/analytics", response_model=schemas.AnalyticsData, tags=["sensors"])
-def read_analytics(
-    db: Session = Depends(database.get_db),
+async def read_analytics(
+    request: Request,
+    db: AsyncSession = Depends(database.get_async_db),
     field_id: int = Query(...),
     sensor_type: str = Query(...),
     start: datetime.datetime = Query(None),
     end: datetime.datetime = Query(None)
 ):
-    if end is None: end = datetime.datetime.utcnow()
+    if end is None: end = window_end()
     if start is None: start = end - datetime.timedelta(days=1)
-    analytics_data = crud.get_analytics(db, field_id=field_id, sensor_type=sensor_type, start_time=start, end_time=end)
+
+    async def compute():
+        analytics_data = await async_crud.get_analytics(db, field_id, sensor_type, start, end)
+        return analytics_data.model_dump() if analytics_data else None
+
+    analytics_data = await cache.aget_or_compute("analytics", field_id, [sensor_type], (start.isoformat(), end.isoformat()), compute)
     if not analytics_data:
         raise HTTPException(status_code=404, detail="No data found for the specified criteria")
-    return analytics_data
+    return responses.json_response(request, analytics_data)
+
+
+@app.post("/api/v1/analytics/query", tags=["sensors"])
+def query_analytics(query: schemas.AnalyticsQuery, db: Session = Depends(database.get_db)):
+    # One JSON line of schemas.SeriesAnalytics per (field_id, sensor_type) with data.
+    end = query.end or window_end()
+    start = query.start or end - datetime.timedelta(days=1)
+    rows = crud.get_fleet_analytics(
+        db,
+        None if query.field_ids == "all" else query.field_ids,
+        None if query.sensor_types == "all" else query.sensor_types,
+        start,
+        end,
+    )
+    return StreamingResponse((row.model_dump_json() + "\n" for row in rows), media_type="application/x-ndjson")
+
+
+@app.get("/api/v1/analytics/advanced", response_model=List[schemas.SeriesStatistics], tags=["sensors"])
+def read_advanced_analytics(
+    request: Request,
+    db: Session = Depends(database.get_db),
+    field_ids: List[int] = Query(..., description="Fields to include"),
+    sensor_types: List[str] = Query(..., description="Sensor types to include"),
+    start: datetime.datetime = Query(None),
+    end: datetime.datetime = Query(None),
+    percentiles: List[float] = Query(list(advanced.DEFAULT_PERCENTILES), description="Percentiles (0-100) to compute"),
+    window_minutes: int = Query(60, ge=1, description="Width of the trailing window for threshold checks"),
+    above: float = Query(None, description="Count windows whose mean exceeds this value"),
+    below: float = Query(None, description="Count windows whose mean falls below this value"),
+):
+    if end is None: end = window_end()
+    if start is None: start = end - datetime.timedelta(days=1)
+    start, end = rollups.naive_utc(start), rollups.naive_utc(end)
+    if any(not 0 <= q <= 100 for q in percentiles):
+        raise HTTPException(status_code=400, detail="Percentiles must be between 0 and 100.")
+    try:
+        statistics = advanced.get_advanced_analytics(
+            db, field_ids, sensor_types, start, end, percentiles, window_minutes * 60, above, below
+        )
+    except advanced.TooManyRows as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return responses.json_response(request, statistics)
+
+
+@app.get("/api/v1/stream", tags=["readings"])
+async def stream_events(
+    request: Request,
+    field_id: int = Query(None, description="Stream readings ingested for this field"),
+    task_id: str = Query(None, description="Stream progress of this background task")
+):
+    if events.broker is None:
+        raise HTTPException(status_code=503, detail="Event streaming is disabled.")
+    channels = []
+    if field_id is not None: channels.append(events.field_channel(field_id))
+    if task_id is not None: channels.append(events.task_channel(task_id))
+    if not channels:
+        raise HTTPException(status_code=400, detail="Provide field_id and/or task_id.")
+
+    async def event_stream():
+        async with events.broker.subscribe(channels) as subscription:
+            yield ": connected\n\n"
+            while not await request.is_disconnected():
+                message = await subscription.get(events.EVENTS_HEARTBEAT_SECONDS)
+                yield events.format_sse(message) if message is not None else ": keepalive\n\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/api/v1/metrics", tags=["metrics"])
+def read_metrics():
+    return {
+        "cache": cache.stats(),
+        "write_behind": write_behind.stats() if write_behind is not None else None,
+        "db_pool": database.process_pool_stats(),
+    }
+
+
+@app.get("/metrics", include_in_schema=False)
+def read_prometheus_metrics():
+    return Response(instrumentation.render(), media_type=instrumentation.CONTENT_TYPE)
 
 
 @app.get("/")
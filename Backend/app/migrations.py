@@ -0,0 +1,177 @@
+"""
+Versioned schema migrations.
+
+`create_all` only creates missing tables, so changes to existing tables are
+applied here. Each migration runs once, in its own transaction, and is
+recorded in `schema_migrations`. Run them with `python -m app.migrations`;
+the API also applies pending migrations on startup.
+"""
+import logging
+import os
+from datetime import date, datetime
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection, Engine
+
+logger = logging.getLogger(__name__)
+
+PARTITIONING = os.getenv("SENSOR_READINGS_PARTITIONING", "").lower()
+PARTITION_MONTHS_AHEAD = int(os.getenv("SENSOR_READINGS_PARTITION_MONTHS_AHEAD", "3"))
+
+
+def _add_months(day: date, months: int) -> date:
+    month = day.month - 1 + months
+    return date(day.year + month // 12, month % 12 + 1, 1)
+
+
+def _partition_name(month_start: date) -> str:
+    return f"sensor_readings_{month_start:%Y_%m}"
+
+
+def is_partitioned(conn: Connection) -> bool:
+    """Whether `sensor_readings` is a range-partitioned Postgres table."""
+    if conn.dialect.name != "postgresql":
+        return False
+    return bool(conn.execute(text(
+        "SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid "
+        "WHERE c.relname = 'sensor_readings'"
+    )).scalar())
+
+
+def ensure_partitions(conn: Connection, start: date = None, months_ahead: int = None) -> int:
+    """
+    Create the monthly partitions of `sensor_readings` from `start` up to
+    `months_ahead` months past the current month. Returns how many were created.
+    """
+    if not is_partitioned(conn):
+        return 0
+    months_ahead = PARTITION_MONTHS_AHEAD if months_ahead is None else months_ahead
+    month = (start or date.today()).replace(day=1)
+    last = _add_months(date.today().replace(day=1), months_ahead)
+    created = 0
+    while month <= last:
+        name = _partition_name(month)
+        exists = conn.execute(text("SELECT to_regclass(:name)"), {"name": name}).scalar()
+        if not exists:
+            conn.execute(text(
+                f"CREATE TABLE {name} PARTITION OF sensor_readings "
+                f"FOR VALUES FROM ('{month.isoformat()}') TO ('{_add_months(month, 1).isoformat()}')"
+            ))
+            created += 1
+        month = _add_months(month, 1)
+    return created
+
+
+def _composite_reading_index(conn: Connection) -> None:
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_sensor_readings_field_sensor_time "
+        "ON sensor_readings (field_id, sensor_type, timestamp)"
+    ))
+
+
+def _unique_hourly_key(conn: Connection) -> None:
+    # Older beat runs could insert the same hour twice; keep the newest row.
+    conn.execute(text(
+        "DELETE FROM hourly_analytics WHERE id NOT IN ("
+        "SELECT MAX(id) FROM hourly_analytics GROUP BY field_id, sensor_type, hour_timestamp)"
+    ))
+    conn.execute(text(
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_hourly_analytics_field_sensor_hour "
+        "ON hourly_analytics (field_id, sensor_type, hour_timestamp)"
+    ))
+
+
+def _hourly_sums(conn: Connection) -> None:
+    # Rows rolled up before this migration get their sum back from avg * count;
+    # their sum of squares stays NULL, so they report no standard deviation.
+    columns = {column["name"] for column in inspect(conn).get_columns("hourly_analytics")}
+    for column in ("sum_value", "sum_sq_value"):
+        if column not in columns:
+            conn.execute(text(f"ALTER TABLE hourly_analytics ADD COLUMN {column} FLOAT"))
+    conn.execute(text(
+        "UPDATE hourly_analytics SET sum_value = avg_value * reading_count WHERE sum_value IS NULL"
+    ))
+
+
+def _partition_sensor_readings(conn: Connection) -> None:
+    """
+    Rebuild `sensor_readings` as a table partitioned by month on `timestamp`.
+
+    The existing rows are copied into the new partitions inside the migration
+    transaction, so the table is locked for the duration of the copy.
+    """
+    first = conn.execute(text("SELECT MIN(timestamp) FROM sensor_readings")).scalar()
+    conn.execute(text("ALTER TABLE sensor_readings RENAME TO sensor_readings_unpartitioned"))
+    conn.execute(text("ALTER SEQUENCE sensor_readings_id_seq OWNED BY NONE"))
+    conn.execute(text(
+        "CREATE TABLE sensor_readings ("
+        "id INTEGER NOT NULL DEFAULT nextval('sensor_readings_id_seq'), "
+        "field_id INTEGER NOT NULL REFERENCES fields (id), "
+        "sensor_type VARCHAR NOT NULL, "
+        "value FLOAT NOT NULL, "
+        "unit VARCHAR NOT NULL, "
+        "timestamp TIMESTAMP WITHOUT TIME ZONE NOT NULL, "
+        "PRIMARY KEY (id, timestamp)"
+        ") PARTITION BY RANGE (timestamp)"
+    ))
+    conn.execute(text("ALTER SEQUENCE sensor_readings_id_seq OWNED BY sensor_readings.id"))
+    conn.execute(text("CREATE TABLE sensor_readings_default PARTITION OF sensor_readings DEFAULT"))
+    ensure_partitions(conn, start=first.date() if first else None)
+    conn.execute(text(
+        "INSERT INTO sensor_readings (id, field_id, sensor_type, value, unit, timestamp) "
+        "SELECT id, field_id, sensor_type, value, unit, timestamp FROM sensor_readings_unpartitioned"
+    ))
+    conn.execute(text("DROP TABLE sensor_readings_unpartitioned"))
+    conn.execute(text("CREATE INDEX ix_sensor_readings_sensor_type ON sensor_readings (sensor_type)"))
+    _composite_reading_index(conn)
+
+
+def _partitioning_enabled(conn: Connection) -> bool:
+    return conn.dialect.name == "postgresql" and PARTITIONING == "month"
+
+
+# (version, description, migration, predicate). A migration whose predicate is
+# false is skipped without being recorded, so it can be enabled later.
+MIGRATIONS = [
+    (1, "composite (field_id, sensor_type, timestamp) index on sensor_readings", _composite_reading_index, None),
+    (2, "unique (field_id, sensor_type, hour_timestamp) key on hourly_analytics", _unique_hourly_key, None),
+    (3, "monthly range partitioning of sensor_readings", _partition_sensor_readings, _partitioning_enabled),
+    (4, "sum and sum of squares columns on hourly_analytics", _hourly_sums, None),
+]
+
+
+def applied_versions(conn: Connection) -> set:
+    conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_migrations ("
+        "version INTEGER PRIMARY KEY, description VARCHAR NOT NULL, applied_at TIMESTAMP NOT NULL)"
+    ))
+    return {version for (version,) in conn.execute(text("SELECT version FROM schema_migrations"))}
+
+
+def run_migrations(engine: Engine) -> list:
+    """Apply every pending migration and return the versions that were applied."""
+    with engine.begin() as conn:
+        done = applied_versions(conn)
+    applied = []
+    for version, description, migrate, predicate in MIGRATIONS:
+        if version in done:
+            continue
+        with engine.begin() as conn:
+            if predicate is not None and not predicate(conn):
+                continue
+            logger.info("Applying migration %d: %s", version, description)
+            migrate(conn)
+            conn.execute(
+                text("INSERT INTO schema_migrations (version, description, applied_at) VALUES (:v, :d, :t)"),
+                {"v": version, "d": description, "t": datetime.utcnow()},
+            )
+        applied.append(version)
+    return applied
+
+
+if __name__ == "__main__":
+    from . import database, models
+
+    logging.basicConfig(level=logging.INFO)
+    models.Base.metadata.create_all(bind=database.engine)
+    print(f"Applied migrations: {run_migrations(database.engine) or 'none'}")
@@ -1,5 +1,5 @@
 
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Index
 from sqlalchemy.orm import relationship
 from .database import Base
 import datetime
@@ -27,6 +27,29 @@ class SensorReading(Base):
 
     field = relationship("Field", back_populates="readings")
 
+    __table_args__ = (
+        Index("ix_sensor_readings_field_sensor_time", "field_id", "sensor_type", "timestamp"),
+    )
+
+class MinuteAnalytics(Base):
+    """Model for storing per-minute aggregated analytics."""
+    __tablename__ = "minute_analytics"
+
+    id = Column(Integer, primary_key=True, index=True)
+    field_id = Column(Integer, ForeignKey("fields.id"), nullable=False)
+    sensor_type = Column(String, nullable=False)
+    minute_timestamp = Column(DateTime, nullable=False)
+    min_value = Column(Float)
+    max_value = Column(Float)
+    avg_value = Column(Float)
+    sum_value = Column(Float)
+    sum_sq_value = Column(Float)
+    reading_count = Column(Integer)
+
+    __table_args__ = (
+        Index("uq_minute_analytics_field_sensor_minute", "field_id", "sensor_type", "minute_timestamp", unique=True),
+    )
+
 class HourlyAnalytics(Base):
     """Model for storing hourly aggregated analytics."""
     __tablename__ = "hourly_analytics"
@@ -38,4 +61,49 @@ class HourlyAnalytics(Base):
     min_value = Column(Float)
     max_value = Column(Float)
     avg_value = Column(Float)
-    reading_count = Column(Integer)
\ No newline at end of file
+    sum_value = Column(Float)
+    sum_sq_value = Column(Float)
+    reading_count = Column(Integer)
+
+    __table_args__ = (
+        Index("uq_hourly_analytics_field_sensor_hour", "field_id", "sensor_type", "hour_timestamp", unique=True),
+    )
+
+class DailyAnalytics(Base):
+    """Model for storing daily aggregated analytics."""
+    __tablename__ = "daily_analytics"
+
+    id = Column(Integer, primary_key=True, index=True)
+    field_id = Column(Integer, ForeignKey("fields.id"), nullable=False)
+    sensor_type = Column(String, nullable=False)
+    day_timestamp = Column(DateTime, nullable=False)
+    min_value = Column(Float)
+    max_value = Column(Float)
+    avg_value = Column(Float)
+    sum_value = Column(Float)
+    sum_sq_value = Column(Float)
+    reading_count = Column(Integer)
+
+    __table_args__ = (
+        Index("uq_daily_analytics_field_sensor_day", "field_id", "sensor_type", "day_timestamp", unique=True),
+    )
+
+class RollupDirtyHour(Base):
+    """An hour of one sensor series whose rollup must be recomputed after late or backfilled data."""
+    __tablename__ = "rollup_dirty_hours"
+
+    field_id = Column(Integer, primary_key=True)
+    sensor_type = Column(String, primary_key=True)
+    hour_timestamp = Column(DateTime, primary_key=True)
+    marked_at = Column(DateTime, default=datetime.datetime.utcnow, nullable=False)
+
+class RollupState(Base):
+    """
+    Progress marker of a rollup job: every bucket before `watermark` has been
+    rolled up. Rows named `raw_horizon:<sensor_type>` instead mark how far the
+    retention job has pruned that sensor type's raw readings.
+    """
+    __tablename__ = "rollup_state"
+
+    name = Column(String, primary_key=True)
+    watermark = Column(DateTime, nullable=False)
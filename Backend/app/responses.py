@@ -0,0 +1,98 @@
+"""
+Fast JSON responses for large read endpoints.
+
+`json_response` serializes plain lists, dicts and tuples with orjson,
+skipping FastAPI's `jsonable_encoder` and response-model validation, and
+compresses the body with brotli or gzip when the client accepts it and the
+body is at least RESPONSE_COMPRESSION_MIN_BYTES long. Brotli needs the
+optional `brotli` package; without it only gzip is offered.
+"""
+import gzip
+import importlib.util
+import os
+from datetime import datetime
+from typing import Dict, Optional, Sequence
+
+import orjson
+from fastapi import Request
+from fastapi.responses import Response
+
+from . import crud
+
+RESPONSE_COMPRESSION = os.getenv("RESPONSE_COMPRESSION", "1") == "1"
+RESPONSE_COMPRESSION_MIN_BYTES = int(os.getenv("RESPONSE_COMPRESSION_MIN_BYTES", "4096"))
+RESPONSE_GZIP_LEVEL = int(os.getenv("RESPONSE_GZIP_LEVEL", "6"))
+RESPONSE_BROTLI_QUALITY = int(os.getenv("RESPONSE_BROTLI_QUALITY", "4"))
+
+FORMATS = ("columns", "rows")
+
+
+def brotli_available() -> bool:
+    return importlib.util.find_spec("brotli") is not None
+
+
+def _accepted_encodings(header: str) -> set:
+    """Codings listed in an Accept-Encoding header, leaving out those with q=0."""
+    accepted = set()
+    for part in header.split(","):
+        coding, _, params = part.strip().partition(";")
+        q = params.strip().partition("=")[2] if params.strip().startswith("q=") else "1"
+        try:
+            if float(q) > 0:
+                accepted.add(coding.strip().lower())
+        except ValueError:
+            continue
+    return accepted
+
+
+def compress(body: bytes, accept_encoding: str):
+    """Return `(body, content_encoding)`, compressed with the best accepted coding when worthwhile."""
+    if not RESPONSE_COMPRESSION or len(body) < RESPONSE_COMPRESSION_MIN_BYTES:
+        return body, None
+    accepted = _accepted_encodings(accept_encoding)
+    if "br" in accepted and brotli_available():
+        import brotli
+
+        return brotli.compress(body, quality=RESPONSE_BROTLI_QUALITY), "br"
+    if "gzip" in accepted or "*" in accepted:
+        return gzip.compress(body, compresslevel=RESPONSE_GZIP_LEVEL), "gzip"
+    return body, None
+
+
+def json_response(request: Request, content, status_code: int = 200) -> Response:
+    """Serialize `content` with orjson, compressed according to the request's Accept-Encoding."""
+    body, encoding = compress(orjson.dumps(content), request.headers.get("accept-encoding", ""))
+    headers = {"Vary": "Accept-Encoding"}
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return Response(body, status_code=status_code, media_type="application/json", headers=headers)
+
+
+def epoch_seconds(value: datetime) -> float:
+    """Seconds since `crud.EPOCH` of a naive UTC timestamp."""
+    return (value - crud.EPOCH).total_seconds()
+
+
+def readings_page(rows: Sequence, next_cursor: Optional[str], format: str = "rows") -> Dict:
+    """
+    A page of `crud.get_readings_page` tuples, as `schemas.SensorReadingPage`
+    (`rows`) or with one list per column and `t` in Unix seconds (`columns`).
+    """
+    if format == "columns":
+        ids, field_ids, sensor_types, values, units, timestamps = zip(*rows) if rows else ((),) * 6
+        return {
+            'id': list(ids),
+            't': [epoch_seconds(ts) for ts in timestamps],
+            'field_id': list(field_ids),
+            'sensor_type': list(sensor_types),
+            'value': list(values),
+            'unit': list(units),
+            'next_cursor': next_cursor,
+        }
+    return {
+        'items': [
+            {'id': id, 'field_id': field_id, 'sensor_type': sensor_type, 'value': value, 'unit': unit, 'timestamp': timestamp}
+            for id, field_id, sensor_type, value, unit, timestamp in rows
+        ],
+        'next_cursor': next_cursor,
+    }
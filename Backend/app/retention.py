@@ -0,0 +1,272 @@
+"""
+Retention of raw readings and rollups.
+
+Raw readings are kept for a number of days per sensor type, and each rollup
+tier for its own number of days, so old data stays queryable at a coarser
+resolution once its raw rows are gone:
+
+    RETENTION_RAW_DAYS=90                                   # every sensor type
+    RETENTION_RAW_DAYS_BY_SENSOR=temperature=30,soil_moisture=365
+    RETENTION_MINUTE_DAYS=30 RETENTION_HOUR_DAYS=730 RETENTION_DAY_DAYS=
+
+An unset or empty value keeps that data forever.
+
+Raw readings are pruned a day at a time, oldest first, and only once the day
+is verified to be covered: the watermark of every tier that outlives the raw
+data is past it, none of its hours is dirty, and those tiers count exactly
+the raw rows in it. Rows are deleted in batches of RETENTION_BATCH_SIZE, one
+short transaction each. The day pruned up to becomes the sensor type's raw
+horizon (see `rollups.get_raw_horizons`), before which rollups are final.
+On a partitioned table, monthly partitions that have expired for every
+sensor type are verified the same way, then detached and dropped.
+
+Run it with `python -m app.retention`; the worker runs it daily.
+"""
+import logging
+import os
+import re
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from sqlalchemy import func, select, text
+from sqlalchemy.orm import Session
+
+from . import database, migrations, models, rollups
+
+logger = logging.getLogger(__name__)
+
+
+def _days(value: Optional[str]) -> Optional[int]:
+    return int(value) if value not in (None, "") else None
+
+
+def _days_by_sensor(value: str) -> Dict[str, int]:
+    """Parse `type=days,type=days`."""
+    pairs = (item.split("=", 1) for item in value.split(",") if item.strip())
+    return {sensor_type.strip(): int(days) for sensor_type, days in pairs}
+
+
+RETENTION_RAW_DAYS = _days(os.getenv("RETENTION_RAW_DAYS"))
+RETENTION_RAW_DAYS_BY_SENSOR = _days_by_sensor(os.getenv("RETENTION_RAW_DAYS_BY_SENSOR", ""))
+RETENTION_ROLLUP_DAYS = {
+    tier.name: _days(os.getenv(f"RETENTION_{tier.name.upper()}_DAYS")) for tier in rollups.TIERS
+}
+RETENTION_BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", "5000"))
+RETENTION_MAX_DAYS_PER_RUN = int(os.getenv("RETENTION_MAX_DAYS_PER_RUN", "31"))
+RETENTION_LOCK_TIMEOUT = os.getenv("RETENTION_LOCK_TIMEOUT", "5s")
+
+_PARTITION_NAME = re.compile(r"^sensor_readings_(\d{4})_(\d{2})$")
+
+
+def raw_retention_days(sensor_type: str) -> Optional[int]:
+    """Days of raw readings kept for `sensor_type`, or None to keep them forever."""
+    return RETENTION_RAW_DAYS_BY_SENSOR.get(sensor_type, RETENTION_RAW_DAYS)
+
+
+def raw_cutoff(sensor_type: str, now: Optional[datetime] = None) -> Optional[datetime]:
+    """Day boundary before which `sensor_type`'s raw readings have expired."""
+    days = raw_retention_days(sensor_type)
+    if days is None:
+        return None
+    return rollups.floor_to((now or datetime.utcnow()) - days * rollups.DAY, rollups.DAY)
+
+
+def rollup_horizons(now: Optional[datetime] = None) -> Dict[str, Optional[datetime]]:
+    """Per tier name, the day boundary before which its rollups have expired (None: kept forever)."""
+    now = now or datetime.utcnow()
+    return {
+        name: rollups.floor_to(now - days * rollups.DAY, rollups.DAY) if days is not None else None
+        for name, days in RETENTION_ROLLUP_DAYS.items()
+    }
+
+
+def _covering_tiers(sensor_type: str) -> List[rollups.Tier]:
+    """The tiers that must cover raw readings before they are pruned: hours, plus any tier kept longer."""
+    raw_days = raw_retention_days(sensor_type)
+    return [
+        tier for tier in rollups.TIERS
+        if tier is rollups.HOUR_TIER
+        or RETENTION_ROLLUP_DAYS[tier.name] is None
+        or RETENTION_ROLLUP_DAYS[tier.name] > raw_days
+    ]
+
+
+def _sensor_types(db: Session) -> List[str]:
+    rolled_up = {sensor_type for (sensor_type,) in db.query(models.HourlyAnalytics.sensor_type).distinct()}
+    return sorted(rolled_up | set(RETENTION_RAW_DAYS_BY_SENSOR))
+
+
+def _delete_in_batches(db: Session, model, *conditions, batch_size: Optional[int] = None) -> int:
+    """Delete the rows of `model` matching `conditions`, committing every `batch_size` rows."""
+    batch_size = batch_size or RETENTION_BATCH_SIZE
+    deleted = 0
+    while True:
+        ids = select(model.id).where(*conditions).limit(batch_size)
+        count = db.query(model).filter(model.id.in_(ids), *conditions).delete(synchronize_session=False)
+        db.commit()
+        deleted += count
+        if count < batch_size:
+            return deleted
+
+
+def is_covered(db: Session, sensor_type: str, start: datetime, end: datetime, tiers: List[rollups.Tier]) -> bool:
+    """
+    Whether the raw `sensor_type` readings in `[start, end)` are fully
+    represented in every one of `tiers`: no hour in the span is dirty and
+    each tier counts exactly as many readings as there are raw rows.
+    """
+    dirty = models.RollupDirtyHour
+    if db.query(dirty.hour_timestamp).filter(
+        dirty.sensor_type == sensor_type,
+        dirty.hour_timestamp >= start,
+        dirty.hour_timestamp < end,
+    ).first() is not None:
+        return False
+    reading = models.SensorReading
+    raw_count = db.query(func.count(reading.id)).filter(
+        reading.sensor_type == sensor_type,
+        reading.timestamp >= start,
+        reading.timestamp < end,
+    ).scalar()
+    for tier in tiers:
+        rolled_up = db.query(func.coalesce(func.sum(tier.model.reading_count), 0)).filter(
+            tier.model.sensor_type == sensor_type,
+            tier.bucket >= start,
+            tier.bucket < end,
+        ).scalar()
+        if rolled_up != raw_count:
+            return False
+    return True
+
+
+def _verified(db: Session, sensor_type: str, start: datetime, end: datetime, watermarks: Dict) -> bool:
+    """Whether every covering tier has rolled up past `end` and covers `[start, end)`."""
+    tiers = _covering_tiers(sensor_type)
+    return all(
+        watermarks[tier.name] is not None and watermarks[tier.name] >= end for tier in tiers
+    ) and is_covered(db, sensor_type, start, end, tiers)
+
+
+def prune_raw(db: Session, sensor_type: str, now: Optional[datetime] = None, max_days: Optional[int] = None) -> int:
+    """
+    Delete the expired raw readings of `sensor_type`, at most `max_days` days
+    per call, stopping at the first day that is not verifiably covered by its
+    rollups. Returns how many rows were deleted.
+    """
+    cutoff = raw_cutoff(sensor_type, now)
+    if cutoff is None:
+        return 0
+    watermarks = rollups.get_watermarks(db)
+
+    reading = models.SensorReading
+    deleted = 0
+    day = rollups.get_raw_horizons(db).get(sensor_type)
+    if day is not None:
+        # Late readings behind the horizon were never rolled up and have expired.
+        deleted += _delete_in_batches(db, reading, reading.sensor_type == sensor_type, reading.timestamp < day)
+    else:
+        first = db.query(func.min(rollups.HOUR_TIER.bucket)).filter(
+            models.HourlyAnalytics.sensor_type == sensor_type
+        ).scalar()
+        if first is None:
+            return deleted
+        day = rollups.floor_to(rollups._as_datetime(first), rollups.DAY)
+
+    for _ in range(max_days or RETENTION_MAX_DAYS_PER_RUN):
+        if day >= cutoff:
+            break
+        end = day + rollups.DAY
+        if not _verified(db, sensor_type, day, end, watermarks):
+            logger.warning("Not pruning %s readings from %s: rollups do not cover them yet", sensor_type, day)
+            break
+        deleted += _delete_in_batches(
+            db, reading, reading.sensor_type == sensor_type, reading.timestamp >= day, reading.timestamp < end
+        )
+        rollups.set_raw_horizon(db, sensor_type, end)
+        db.commit()
+        day = end
+    return deleted
+
+
+def prune_rollups(db: Session, now: Optional[datetime] = None) -> Dict[str, int]:
+    """Delete rollup rows older than their tier's retention. Returns rows deleted per tier."""
+    horizons = rollup_horizons(now)
+    return {
+        tier.name: _delete_in_batches(db, tier.model, tier.bucket < horizons[tier.name])
+        for tier in rollups.TIERS if horizons[tier.name] is not None
+    }
+
+
+def drop_expired_partitions(db: Session, now: Optional[datetime] = None) -> List[str]:
+    """
+    Detach and drop the monthly `sensor_readings` partitions that have expired
+    for every sensor type and are covered by rollups, oldest first. Each drop
+    is its own transaction with a lock timeout, so it never queues behind
+    long-running queries. Returns the names of the dropped partitions.
+    """
+    if not migrations.is_partitioned(db.connection()):
+        return []
+    # Partitions hold every sensor type, so all of them, including ones not
+    # seen yet, need a raw retention.
+    sensor_types = _sensor_types(db)
+    cutoffs = [raw_cutoff(sensor_type, now) for sensor_type in sensor_types]
+    if RETENTION_RAW_DAYS is None or not sensor_types or None in cutoffs:
+        return []
+    watermarks = rollups.get_watermarks(db)
+    cutoff = min(cutoffs)
+
+    partitions = sorted(db.execute(text(
+        "SELECT c.relname FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid JOIN pg_class p ON p.oid = i.inhparent "
+        "WHERE p.relname = 'sensor_readings'"
+    )).scalars())
+    horizons = rollups.get_raw_horizons(db)
+    dropped = []
+    for name in partitions:
+        match = _PARTITION_NAME.match(name)
+        if not match:
+            continue
+        start = datetime(int(match.group(1)), int(match.group(2)), 1)
+        end = datetime.combine(migrations._add_months(start.date(), 1), datetime.min.time())
+        if end > cutoff:
+            break
+        present = set(db.execute(text(f"SELECT DISTINCT sensor_type FROM {name}")).scalars())
+        if not present <= set(sensor_types) or not all(
+            _verified(db, sensor_type, start, end, watermarks) for sensor_type in present
+        ):
+            logger.warning("Not dropping partition %s: rollups do not cover it yet", name)
+            break
+        try:
+            db.execute(text(f"SET LOCAL lock_timeout = '{RETENTION_LOCK_TIMEOUT}'"))
+            db.execute(text(f"ALTER TABLE sensor_readings DETACH PARTITION {name}"))
+            db.execute(text(f"DROP TABLE {name}"))
+            for sensor_type in sensor_types:
+                if horizons.get(sensor_type) is None or horizons[sensor_type] < end:
+                    rollups.set_raw_horizon(db, sensor_type, end)
+                    horizons[sensor_type] = end
+            db.commit()
+        except Exception:
+            db.rollback()
+            logger.exception("Could not drop partition %s", name)
+            break
+        dropped.append(name)
+    db.commit()
+    return dropped
+
+
+def apply_retention(db: Session, now: Optional[datetime] = None) -> dict:
+    """Drop expired partitions, prune expired raw readings and rollups. Returns a summary."""
+    now = now or datetime.utcnow()
+    dropped = drop_expired_partitions(db, now)
+    raw = {sensor_type: prune_raw(db, sensor_type, now) for sensor_type in _sensor_types(db)}
+    return {
+        'partitions_dropped': dropped,
+        'raw_deleted': {sensor_type: count for sensor_type, count in raw.items() if count},
+        'rollups_deleted': prune_rollups(db, now),
+    }
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    with database.SessionLocal() as db:
+        print(apply_retention(db))
@@ -0,0 +1,574 @@
+"""
+Incremental multi-resolution rollups of `sensor_readings`.
+
+Readings are aggregated into three tiers, `minute_analytics`,
+`hourly_analytics` and `daily_analytics`, each holding min, max, sum, count
+and sum of squares per series and bucket. Two things keep every tier
+complete and correct:
+
+* a watermark per tier in `rollup_state`: every closed bucket before it has
+  been rolled up, and each run advances it over the buckets that have closed
+  since;
+* dirty hours in `rollup_dirty_hours`: ingestion marks the closed hours it
+  writes to, and each run recomputes those hours together with their minutes
+  and their day.
+
+Rows are upserted on the (field_id, sensor_type, bucket) key, so retries and
+concurrent runs are harmless. Once `retention` has pruned a sensor type's raw
+readings up to its raw horizon, the rollups before that horizon are final and
+are never recomputed. `plan_ranges` splits a query range into whole
+buckets of the coarsest usable tier plus the raw edges.
+
+Rebuild a date range with:
+
+    python -m app.rollups backfill --start 2024-01-01 --end 2024-02-01 --workers 4
+"""
+import argparse
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from sqlalchemy import and_, delete, func, insert, or_
+from sqlalchemy.orm import Session
+
+from . import database, models
+
+logger = logging.getLogger(__name__)
+
+EPOCH = datetime(1970, 1, 1)
+MINUTE = timedelta(minutes=1)
+HOUR = timedelta(hours=1)
+DAY = timedelta(days=1)
+ROLLUP_DELAY_SECONDS = int(os.getenv("ROLLUP_DELAY_SECONDS", "60"))
+ROLLUP_MAX_HOURS_PER_RUN = int(os.getenv("ROLLUP_MAX_HOURS_PER_RUN", "168"))
+ROLLUP_DIRTY_BATCH_SIZE = int(os.getenv("ROLLUP_DIRTY_BATCH_SIZE", "500"))
+BACKFILL_CHUNK_HOURS = int(os.getenv("ROLLUP_BACKFILL_CHUNK_HOURS", "24"))
+
+SeriesHour = Tuple[int, str, datetime]
+SeriesSpan = Tuple[int, str, datetime, datetime]
+
+
+@dataclass(frozen=True)
+class Tier:
+    """One rollup resolution: its bucket width, table and bucket column."""
+    name: str
+    width: timedelta
+    model: type
+    column: str
+    sqlite_format: str
+
+    @property
+    def bucket(self):
+        return getattr(self.model, self.column)
+
+    @property
+    def watermark_name(self) -> str:
+        return self.model.__tablename__
+
+
+MINUTE_TIER = Tier("minute", MINUTE, models.MinuteAnalytics, "minute_timestamp", "%Y-%m-%d %H:%M:00")
+HOUR_TIER = Tier("hour", HOUR, models.HourlyAnalytics, "hour_timestamp", "%Y-%m-%d %H:00:00")
+DAY_TIER = Tier("day", DAY, models.DailyAnalytics, "day_timestamp", "%Y-%m-%d 00:00:00")
+
+# Finest first.
+TIERS = (MINUTE_TIER, HOUR_TIER, DAY_TIER)
+WATERMARK_NAME = HOUR_TIER.watermark_name
+RAW_HORIZON_PREFIX = "raw_horizon:"
+
+
+def naive_utc(ts: datetime) -> datetime:
+    """`ts` as a naive UTC datetime, the form every timestamp is stored in."""
+    if ts.tzinfo is not None:
+        ts = ts.astimezone(timezone.utc).replace(tzinfo=None)
+    return ts
+
+
+def floor_to(ts: datetime, width: timedelta) -> datetime:
+    """Start of the `width`-wide bucket containing naive UTC `ts`."""
+    return ts - (ts - EPOCH) % width
+
+
+def ceil_to(ts: datetime, width: timedelta) -> datetime:
+    floor = floor_to(ts, width)
+    return floor if floor == ts else floor + width
+
+
+def floor_hour(ts: datetime) -> datetime:
+    """Start of the hour containing `ts`, as a naive UTC datetime."""
+    return naive_utc(ts).replace(minute=0, second=0, microsecond=0)
+
+
+def bucket_expr(db: Session, tier: Tier, column):
+    """SQL expression truncating a timestamp column to the start of its `tier` bucket."""
+    if db.get_bind().dialect.name == 'sqlite':
+        return func.strftime(tier.sqlite_format, column)
+    return func.date_trunc(tier.name, column)
+
+
+def hour_expr(db: Session, column):
+    """SQL expression truncating a timestamp column to the start of its hour."""
+    return bucket_expr(db, HOUR_TIER, column)
+
+
+def tier_for_width(seconds: int) -> Optional[Tier]:
+    """The coarsest tier whose buckets nest exactly inside `seconds`-wide buckets."""
+    for tier in reversed(TIERS):
+        if seconds % tier.width.total_seconds() == 0:
+            return tier
+    return None
+
+
+def _as_datetime(value) -> datetime:
+    return datetime.fromisoformat(value) if isinstance(value, str) else value
+
+
+def get_watermark(db: Session, tier: Tier = HOUR_TIER) -> Optional[datetime]:
+    """Start of the first bucket of `tier` that has not been rolled up yet, or None before the first run."""
+    state = db.get(models.RollupState, tier.watermark_name)
+    return state.watermark if state else None
+
+
+def get_watermarks(db: Session) -> Dict[str, Optional[datetime]]:
+    """Watermark of every tier, keyed by tier name."""
+    states = {
+        state.name: state.watermark
+        for state in db.query(models.RollupState).filter(
+            models.RollupState.name.in_([tier.watermark_name for tier in TIERS])
+        )
+    }
+    return {tier.name: states.get(tier.watermark_name) for tier in TIERS}
+
+
+def _set_state(db: Session, name: str, watermark: datetime) -> None:
+    state = db.get(models.RollupState, name)
+    if state is None:
+        db.add(models.RollupState(name=name, watermark=watermark))
+    else:
+        state.watermark = watermark
+
+
+def _set_watermark(db: Session, tier: Tier, watermark: datetime) -> None:
+    _set_state(db, tier.watermark_name, watermark)
+
+
+def get_raw_horizons(db: Session) -> Dict[str, datetime]:
+    """Per sensor type, the time before which its raw readings have been pruned."""
+    states = db.query(models.RollupState).filter(models.RollupState.name.startswith(RAW_HORIZON_PREFIX))
+    return {state.name[len(RAW_HORIZON_PREFIX):]: state.watermark for state in states}
+
+
+def set_raw_horizon(db: Session, sensor_type: str, horizon: datetime) -> None:
+    """Record that `sensor_type`'s raw readings before `horizon` are gone. Does not commit."""
+    _set_state(db, RAW_HORIZON_PREFIX + sensor_type, horizon)
+
+
+def _retained(db: Session, sensor_type_column, time_column) -> list:
+    """Conditions limiting a query to the spans whose raw readings have not been pruned."""
+    return [
+        or_(sensor_type_column != sensor_type, time_column >= horizon)
+        for sensor_type, horizon in get_raw_horizons(db).items()
+    ]
+
+
+def mark_dirty(db: Session, keys: Iterable[SeriesHour], now: Optional[datetime] = None) -> int:
+    """
+    Record the closed hours in `keys` so the next run recomputes them.
+
+    Hours that have not closed yet are skipped; the watermark pass picks them
+    up. Returns how many hours were marked. Does not commit.
+    """
+    current_hour = floor_hour(now or datetime.utcnow())
+    marked_at = datetime.utcnow()
+    values = [
+        {'field_id': field_id, 'sensor_type': sensor_type, 'hour_timestamp': hour, 'marked_at': marked_at}
+        for field_id, sensor_type, hour in set(keys) if hour < current_hour
+    ]
+    if not values:
+        return 0
+    dialect_insert = database.dialect_insert(db.get_bind())
+    table = models.RollupDirtyHour.__table__
+    if dialect_insert is None:
+        for value in values:
+            db.merge(models.RollupDirtyHour(**value))
+    else:
+        stmt = dialect_insert(table).values(values)
+        db.execute(stmt.on_conflict_do_update(
+            index_elements=['field_id', 'sensor_type', 'hour_timestamp'],
+            set_={'marked_at': stmt.excluded.marked_at},
+        ))
+    return len(values)
+
+
+def mark_rows_dirty(db: Session, rows: Iterable[dict]) -> int:
+    """Mark the hours touched by parsed reading rows (see `ingest.parse_row`)."""
+    return mark_dirty(db, ((r['field_id'], r['sensor_type'], floor_hour(r['timestamp'])) for r in rows))
+
+
+def dirty_hours(db: Session, field_id: int, sensor_types: Sequence[str], start: datetime, end: datetime) -> Set[datetime]:
+    """Dirty hours of any of the given series within `[start, end]`."""
+    return fleet_dirty_hours(db, [field_id], sensor_types, start, end)
+
+
+def fleet_dirty_hours(
+    db: Session,
+    field_ids: Optional[Sequence[int]],
+    sensor_types: Optional[Sequence[str]],
+    start: datetime,
+    end: datetime,
+) -> Set[datetime]:
+    """Dirty hours within `[start, end]` of any series of the given fields and sensor types (None: all)."""
+    dirty = models.RollupDirtyHour
+    query = db.query(dirty.hour_timestamp).filter(
+        dirty.hour_timestamp >= floor_hour(start),
+        dirty.hour_timestamp <= end,
+    )
+    if field_ids is not None:
+        query = query.filter(dirty.field_id.in_(field_ids))
+    if sensor_types is not None:
+        query = query.filter(dirty.sensor_type.in_(sensor_types))
+    return {hour for (hour,) in query.distinct()}
+
+
+def _upsert_rollups(db: Session, tier: Tier, values: List[dict]) -> None:
+    if not values:
+        return
+    table = tier.model.__table__
+    dialect_insert = database.dialect_insert(db.get_bind())
+    if dialect_insert is None:
+        for value in values:
+            db.execute(delete(table).where(
+                table.c.field_id == value['field_id'],
+                table.c.sensor_type == value['sensor_type'],
+                table.c[tier.column] == value[tier.column],
+            ))
+        db.execute(insert(table), values)
+        return
+    stmt = dialect_insert(table).values(values)
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=['field_id', 'sensor_type', tier.column],
+        set_={
+            column: stmt.excluded[column]
+            for column in ('min_value', 'max_value', 'avg_value', 'sum_value', 'sum_sq_value', 'reading_count')
+        },
+    ))
+
+
+def _aggregate(db: Session, tier: Tier, *conditions) -> List[dict]:
+    """Run one grouped query over raw readings and return `tier` rollup rows."""
+    reading = models.SensorReading
+    bucket = bucket_expr(db, tier, reading.timestamp).label("bucket")
+    rows = db.query(
+        reading.field_id,
+        reading.sensor_type,
+        bucket,
+        func.min(reading.value),
+        func.max(reading.value),
+        func.sum(reading.value),
+        func.sum(reading.value * reading.value),
+        func.count(reading.id)
+    ).filter(*conditions).group_by(
+        reading.field_id, reading.sensor_type, bucket
+    ).all()
+    return [
+        {
+            'field_id': field_id,
+            'sensor_type': sensor_type,
+            tier.column: _as_datetime(bucket_value),
+            'min_value': min_value,
+            'max_value': max_value,
+            'avg_value': sum_value / count,
+            'sum_value': sum_value,
+            'sum_sq_value': sum_sq_value,
+            'reading_count': count,
+        }
+        for field_id, sensor_type, bucket_value, min_value, max_value, sum_value, sum_sq_value, count in rows
+    ]
+
+
+def rollup_range(db: Session, start: datetime, end: datetime, tier: Tier = HOUR_TIER) -> int:
+    """
+    Upsert the `tier` rollups of every series for the buckets in `[start, end)`,
+    skipping spans whose raw readings have been pruned. Does not commit.
+    """
+    reading = models.SensorReading
+    values = _aggregate(
+        db, tier, reading.timestamp >= start, reading.timestamp < end,
+        *_retained(db, reading.sensor_type, reading.timestamp),
+    )
+    _upsert_rollups(db, tier, values)
+    return len(values)
+
+
+def rollup_series(db: Session, tier: Tier, spans: Sequence[SeriesSpan]) -> int:
+    """
+    Recompute the `tier` rollups inside specific (field_id, sensor_type, start, end)
+    spans in one grouped query. Buckets without readings left lose their row.
+    Does not commit.
+    """
+    if not spans:
+        return 0
+    rollup = tier.model
+    for field_id, sensor_type, start, end in spans:
+        db.query(rollup).filter(
+            rollup.field_id == field_id,
+            rollup.sensor_type == sensor_type,
+            tier.bucket >= start,
+            tier.bucket < end,
+        ).delete(synchronize_session=False)
+    reading = models.SensorReading
+    values = _aggregate(db, tier, or_(*(
+        and_(
+            reading.field_id == field_id,
+            reading.sensor_type == sensor_type,
+            reading.timestamp >= start,
+            reading.timestamp < end,
+        )
+        for field_id, sensor_type, start, end in spans
+    )))
+    _upsert_rollups(db, tier, values)
+    return len(values)
+
+
+def rollup_series_hours(db: Session, keys: Sequence[SeriesHour]) -> int:
+    """
+    Recompute specific (field_id, sensor_type, hour) keys in every tier: the
+    hour itself, its minutes and the day containing it. Keys before their
+    sensor type's raw horizon are skipped, since their raw readings are gone.
+    Returns the number of hourly rows written. Does not commit.
+    """
+    horizons = get_raw_horizons(db)
+    keys = {
+        (field_id, sensor_type, hour) for field_id, sensor_type, hour in keys
+        if sensor_type not in horizons or hour >= horizons[sensor_type]
+    }
+    hours = sorted((field_id, sensor_type, hour, hour + HOUR) for field_id, sensor_type, hour in keys)
+    days = sorted({
+        (field_id, sensor_type, floor_to(hour, DAY), floor_to(hour, DAY) + DAY)
+        for field_id, sensor_type, hour in keys
+    })
+    rollup_series(db, MINUTE_TIER, hours)
+    rollup_series(db, DAY_TIER, days)
+    return rollup_series(db, HOUR_TIER, hours)
+
+
+def process_dirty_hours(db: Session, batch_size: Optional[int] = None) -> int:
+    """
+    Recompute every dirty hour in all tiers, one grouped query per tier and
+    batch, committing per batch.
+
+    A mark is only cleared if it was not refreshed while its batch was being
+    processed, so readings that arrive concurrently are never lost.
+    """
+    batch_size = batch_size or ROLLUP_DIRTY_BATCH_SIZE
+    dirty = models.RollupDirtyHour
+    processed = 0
+    last_key = None
+    while True:
+        query = db.query(dirty).order_by(dirty.hour_timestamp, dirty.field_id, dirty.sensor_type)
+        if last_key is not None:
+            hour, field_id, sensor_type = last_key
+            query = query.filter(or_(
+                dirty.hour_timestamp > hour,
+                and_(dirty.hour_timestamp == hour, dirty.field_id > field_id),
+                and_(dirty.hour_timestamp == hour, dirty.field_id == field_id, dirty.sensor_type > sensor_type),
+            ))
+        batch = [(d.field_id, d.sensor_type, d.hour_timestamp, d.marked_at) for d in query.limit(batch_size)]
+        if not batch:
+            return processed
+        rollup_series_hours(db, [(f, s, h) for f, s, h, _ in batch])
+        for field_id, sensor_type, hour, marked_at in batch:
+            db.query(dirty).filter(
+                dirty.field_id == field_id,
+                dirty.sensor_type == sensor_type,
+                dirty.hour_timestamp == hour,
+                dirty.marked_at <= marked_at,
+            ).delete(synchronize_session=False)
+        db.commit()
+        processed += len(batch)
+        last_key = (batch[-1][2], batch[-1][0], batch[-1][1])
+
+
+def advance_watermark(
+    db: Session, now: Optional[datetime] = None, max_hours: Optional[int] = None, tier: Tier = HOUR_TIER
+) -> Tuple[Optional[datetime], int]:
+    """
+    Roll up the `tier` buckets that closed since its watermark, at most
+    `max_hours` worth (but at least one bucket) per call, and move the
+    watermark past them. Returns the new watermark and how many rollup rows
+    were written.
+
+    Watermarks never pass the last closed hour, even for the minute tier:
+    late readings are only marked dirty in closed hours (see `mark_dirty`),
+    so minutes of the open hour must not be rolled up yet.
+    """
+    now = now or datetime.utcnow()
+    span = max((max_hours or ROLLUP_MAX_HOURS_PER_RUN) * HOUR, tier.width)
+    target = floor_to(now - timedelta(seconds=ROLLUP_DELAY_SECONDS), max(tier.width, HOUR))
+    watermark = get_watermark(db, tier)
+    if watermark is None:
+        first = db.query(func.min(models.SensorReading.timestamp)).scalar()
+        watermark = floor_to(first, tier.width) if first else target
+    if watermark >= target:
+        _set_watermark(db, tier, watermark)
+        db.commit()
+        return watermark, 0
+
+    end = min(target, floor_to(watermark + span, tier.width))
+    written = rollup_range(db, watermark, end, tier)
+    _set_watermark(db, tier, end)
+    db.commit()
+    return end, written
+
+
+def run_incremental(db: Session, now: Optional[datetime] = None) -> dict:
+    """Advance the watermark of every tier, then recompute dirty hours. Returns a summary."""
+    tiers = {}
+    for tier in TIERS:
+        watermark, written = advance_watermark(db, now, tier=tier)
+        tiers[tier.name] = {'watermark': watermark.isoformat() if watermark else None, 'rows_written': written}
+    dirty = process_dirty_hours(db)
+    return {
+        'watermark': tiers[HOUR_TIER.name]['watermark'],
+        'rows_written': sum(t['rows_written'] for t in tiers.values()),
+        'dirty_hours': dirty,
+        'tiers': tiers,
+    }
+
+
+def plan_ranges(
+    start: datetime,
+    end: datetime,
+    watermarks: Dict[str, Optional[datetime]],
+    dirty: Set[datetime],
+    tiers: Sequence[Tier] = TIERS,
+    horizons: Optional[Dict[str, Optional[datetime]]] = None,
+) -> Tuple[Dict[str, List[Tuple[datetime, datetime]]], List[Tuple[datetime, datetime, bool]]]:
+    """
+    Cover `[start, end]` with whole, up-to-date rollup buckets, coarsest tier first.
+
+    A bucket is usable when it lies inside the range, before its tier's
+    watermark, at or after its tier's retention horizon (if any), and
+    overlaps no dirty hour. Whatever a tier can't cover is
+    handed to the next finer one, and the rest to raw readings. Returns the
+    merged `[from, to)` bucket ranges per tier name, in time order, and the
+    raw `(from, to, to_inclusive)` intervals. Aware `start` and `end` are
+    converted to naive UTC first.
+    """
+    start, end = naive_utc(start), naive_utc(end)
+    ranges: Dict[str, List[Tuple[datetime, datetime]]] = {tier.name: [] for tier in tiers}
+    raw: List[Tuple[datetime, datetime, bool]] = []
+
+    def cover(lo: datetime, hi: datetime, inclusive: bool, remaining: Sequence[Tier]) -> None:
+        if lo > hi or (lo == hi and not inclusive):
+            return
+        if not remaining:
+            raw.append((lo, hi, inclusive))
+            return
+        tier, finer = remaining[-1], remaining[:-1]
+        watermark = watermarks.get(tier.name)
+        first, last = ceil_to(lo, tier.width), floor_to(hi, tier.width)
+        horizon = (horizons or {}).get(tier.name)
+        if horizon is not None:
+            first = max(first, ceil_to(horizon, tier.width))
+        if watermark is not None:
+            last = min(last, floor_to(watermark, tier.width))
+        if watermark is None or first >= last:
+            cover(lo, hi, inclusive, finer)
+            return
+
+        # A dirty hour invalidates the buckets it overlaps: its day, itself, or its minutes.
+        stale = sorted(
+            (max(floor_to(hour, tier.width), first), min(max(floor_to(hour, tier.width) + tier.width, hour + HOUR), last))
+            for hour in dirty if first < hour + HOUR and hour < last
+        )
+        cover(lo, first, False, finer)
+        cursor = first
+        for stale_start, stale_end in stale:
+            if stale_end <= cursor:
+                continue
+            if cursor < stale_start:
+                ranges[tier.name].append((cursor, stale_start))
+            cover(max(stale_start, cursor), stale_end, False, finer)
+            cursor = stale_end
+        if cursor < last:
+            ranges[tier.name].append((cursor, last))
+        cover(last, hi, inclusive, finer)
+
+    cover(start, end, True, tuple(tiers))
+    merged = {}
+    for name, tier_ranges in ranges.items():
+        merged[name] = []
+        for range_start, range_end in tier_ranges:
+            if merged[name] and merged[name][-1][1] == range_start:
+                merged[name][-1] = (merged[name][-1][0], range_end)
+            else:
+                merged[name].append((range_start, range_end))
+    return merged, raw
+
+
+def rebuild(db: Session, start: datetime, end: datetime) -> int:
+    """
+    Replace the rollups of every tier in `[start, end)` with freshly computed
+    ones, in one transaction. Days that overlap the range are rebuilt whole;
+    spans whose raw readings have been pruned are left alone. Returns the
+    number of hourly rows written.
+    """
+    written = {}
+    for tier in TIERS:
+        tier_start, tier_end = floor_to(floor_hour(start), tier.width), ceil_to(floor_hour(end), tier.width)
+        db.query(tier.model).filter(
+            tier.bucket >= tier_start,
+            tier.bucket < tier_end,
+            *_retained(db, tier.model.sensor_type, tier.bucket),
+        ).delete(synchronize_session=False)
+        written[tier.name] = rollup_range(db, tier_start, tier_end, tier)
+    db.commit()
+    return written[HOUR_TIER.name]
+
+
+def backfill_chunks(start: datetime, end: datetime, chunk_hours: Optional[int] = None) -> List[Tuple[datetime, datetime]]:
+    """Split `[start, end)` into hour-aligned chunks of `chunk_hours`."""
+    step = (chunk_hours or BACKFILL_CHUNK_HOURS) * HOUR
+    cursor, end = floor_hour(start), floor_hour(end)
+    chunks = []
+    while cursor < end:
+        chunks.append((cursor, min(cursor + step, end)))
+        cursor += step
+    return chunks
+
+
+def backfill(session_factory, start: datetime, end: datetime, workers: int = 4, chunk_hours: Optional[int] = None) -> int:
+    """Rebuild `[start, end)` in parallel chunks, each in its own session. Returns hourly rows written."""
+    def run(chunk):
+        with session_factory() as db:
+            return rebuild(db, *chunk)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return sum(pool.map(run, backfill_chunks(start, end, chunk_hours)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Maintain minute, hourly and daily rollups.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("run", help="advance the watermarks and recompute dirty hours")
+    backfill_parser = commands.add_parser("backfill", help="rebuild rollups for a date range")
+    backfill_parser.add_argument("--start", type=datetime.fromisoformat, required=True)
+    backfill_parser.add_argument("--end", type=datetime.fromisoformat, required=True)
+    backfill_parser.add_argument("--workers", type=int, default=4)
+    backfill_parser.add_argument("--chunk-hours", type=int, default=BACKFILL_CHUNK_HOURS)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    if args.command == "run":
+        with database.SessionLocal() as db:
+            print(run_incremental(db))
+    else:
+        written = backfill(database.SessionLocal, args.start, args.end, args.workers, args.chunk_hours)
+        print(f"Rebuilt {written} hourly rollups between {args.start} and {args.end}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,14 @@
 import datetime
-import csv
-import io
 from fastapi import APIRouter, Depends, HTTPException, Query, UploadFile, File
 from fastapi.responses import JSONResponse
 from sqlalchemy.orm import Session
 from celery.result import AsyncResult
-from typing import Dict
+from typing import Dict, List
 
-from .. import crud, schemas, database
+from .. import crud, schemas, database, staging, charts
+from ..cache import cache, window_end
 from worker.celery_app import celery_app
-from worker.tasks import process_csv_file
+from worker.tasks import chunk_progress, process_csv_file
 
 router = APIRouter(
     prefix="/api/v1",
@@ -21,27 +20,42 @@ async def create_bulk_sensor_readings(
     file: UploadFile = File(...),
 ):
     """
-    Accepts a CSV file, starts a background processing task, and returns a task ID.
+    Accepts a CSV file, stages it on disk, starts a background processing task, and returns a task ID.
     """
     if not file.filename.endswith('.csv'):
         raise HTTPException(status_code=400, detail="Invalid file type. Please upload a CSV.")
     
-    csv_content = (await file.read()).decode('utf-8')
-    task = process_csv_file.delay(csv_content)
+    staged_path = await staging.spool_upload(file)
+    task = process_csv_file.delay(staged_path)
     
     return JSONResponse({"task_id": task.id})
 
+def _combined_chunk_status(dispatch: Dict):
+    """
+    Combine the progress of a parallel CSV import from its chunk tasks,
+    or return the chord callback's result once every chunk has finished.
+    """
+    callback = AsyncResult(dispatch["callback_id"], app=celery_app)
+    if callback.ready():
+        return callback.status, callback.result
+    return "PROGRESS", chunk_progress(dispatch)
+
 @router.get("/tasks/{task_id}")
 def get_task_status(task_id: str):
     """
     Retrieves the status of a background task.
+    Parallel CSV imports report the combined progress of all their chunks.
     """
     task_result = AsyncResult(task_id, app=celery_app)
-    
+    status, result = task_result.status, task_result.result
+
+    if status == "SUCCESS" and isinstance(result, dict) and "callback_id" in result:
+        status, result = _combined_chunk_status(result)
+
     response = {
         "task_id": task_id,
-        "status": task_result.status,
-        "result": task_result.result
+        "status": status,
+        "result": result
     }
     return JSONResponse(response)
 
@@ -63,12 +77,18 @@ def read_analytics(
     end: datetime.datetime = Query(None)
 ):
     """
-    Gets aggregated analytics for a sensor.
+    Gets aggregated analytics for a sensor. Responses are cached until new
+    readings for the same field and sensor type arrive.
     """
-    if end is None: end = datetime.datetime.utcnow()
+    if end is None: end = window_end()
     if start is None: start = end - datetime.timedelta(days=1)
-    analytics_data = crud.get_analytics(db, field_id=field_id, sensor_type=sensor_type, start_time=start, end_time=end)
-    if not analytics_data or analytics_data.count == 0:
+
+    def compute():
+        analytics_data = crud.get_analytics(db, field_id=field_id, sensor_type=sensor_type, start_time=start, end_time=end)
+        return analytics_data.model_dump() if analytics_data else None
+
+    analytics_data = cache.get_or_compute("analytics", field_id, [sensor_type], (start.isoformat(), end.isoformat()), compute)
+    if not analytics_data or analytics_data["count"] == 0:
         raise HTTPException(status_code=404, detail="No data found for the specified criteria")
     return analytics_data
 
@@ -76,24 +96,19 @@ def read_analytics(
 def get_chart_data(
     db: Session = Depends(database.get_db),
     field_id: int = Query(1),
-    hours: int = Query(24)
+    hours: int = Query(24),
+    max_points: int = Query(charts.DEFAULT_MAX_POINTS, ge=1, le=10000),
+    resolution: int = Query(None, ge=1),
+    sensor_types: List[str] = Query(charts.DEFAULT_SENSOR_TYPES)
 ):
     """
-    Provides data formatted for time-series charts.
+    Provides data formatted for time-series charts, aggregated into at most
+    `max_points` time buckets (or buckets of `resolution` seconds).
     """
-    end_time = datetime.datetime.utcnow()
+    end_time = window_end()
     start_time = end_time - datetime.timedelta(hours=hours)
-    temp_readings = crud.get_readings_for_chart(db, field_id, "temperature", start_time, end_time)
-    moisture_readings = crud.get_readings_for_chart(db, field_id, "soil_moisture", start_time, end_time)
-    
-    combined_data: Dict[str, Dict] = {}
-    for ts, value in temp_readings:
-        time_key = ts.strftime('%Y-%m-%d %H:%M')
-        if time_key not in combined_data: combined_data[time_key] = {'time': ts.strftime('%H:%M')}
-        combined_data[time_key]['temperature'] = value
-    for ts, value in moisture_readings:
-        time_key = ts.strftime('%Y-%m-%d %H:%M')
-        if time_key not in combined_data: combined_data[time_key] = {'time': ts.strftime('%H:%M')}
-        combined_data[time_key]['soil_moisture'] = value
-        
-    return sorted(list(combined_data.values()), key=lambda x: x['time'])
+    width = charts.bucket_seconds(hours, max_points, resolution)
+    return cache.get_or_compute(
+        "chart", field_id, sensor_types, (start_time.isoformat(), end_time.isoformat(), width),
+        lambda: charts.get_chart_data(db, field_id, sensor_types, start_time, end_time, width)
+    )
@@ -1,6 +1,6 @@
 from pydantic import BaseModel, ConfigDict
 from datetime import datetime
-from typing import List
+from typing import Dict, List, Literal, Optional, Union
 
 class SensorReadingCreate(BaseModel):
     field_id: int
@@ -19,13 +19,54 @@ class SensorReading(BaseModel):
     unit: str
     timestamp: datetime
 
+class SensorReadingPage(BaseModel):
+    items: List[SensorReading]
+    next_cursor: Optional[str] = None
+
 class SensorReadingBulk(BaseModel):
     readings: List[SensorReadingCreate]
 
+class BatchItemError(BaseModel):
+    index: int
+    detail: str
+
+class BatchIngestResult(BaseModel):
+    accepted: int
+    rejected: int
+    errors: List[BatchItemError]
+
 class AnalyticsData(BaseModel):
     model_config = ConfigDict(from_attributes=True)
 
     min: float
     max: float
     avg: float
+    stddev: Optional[float] = None
+    count: int
+
+class SeriesAnalytics(AnalyticsData):
+    field_id: int
+    sensor_type: str
+
+class AnalyticsQuery(BaseModel):
+    field_ids: Union[List[int], Literal["all"]] = "all"
+    sensor_types: Union[List[str], Literal["all"]] = "all"
+    start: Optional[datetime] = None
+    end: Optional[datetime] = None
+
+class ThresholdBreaches(BaseModel):
+    count: int
+    last_at: Optional[datetime] = None
+
+class SeriesStatistics(BaseModel):
+    field_id: int
+    sensor_type: str
     count: int
+    min: float
+    max: float
+    avg: float
+    stddev: float
+    percentiles: Dict[str, float]
+    trend_per_hour: Optional[float] = None
+    max_rate_per_hour: Optional[float] = None
+    breaches: ThresholdBreaches
@@ -0,0 +1,39 @@
+import os
+import tempfile
+
+STAGING_DIR = os.getenv(
+    "UPLOAD_STAGING_DIR",
+    os.path.join(tempfile.gettempdir(), "field_insights_uploads")
+)
+CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+
+
+async def spool_upload(file, directory: str = None) -> str:
+    """
+    Copy an upload to a staging file chunk by chunk and return its path.
+
+    Only one chunk is held in memory at a time, so the path can be handed to
+    a worker instead of the file contents.
+    """
+    directory = directory or STAGING_DIR
+    os.makedirs(directory, exist_ok=True)
+    fd, path = tempfile.mkstemp(suffix=".csv", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as staged:
+            while True:
+                chunk = await file.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                staged.write(chunk)
+    except Exception:
+        os.unlink(path)
+        raise
+    return path
+
+
+def discard(path: str) -> None:
+    """Remove a staged upload once it has been processed."""
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,143 @@
+"""
+Benchmark the vectorized advanced analytics against a row-at-a-time baseline.
+
+The baseline is how these statistics are computed without `app.advanced`:
+one ORM query per series, then Python loops over the returned rows. Both
+run against the same synthetic SQLite database in a temporary directory.
+
+    python -m benchmarks.bench_advanced_analytics --fields 20 --readings 2000
+
+Run from the Backend directory. Results are printed as JSON.
+"""
+import argparse
+import json
+import math
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app import advanced, ingest, models
+
+SENSOR_TYPES = ("temperature", "humidity", "soil_moisture")
+START = datetime(2024, 1, 1)
+
+
+def seed(db, fields: int, readings: int, seed: int = 0) -> None:
+    """Insert `readings` random-walk readings per (field, sensor type), one a minute."""
+    rng = random.Random(seed)
+    ingest.upsert_fields(db, range(1, fields + 1))
+    for field_id in range(1, fields + 1):
+        rows = []
+        for sensor_type in SENSOR_TYPES:
+            value = rng.uniform(10, 30)
+            for i in range(readings):
+                value += rng.gauss(0, 0.5)
+                rows.append({
+                    'field_id': field_id,
+                    'sensor_type': sensor_type,
+                    'value': value,
+                    'unit': 'u',
+                    'timestamp': START + timedelta(minutes=i),
+                })
+        ingest.insert_readings(db, rows)
+    db.commit()
+
+
+def row_at_a_time(db, field_ids, sensor_types, start, end, qs, window_seconds, above):
+    """The same statistics, one query per series and a Python loop per reading."""
+    results = []
+    for field_id in field_ids:
+        for sensor_type in sensor_types:
+            rows = db.query(models.SensorReading).filter(
+                models.SensorReading.field_id == field_id,
+                models.SensorReading.sensor_type == sensor_type,
+                models.SensorReading.timestamp >= start,
+                models.SensorReading.timestamp <= end,
+            ).order_by(models.SensorReading.timestamp).all()
+            if not rows:
+                continue
+            values = [r.value for r in rows]
+            ordered = sorted(values)
+            percentiles = {}
+            for q in qs:
+                position = q / 100 * (len(ordered) - 1)
+                low, high = math.floor(position), math.ceil(position)
+                percentiles[f"p{q:g}"] = ordered[low] + (ordered[high] - ordered[low]) * (position - low)
+            max_rate, breaches, window = None, 0, []
+            for previous, reading in zip([None] + rows, rows):
+                if previous is not None:
+                    elapsed = (reading.timestamp - previous.timestamp).total_seconds()
+                    if elapsed > 0:
+                        rate = abs(reading.value - previous.value) / elapsed * 3600
+                        max_rate = rate if max_rate is None else max(max_rate, rate)
+                window.append(reading)
+                while (reading.timestamp - window[0].timestamp).total_seconds() >= window_seconds:
+                    window.pop(0)
+                if statistics.fmean(r.value for r in window) > above:
+                    breaches += 1
+            hours = [(r.timestamp - start).total_seconds() / 3600 for r in rows]
+            results.append({
+                'field_id': field_id,
+                'sensor_type': sensor_type,
+                'count': len(values),
+                'avg': statistics.fmean(values),
+                'stddev': statistics.pstdev(values),
+                'percentiles': percentiles,
+                'trend_per_hour': statistics.linear_regression(hours, values).slope if len(values) > 1 else None,
+                'max_rate_per_hour': max_rate,
+                'breaches': breaches,
+            })
+    return results
+
+
+def timed(fn, repeat: int) -> float:
+    """Median wall time of `repeat` calls, in seconds."""
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - started)
+    return statistics.median(times)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--fields", type=int, default=20)
+    parser.add_argument("--readings", type=int, default=2000, help="readings per series")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        models.Base.metadata.create_all(engine)
+        Session = sessionmaker(bind=engine)
+        with Session() as db:
+            seed(db, args.fields, args.readings)
+            fields, end = list(range(1, args.fields + 1)), START + timedelta(minutes=args.readings)
+            qs = advanced.DEFAULT_PERCENTILES
+            vectorized = timed(
+                lambda: advanced.get_advanced_analytics(db, fields, SENSOR_TYPES, START, end, qs, 3600, above=25.0),
+                args.repeat,
+            )
+            baseline = timed(lambda: row_at_a_time(db, fields, SENSOR_TYPES, START, end, qs, 3600, 25.0), args.repeat)
+        engine.dispose()
+
+    json.dump({
+        'series': args.fields * len(SENSOR_TYPES),
+        'readings': args.fields * len(SENSOR_TYPES) * args.readings,
+        'row_at_a_time_seconds': round(baseline, 4),
+        'vectorized_seconds': round(vectorized, 4),
+        'speedup': round(baseline / vectorized, 1),
+    }, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
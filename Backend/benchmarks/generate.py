@@ -0,0 +1,126 @@
+"""
+Deterministic synthetic sensor data.
+
+Every (field, sensor type) series is a daily cycle plus a seeded random walk,
+sampled every `interval_seconds` and emitted in time order, so the same
+arguments always produce the same readings.
+
+    python -m benchmarks.generate --fields 50 --days 30 --interval 300 --csv readings.csv
+    python -m benchmarks.generate --fields 50 --days 30 --interval 300 --database-url postgresql://...
+
+Run from the Backend directory.
+"""
+import argparse
+import csv
+import math
+import random
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, Sequence
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app import ingest, models
+
+DEFAULT_SENSOR_TYPES = ("temperature", "soil_moisture", "humidity")
+DEFAULT_START = datetime(2024, 1, 1)
+
+# sensor type: (unit, baseline, daily amplitude, random walk step)
+PROFILES = {
+    "temperature": ("C", 18.0, 6.0, 0.2),
+    "soil_moisture": ("%", 35.0, 3.0, 0.3),
+    "humidity": ("%", 60.0, 15.0, 0.5),
+    "ph": ("pH", 6.5, 0.1, 0.01),
+}
+DEFAULT_PROFILE = ("x", 50.0, 5.0, 0.5)
+
+
+def readings(
+    fields: int,
+    sensor_types: Sequence[str] = DEFAULT_SENSOR_TYPES,
+    interval_seconds: int = 300,
+    days: float = 1,
+    start: datetime = DEFAULT_START,
+    first_field: int = 1,
+    seed: int = 0,
+) -> Iterator[Dict]:
+    """Yield `fields` x `sensor_types` series of readings, time-major, as rows for `ingest.insert_readings`."""
+    series = [
+        (field_id, sensor_type, random.Random(f"{seed}:{field_id}:{sensor_type}"))
+        for field_id in range(first_field, first_field + fields)
+        for sensor_type in sensor_types
+    ]
+    drift = [0.0] * len(series)
+    for step in range(int(days * 86400 // interval_seconds)):
+        timestamp = start + timedelta(seconds=step * interval_seconds)
+        phase = math.sin(2 * math.pi * (timestamp.hour * 3600 + timestamp.minute * 60) / 86400)
+        for i, (field_id, sensor_type, rng) in enumerate(series):
+            unit, baseline, amplitude, walk = PROFILES.get(sensor_type, DEFAULT_PROFILE)
+            drift[i] += rng.gauss(0, walk)
+            yield {
+                'field_id': field_id,
+                'sensor_type': sensor_type,
+                'value': round(baseline + amplitude * phase + drift[i], 3),
+                'unit': unit,
+                'timestamp': timestamp,
+            }
+
+
+def write_csv(path: str, rows: Iterator[Dict]) -> int:
+    """Write rows in the bulk upload CSV format. Returns how many were written."""
+    count = 0
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(ingest.READING_COLUMNS)
+        for row in rows:
+            writer.writerow([row['field_id'], row['sensor_type'], row['value'], row['unit'], row['timestamp'].isoformat()])
+            count += 1
+    return count
+
+
+def load(session_factory, rows: Iterator[Dict], batch_size: int = 50000) -> int:
+    """Bulk insert rows straight into the database, bypassing rollup and cache bookkeeping."""
+    count = 0
+    with session_factory() as db:
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) == batch_size:
+                ingest.upsert_fields(db, {r['field_id'] for r in batch})
+                ingest.insert_readings(db, batch)
+                db.commit()
+                count += len(batch)
+                batch = []
+        ingest.upsert_fields(db, {r['field_id'] for r in batch})
+        ingest.insert_readings(db, batch)
+        db.commit()
+        count += len(batch)
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fields", type=int, default=10)
+    parser.add_argument("--sensor-types", default=",".join(DEFAULT_SENSOR_TYPES))
+    parser.add_argument("--interval", type=int, default=300, help="seconds between readings of a series")
+    parser.add_argument("--days", type=float, default=1)
+    parser.add_argument("--start", type=datetime.fromisoformat, default=DEFAULT_START)
+    parser.add_argument("--seed", type=int, default=0)
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--csv", help="write a bulk upload CSV to this path")
+    target.add_argument("--database-url", help="insert into this database (tables are created if missing)")
+    args = parser.parse_args(argv)
+
+    rows = readings(
+        args.fields, args.sensor_types.split(","), args.interval, args.days, args.start, seed=args.seed
+    )
+    if args.csv:
+        print(f"Wrote {write_csv(args.csv, rows)} readings to {args.csv}.")
+    else:
+        engine = create_engine(args.database_url)
+        models.Base.metadata.create_all(bind=engine)
+        print(f"Inserted {load(sessionmaker(bind=engine), rows)} readings.")
+
+
+if __name__ == "__main__":
+    main()
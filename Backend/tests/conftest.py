@@ -1,21 +1,31 @@
+import os
+import tempfile
+
 import pytest
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy.pool import StaticPool
+from sqlalchemy.pool import NullPool
 
 from app.main import app, database
 from app.models import Base
+from app.cache import cache
 
-TEST_SQLALCHEMY_DATABASE_URL = "sqlite:///:memory:"
+# A file database, so the sync engine and the aiosqlite engine share the data.
+_db_dir = tempfile.TemporaryDirectory()
+TEST_DATABASE_PATH = os.path.join(_db_dir.name, "test.db")
+TEST_SQLALCHEMY_DATABASE_URL = f"sqlite:///{TEST_DATABASE_PATH}"
 
 engine = create_engine(
     TEST_SQLALCHEMY_DATABASE_URL,
     connect_args={"check_same_thread": False},
-    poolclass=StaticPool,
 )
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+async_engine = create_async_engine(database.async_database_url(TEST_SQLALCHEMY_DATABASE_URL), poolclass=NullPool)
+AsyncTestingSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+
 def override_get_db():
     """Dependency override to use the in-memory test database."""
     db = TestingSessionLocal()
@@ -24,7 +34,13 @@ def override_get_db():
     finally:
         db.close()
 
+async def override_get_async_db():
+    """Dependency override to use the test database through the async driver."""
+    async with AsyncTestingSessionLocal() as db:
+        yield db
+
 app.dependency_overrides[database.get_db] = override_get_db
+app.dependency_overrides[database.get_async_db] = override_get_async_db
 
 @pytest.fixture()
 def client():
@@ -32,7 +48,20 @@ def client():
     A fixture that creates a fresh, empty database for every single test.
     """
     Base.metadata.create_all(bind=engine)
+    cache.clear()
     with TestClient(app) as c:
         yield c
     Base.metadata.drop_all(bind=engine)
 
+@pytest.fixture()
+def db_session():
+    """
+    A fixture that yields a session on a fresh, empty database.
+    """
+    Base.metadata.create_all(bind=engine)
+    db = TestingSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+        Base.metadata.drop_all(bind=engine)
@@ -0,0 +1,267 @@
+import statistics
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import advanced, charts, crud, ingest, models, rollups
+
+
+def _seed_readings(db, start, hours, per_hour=6):
+    """Insert `per_hour` readings per hour for field 1 temperature, starting at `start`."""
+    rows = []
+    for i in range(hours * per_hour):
+        rows.append({
+            'field_id': 1,
+            'sensor_type': 'temperature',
+            'value': float((i * 7) % 31),
+            'unit': 'C',
+            'timestamp': start + timedelta(minutes=i * 60 // per_hour),
+        })
+    ingest.upsert_fields(db, [1])
+    ingest.insert_readings(db, rows)
+    db.commit()
+    return rows
+
+
+def _assert_matches(result, values):
+    assert result.count == len(values)
+    assert result.min == min(values)
+    assert result.max == max(values)
+    assert result.avg == pytest.approx(sum(values) / len(values))
+
+
+def test_analytics_planner_matches_raw(db_session):
+    """
+    Test that combining hourly rollups with raw edge hours gives the raw result,
+    including after late data lands in an hour that was already rolled up.
+    """
+    start = datetime(2024, 1, 1)
+    rows = _seed_readings(db_session, start, hours=6)
+    query_start, query_end = start + timedelta(minutes=25), start + timedelta(hours=5, minutes=15)
+
+    rollups.advance_watermark(db_session, now=start + timedelta(hours=4, minutes=5))
+    assert rollups.get_watermark(db_session) == start + timedelta(hours=4)
+    assert db_session.query(models.HourlyAnalytics).count() == 4
+
+    in_range = [r['value'] for r in rows if query_start <= r['timestamp'] <= query_end]
+    _assert_matches(crud.get_analytics(db_session, 1, 'temperature', query_start, query_end), in_range)
+
+    late = "field_id,sensor_type,value,unit,timestamp\n1,temperature,99,C,2024-01-01T02:30:00\n"
+    ingest.ingest_csv(db_session, late.splitlines(keepends=True))
+    assert db_session.query(models.RollupDirtyHour).count() == 1
+    _assert_matches(crud.get_analytics(db_session, 1, 'temperature', query_start, query_end), in_range + [99.0])
+
+    assert rollups.process_dirty_hours(db_session) == 1
+    assert db_session.query(models.RollupDirtyHour).count() == 0
+    hour = db_session.query(models.HourlyAnalytics).filter_by(hour_timestamp=start + timedelta(hours=2)).one()
+    assert hour.max_value == 99 and hour.reading_count == 7
+    _assert_matches(crud.get_analytics(db_session, 1, 'temperature', query_start, query_end), in_range + [99.0])
+
+
+def test_rollups_are_idempotent(db_session):
+    """
+    Test that re-running and rebuilding rollups never duplicates hours.
+    """
+    start = datetime(2024, 1, 1)
+    _seed_readings(db_session, start, hours=3)
+
+    rollups.advance_watermark(db_session, now=start + timedelta(hours=3, minutes=5))
+    rollups.rollup_range(db_session, start, start + timedelta(hours=3))
+    db_session.commit()
+    assert rollups.backfill(lambda: db_session, start, start + timedelta(hours=3), workers=1, chunk_hours=2) == 3
+    assert db_session.query(models.HourlyAnalytics).count() == 3
+
+
+def test_analytics_planner_no_data(db_session):
+    """
+    Test that an empty range returns None.
+    """
+    assert crud.get_analytics(db_session, 1, 'temperature', datetime(2024, 1, 1), datetime(2024, 1, 2)) is None
+
+
+def test_tiered_rollups_match_raw(db_session):
+    """
+    Test that analytics and charts served from minute, hour and day rollups
+    match the raw data, including stddev and a dirty hour inside a rolled-up day.
+    """
+    start = datetime(2024, 1, 1)
+    rows = _seed_readings(db_session, start, hours=72, per_hour=12)
+    now = start + timedelta(hours=72, minutes=5)
+    for tier in rollups.TIERS:
+        rollups.advance_watermark(db_session, now=now, tier=tier)
+    assert rollups.get_watermarks(db_session) == {
+        'minute': start + timedelta(hours=72),
+        'hour': start + timedelta(hours=72),
+        'day': start + timedelta(days=3),
+    }
+    assert db_session.query(models.DailyAnalytics).count() == 3
+
+    late = "field_id,sensor_type,value,unit,timestamp\n1,temperature,99,C,2024-01-02T05:30:00\n"
+    ingest.ingest_csv(db_session, late.splitlines(keepends=True))
+    rows.append({'value': 99.0, 'timestamp': datetime(2024, 1, 2, 5, 30)})
+
+    query_start, query_end = start + timedelta(hours=3, minutes=17, seconds=30), start + timedelta(hours=70, minutes=42)
+    in_range = [r['value'] for r in rows if query_start <= r['timestamp'] <= query_end]
+    ranges, raw = rollups.plan_ranges(
+        query_start, query_end, rollups.get_watermarks(db_session), {datetime(2024, 1, 2, 5)}
+    )
+    assert ranges['day'] == []
+    assert ranges['hour'] == [(datetime(2024, 1, 1, 4), datetime(2024, 1, 2, 5)), (datetime(2024, 1, 2, 6), datetime(2024, 1, 3, 22))]
+    assert raw == [
+        (query_start, datetime(2024, 1, 1, 3, 18), False),
+        (datetime(2024, 1, 2, 5), datetime(2024, 1, 2, 6), False),
+        (query_end, query_end, True),
+    ]
+    result = crud.get_analytics(db_session, 1, 'temperature', query_start, query_end)
+    _assert_matches(result, in_range)
+    assert result.stddev == pytest.approx(statistics.pstdev(in_range))
+
+    assert rollups.process_dirty_hours(db_session) == 1
+    day = db_session.query(models.DailyAnalytics).filter_by(day_timestamp=datetime(2024, 1, 2)).one()
+    assert day.max_value == 99 and day.reading_count == 24 * 12 + 1
+    _assert_matches(crud.get_analytics(db_session, 1, 'temperature', start, start + timedelta(days=3)), [r['value'] for r in rows])
+
+    points = charts.get_chart_data(db_session, 1, ['temperature'], start, now, 3600)
+    hours = [[r['value'] for r in rows if start + timedelta(hours=h) <= r['timestamp'] < start + timedelta(hours=h + 1)] for h in range(72)]
+    assert [p['temperature_max'] for p in points] == [max(values) for values in hours]
+    assert [p['temperature'] for p in points] == pytest.approx([sum(values) / len(values) for values in hours])
+
+
+def test_default_chart_widths_use_rollups(db_session):
+    """
+    Test that default chart widths are whole minutes, hours or days, and that
+    a default 24h chart is filled from the minute rollups.
+    """
+    assert charts.bucket_seconds(24) == 120
+    assert charts.bucket_seconds(720) == 2640
+    assert charts.bucket_seconds(24 * 365 * 5, max_points=1000) == 2 * 86400
+    assert charts.bucket_seconds(1, max_points=3600) == 1
+
+    start = datetime(2024, 1, 1)
+    rows = _seed_readings(db_session, start, hours=24, per_hour=60)
+    now = start + timedelta(hours=24, minutes=5)
+    rollups.run_incremental(db_session, now=now)
+    # Drop the raw readings: whatever the chart still shows comes from the rollups.
+    db_session.query(models.SensorReading).delete()
+    db_session.commit()
+
+    width = charts.bucket_seconds(24)
+    assert rollups.tier_for_width(width) is rollups.MINUTE_TIER
+    columns = charts.get_chart_columns(db_session, 1, ['temperature'], start, now, width)
+    assert len(columns['t']) == 24 * 3600 // width
+    assert columns['temperature_max'][0] == max(r['value'] for r in rows[:2])
+
+
+def test_late_reading_in_open_hour_is_not_lost(db_session):
+    """
+    Test that a late reading for a minute of the still-open hour is counted
+    by analytics and by the minute rollups once that hour closes.
+    """
+    start = datetime(2024, 1, 1)
+    rows = _seed_readings(db_session, start, hours=2, per_hour=12)
+    now = start + timedelta(hours=1, minutes=40)
+    rollups.run_incremental(db_session, now=now)
+    assert rollups.get_watermarks(db_session)['minute'] == start + timedelta(hours=1)
+
+    late = "field_id,sensor_type,value,unit,timestamp\n1,temperature,99,C,2024-01-01T01:05:30\n"
+    ingest.ingest_csv(db_session, late.splitlines(keepends=True))
+    rows.append({'value': 99.0, 'timestamp': datetime(2024, 1, 1, 1, 5, 30)})
+    in_range = [r['value'] for r in rows if r['timestamp'] <= now]
+    _assert_matches(crud.get_analytics(db_session, 1, 'temperature', start, now), in_range)
+
+    rollups.run_incremental(db_session, now=start + timedelta(hours=2, minutes=5))
+    minute = db_session.query(models.MinuteAnalytics).filter_by(minute_timestamp=datetime(2024, 1, 1, 1, 5)).one()
+    assert minute.reading_count == 2 and minute.max_value == 99
+    _assert_matches(crud.get_analytics(db_session, 1, 'temperature', start, now), in_range)
+
+
+def test_advanced_analytics_match_per_series_reference(db_session):
+    """
+    Test that the vectorized statistics of several series fetched together
+    match a straightforward per-series computation.
+    """
+    start = datetime(2024, 1, 1)
+    rows = []
+    for field_id in (1, 2):
+        for sensor_type, step in (('humidity', 3), ('temperature', 7)):
+            for i in range(40 + field_id):
+                rows.append({
+                    'field_id': field_id,
+                    'sensor_type': sensor_type,
+                    'value': float((i * step + field_id) % 23),
+                    'unit': 'u',
+                    'timestamp': start + timedelta(minutes=5 * i),
+                })
+    ingest.upsert_fields(db_session, [1, 2])
+    ingest.insert_readings(db_session, rows)
+    db_session.commit()
+
+    result = advanced.get_advanced_analytics(
+        db_session, [1, 2], ['humidity', 'temperature'], start, start + timedelta(days=1),
+        qs=[0, 25, 50, 90, 100], window_seconds=900, above=15,
+    )
+    assert [(r['field_id'], r['sensor_type']) for r in result] == [
+        (1, 'humidity'), (1, 'temperature'), (2, 'humidity'), (2, 'temperature'),
+    ]
+    for series in result:
+        ordered = sorted(
+            (r for r in rows if (r['field_id'], r['sensor_type']) == (series['field_id'], series['sensor_type'])),
+            key=lambda r: r['timestamp'],
+        )
+        values = [r['value'] for r in ordered]
+        hours = [(r['timestamp'] - start).total_seconds() / 3600 for r in ordered]
+        assert series['count'] == len(values)
+        assert series['avg'] == pytest.approx(statistics.fmean(values))
+        assert series['stddev'] == pytest.approx(statistics.pstdev(values))
+        quartiles = statistics.quantiles(values, n=4, method='inclusive')
+        assert series['percentiles']['p25'] == pytest.approx(quartiles[0])
+        assert series['percentiles']['p50'] == pytest.approx(statistics.median(values))
+        assert (series['percentiles']['p0'], series['percentiles']['p100']) == (min(values), max(values))
+        assert series['trend_per_hour'] == pytest.approx(statistics.linear_regression(hours, values).slope)
+        assert series['max_rate_per_hour'] == pytest.approx(
+            max(abs(b - a) * 12 for a, b in zip(values, values[1:]))
+        )
+        windows = [statistics.fmean(values[max(i - 2, 0):i + 1]) for i in range(len(values))]
+        breaches = [r['timestamp'] for r, mean in zip(ordered, windows) if mean > 15]
+        assert series['breaches']['count'] == len(breaches)
+        assert series['breaches']['last_at'] == (breaches[-1] if breaches else None)
+
+
+def test_fleet_analytics_match_per_series_analytics(db_session):
+    """
+    Test that one grouped query over rollups and raw edges gives the same
+    aggregates as per-series analytics, with a dirty hour in one series.
+    """
+    start = datetime(2024, 1, 1)
+    rows = [
+        {
+            'field_id': field_id,
+            'sensor_type': sensor_type,
+            'value': float((i * (field_id + 3)) % 19),
+            'unit': 'u',
+            'timestamp': start + timedelta(minutes=7 * i),
+        }
+        for field_id in (1, 2, 3)
+        for sensor_type in ('humidity', 'temperature')
+        for i in range(300)
+    ]
+    ingest.upsert_fields(db_session, [1, 2, 3])
+    ingest.insert_readings(db_session, rows)
+    db_session.commit()
+    rollups.run_incremental(db_session, now=start + timedelta(days=2))
+    late = "field_id,sensor_type,value,unit,timestamp\n2,humidity,77,C,2024-01-01T10:30:00\n"
+    ingest.ingest_csv(db_session, late.splitlines(keepends=True))
+
+    query_start, query_end = start + timedelta(minutes=13), start + timedelta(hours=30, minutes=2)
+    fleet = list(crud.get_fleet_analytics(db_session, [1, 2], None, query_start, query_end))
+    assert [(r.field_id, r.sensor_type) for r in fleet] == [
+        (1, 'humidity'), (1, 'temperature'), (2, 'humidity'), (2, 'temperature'),
+    ]
+    for result in fleet:
+        single = crud.get_analytics(db_session, result.field_id, result.sensor_type, query_start, query_end)
+        assert (result.min, result.max, result.count) == (single.min, single.max, single.count)
+        assert result.avg == pytest.approx(single.avg)
+        assert result.stddev == pytest.approx(single.stddev)
+    assert fleet[2].max == 77
+
+    assert [r.sensor_type for r in crud.get_fleet_analytics(db_session, None, ['temperature'], query_start, query_end)] == ['temperature'] * 3
@@ -60,8 +60,530 @@ def test_bulk_upload_csv(client: TestClient):
     )
 
     assert response.status_code == 200
-    assert response.json() == {"message": "Successfully ingested 2 readings from CSV."}
+    assert response.json()["message"] == "Successfully ingested 2 readings from CSV."
+    assert response.json()["rows_per_sec"] >= 0
 
     analytics_response = client.get("/api/v1/analytics?field_id=1&sensor_type=temperature")
     assert analytics_response.status_code == 200
     assert analytics_response.json()["count"] == 1
+
+def test_bulk_upload_csv_in_batches(client: TestClient, monkeypatch):
+    """
+    Test that a CSV spanning several batches and fields is fully ingested.
+    """
+    from io import BytesIO
+    from app import ingest
+
+    monkeypatch.setattr(ingest, "DEFAULT_BATCH_SIZE", 2)
+    client.post("/api/v1/sensors", json={"field_id": 1, "sensor_type": "temperature", "value": 10, "unit": "C"})
+
+    rows = [f"{field_id},temperature,{value},C,2024-01-01T00:0{value}:00Z" for field_id in (1, 2) for value in range(5)]
+    csv_content = "field_id,sensor_type,value,unit,timestamp\n" + "\n".join(rows)
+    response = client.post(
+        "/api/v1/sensors/bulk",
+        files={"file": ("batches.csv", BytesIO(csv_content.encode('utf-8')), "text/csv")}
+    )
+    assert response.status_code == 200
+    assert response.json()["message"] == "Successfully ingested 10 readings from CSV."
+
+    analytics_response = client.get(
+        "/api/v1/analytics?field_id=2&sensor_type=temperature&start=2024-01-01T00:00:00&end=2024-01-01T01:00:00"
+    )
+    assert analytics_response.status_code == 200
+    assert analytics_response.json()["count"] == 5
+    assert analytics_response.json()["max"] == 4
+
+def test_bulk_upload_csv_invalid_row(client: TestClient):
+    """
+    Test that a malformed row is reported with its line number.
+    """
+    from io import BytesIO
+
+    csv_content = "field_id,sensor_type,value,unit\n1,temperature,22,C\n1,temperature,warm,C"
+    response = client.post(
+        "/api/v1/sensors/bulk",
+        files={"file": ("bad.csv", BytesIO(csv_content.encode('utf-8')), "text/csv")}
+    )
+    assert response.status_code == 400
+    assert "Row 3" in response.json()["detail"]
+
+def test_spool_upload_writes_chunks(tmp_path, monkeypatch):
+    """
+    Test that an upload is staged to disk in chunks and can be discarded.
+    """
+    import asyncio
+    from io import BytesIO
+    from app import staging
+
+    class FakeUpload:
+        def __init__(self, data):
+            self.buffer = BytesIO(data)
+            self.reads = 0
+
+        async def read(self, size=-1):
+            self.reads += 1
+            return self.buffer.read(size)
+
+    monkeypatch.setattr(staging, "CHUNK_SIZE", 8)
+    upload = FakeUpload(b"field_id,sensor_type,value,unit\n1,temperature,22,C\n")
+    path = asyncio.run(staging.spool_upload(upload, directory=str(tmp_path)))
+
+    with open(path, "rb") as staged:
+        assert staged.read() == b"field_id,sensor_type,value,unit\n1,temperature,22,C\n"
+    assert upload.reads > 2
+
+    staging.discard(path)
+    assert not os.path.exists(path)
+
+def test_chart_data_is_downsampled(client: TestClient):
+    """
+    Test that chart data is bucketed server-side and ordered by timestamp.
+    """
+    import datetime
+
+    now = datetime.datetime.utcnow()
+    for minutes_ago in range(0, 600, 5):
+        ts = (now - datetime.timedelta(minutes=minutes_ago)).isoformat()
+        client.post("/api/v1/sensors", json={"field_id": 1, "sensor_type": "temperature", "value": minutes_ago, "unit": "C", "timestamp": ts})
+        client.post("/api/v1/sensors", json={"field_id": 1, "sensor_type": "soil_moisture", "value": 50, "unit": "%", "timestamp": ts})
+
+    response = client.get("/api/v1/readings/chart?field_id=1&hours=24&max_points=48&format=rows")
+    assert response.status_code == 200
+    points = response.json()
+    assert 0 < len(points) <= 48
+    assert [p["timestamp"] for p in points] == sorted(p["timestamp"] for p in points)
+    assert all(p["temperature_min"] <= p["temperature"] <= p["temperature_max"] for p in points)
+    assert all(p["soil_moisture"] == 50 for p in points)
+
+    response = client.get("/api/v1/readings/chart?field_id=1&hours=24&resolution=3600&format=rows")
+    assert len(response.json()) in (10, 11)
+
+def test_chart_data_arbitrary_sensor_types(client: TestClient):
+    """
+    Test that the chart endpoint returns any requested sensor types aligned per bucket.
+    """
+    import datetime
+
+    ts = (datetime.datetime.utcnow() - datetime.timedelta(minutes=30)).isoformat()
+    for sensor_type, value in (("humidity", 70), ("ph", 6.5), ("temperature", 21)):
+        client.post("/api/v1/sensors", json={"field_id": 1, "sensor_type": sensor_type, "value": value, "unit": "x", "timestamp": ts})
+
+    response = client.get("/api/v1/readings/chart?field_id=1&hours=1&sensor_types=humidity&sensor_types=ph&format=rows")
+    assert response.status_code == 200
+    points = response.json()
+    assert len(points) == 1
+    assert points[0]["humidity"] == 70
+    assert points[0]["ph"] == 6.5
+    assert "temperature" not in points[0]
+
+def test_chart_and_readings_columns(client: TestClient, monkeypatch):
+    """
+    Test that the chart defaults to one list per column, that readings can be
+    requested as columns, and that large bodies are compressed when accepted.
+    """
+    import datetime
+    import gzip
+
+    from app import responses
+
+    now = datetime.datetime.utcnow()
+    for minutes_ago in (90, 30):
+        ts = (now - datetime.timedelta(minutes=minutes_ago)).isoformat()
+        client.post("/api/v1/sensors", json={"field_id": 1, "sensor_type": "temperature", "value": minutes_ago, "unit": "C", "timestamp": ts})
+    client.post("/api/v1/sensors", json={"field_id": 1, "sensor_type": "soil_moisture", "value": 40, "unit": "%", "timestamp": ts})
+
+    response = client.get("/api/v1/readings/chart?field_id=1&hours=3&resolution=3600")
+    columns = response.json()
+    rows = client.get("/api/v1/readings/chart?field_id=1&hours=3&resolution=3600&format=rows").json()
+    assert len(columns["t"]) == len(rows) == 2
+    assert columns["t"] == [datetime.datetime.fromisoformat(r["timestamp"]).replace(tzinfo=datetime.timezone.utc).timestamp() for r in rows]
+    assert columns["temperature"] == [90, 30]
+    assert columns["soil_moisture"] == [None, 40]
+    assert client.get("/api/v1/readings/chart?field_id=1&format=xml").status_code == 400
+
+    page = client.get("/api/v1/readings?field_id=1&format=columns").json()
+    assert page["sensor_type"] == ["temperature", "temperature", "soil_moisture"]
+    assert page["value"] == [90, 30, 40] and page["next_cursor"] is None
+    assert client.get("/api/v1/readings?field_id=1").json()["items"][0]["unit"] == "C"
+
+    monkeypatch.setattr(responses, "RESPONSE_COMPRESSION_MIN_BYTES", 0)
+    response = client.get("/api/v1/readings?field_id=1", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.json()["items"][1]["value"] == 30
+    assert responses.compress(b"{}", "br;q=0, gzip;q=0")[1] is None
+    assert gzip.decompress(responses.compress(b"{}", "br;q=0, gzip")[0]) == b"{}"
+
+def test_batch_ingest_reports_item_errors(client: TestClient):
+    """
+    Test that a JSON batch is ingested in one go and invalid items are reported by index.
+    """
+    readings = [{"field_id": i % 3 + 1, "sensor_type": "temperature", "value": i, "unit": "C"} for i in range(10)]
+    readings[4] = {"field_id": 1, "sensor_type": "temperature", "value": "warm", "unit": "C"}
+    readings[7] = {"field_id": 2, "value": 1, "unit": "C"}
+    readings.append("not a reading")
+
+    response = client.post("/api/v1/sensors/batch", json={"readings": readings})
+    assert response.status_code == 200
+    data = response.json()
+    assert data["accepted"] == 8
+    assert data["rejected"] == 3
+    assert [error["index"] for error in data["errors"]] == [4, 7, 10]
+    assert "sensor_type" in data["errors"][1]["detail"]
+
+    analytics = client.get("/api/v1/analytics?field_id=3&sensor_type=temperature").json()
+    assert analytics["count"] == 3
+
+def test_batch_ingest_rejects_oversized_batch(client: TestClient, monkeypatch):
+    """
+    Test that batches above BATCH_MAX_ITEMS are refused.
+    """
+    from app import batch
+
+    monkeypatch.setattr(batch, "BATCH_MAX_ITEMS", 2)
+    reading = {"field_id": 1, "sensor_type": "temperature", "value": 1, "unit": "C"}
+    response = client.post("/api/v1/sensors/batch", json={"readings": [reading] * 3})
+    assert response.status_code == 413
+
+def test_write_behind_buffers_single_readings(client: TestClient, monkeypatch):
+    """
+    Test that write-behind mode acknowledges readings, applies backpressure and flushes them in bulk.
+    """
+    from app import buffer, main
+    from tests.conftest import TestingSessionLocal
+
+    write_behind = buffer.WriteBehindBuffer(TestingSessionLocal, max_rows=2, flush_rows=100, flush_seconds=60)
+    monkeypatch.setattr(main, "write_behind", write_behind)
+    reading = {"field_id": 5, "sensor_type": "temperature", "value": 21, "unit": "C"}
+
+    assert client.post("/api/v1/sensors", json=reading).status_code == 202
+    assert client.post("/api/v1/sensors", json=reading).status_code == 202
+    response = client.post("/api/v1/sensors", json=reading)
+    assert response.status_code == 429
+    assert response.headers["retry-after"] == "1"
+
+    assert client.get("/api/v1/analytics?field_id=5&sensor_type=temperature").status_code == 404
+    assert write_behind.flush() == 2
+    assert client.get("/api/v1/analytics?field_id=5&sensor_type=temperature").json()["count"] == 2
+
+    stats = client.get("/api/v1/metrics").json()["write_behind"]
+    assert stats["depth"] == 0
+    assert stats["rejected"] == 1
+    assert stats["flushed_rows"] == 2
+
+def test_write_behind_flushes_on_stop(monkeypatch):
+    """
+    Test that stopping the buffer writes out readings still waiting.
+    """
+    from app import buffer
+
+    written = []
+
+    class FakeSession:
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
+    monkeypatch.setattr(buffer.ingest, "write_batch", lambda db, rows: written.extend(rows))
+    write_behind = buffer.WriteBehindBuffer(FakeSession, flush_rows=100, flush_seconds=60)
+    write_behind.start()
+    write_behind.offer({"field_id": 1})
+    write_behind.stop()
+    assert written == [{"field_id": 1}]
+
+
+def test_write_behind_failed_flush_stays_bounded(monkeypatch):
+    """
+    Test that readings offered during a flush that fails count against
+    max_rows, so the retried batch never exceeds it.
+    """
+    from app import buffer
+
+    class FakeSession:
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
+    write_behind = buffer.WriteBehindBuffer(FakeSession, max_rows=10, flush_rows=100, flush_seconds=60)
+    written, offered = [], []
+
+    def failing_write(db, rows):
+        # Readings keep arriving while the flush is in flight.
+        offered.extend(write_behind.offer({"field_id": 2}) for _ in range(10))
+        raise RuntimeError("database unavailable")
+
+    for _ in range(6):
+        write_behind.offer({"field_id": 1})
+    monkeypatch.setattr(buffer.ingest, "write_batch", failing_write)
+    assert write_behind.flush() == 0
+    assert offered.count(True) == 4
+    assert write_behind.depth() == 10 and write_behind.stats()["in_flight"] == 0
+    assert not write_behind.offer({"field_id": 3})
+
+    monkeypatch.setattr(buffer.ingest, "write_batch", lambda db, rows: written.append(rows))
+    assert write_behind.flush() == 10
+    assert [row["field_id"] for row in written[0]] == [1] * 6 + [2] * 4
+
+
+def test_async_crud_reads_rows_written_by_sync_session(db_session):
+    """
+    The async session sees data committed through the sync engine.
+    """
+    import asyncio
+    from app import async_crud, crud, schemas
+    from app.models import Field
+    from tests.conftest import AsyncTestingSessionLocal
+
+    db_session.add(Field(id=1, name="Field 1"))
+    db_session.commit()
+    created = crud.create_sensor_reading(
+        db_session, schemas.SensorReadingCreate(field_id=1, sensor_type="temperature", value=20.0, unit="C")
+    )
+
+    async def read():
+        async with AsyncTestingSessionLocal() as db:
+            return await async_crud.get_sensor_reading(db, created.id), await async_crud.get_sensor_readings(db)
+
+    reading, readings = asyncio.run(read())
+    assert reading.value == 20.0
+    assert [r.id for r in readings] == [created.id]
+
+
+def test_async_create_reading_upserts_field_and_notifies_off_loop(db_session, monkeypatch):
+    """
+    Concurrent first readings of a new field both succeed, and cache
+    invalidation and publishing run outside the event loop.
+    """
+    import asyncio
+    from app import async_crud, crud, schemas
+    from app.models import Field
+    from tests.conftest import AsyncTestingSessionLocal
+
+    notified = []
+
+    def notify(rows):
+        try:
+            asyncio.get_running_loop()
+            notified.append("loop")
+        except RuntimeError:
+            notified.append(len(rows))
+
+    monkeypatch.setattr(crud, "notify_readings", notify)
+
+    async def create(value):
+        async with AsyncTestingSessionLocal() as db:
+            reading = schemas.SensorReadingCreate(field_id=7, sensor_type="temperature", value=value, unit="C")
+            return await async_crud.create_sensor_reading(db, reading)
+
+    async def create_both():
+        return await asyncio.gather(create(1.0), create(2.0))
+
+    first, second = asyncio.run(create_both())
+    assert {first.value, second.value} == {1.0, 2.0}
+    assert db_session.query(Field).filter(Field.id == 7).count() == 1
+    assert notified == [1, 1]
+
+
+def test_pool_stats_track_checkouts(tmp_path):
+    """
+    Queue pools report checkouts and wait times for the metrics endpoint.
+    """
+    from app import database
+
+    engine = database.create_db_engine(f"sqlite:///{tmp_path / 'pool.db'}")
+    with engine.connect():
+        assert database.pool_stats(engine)["checked_out"] == 1
+    engine.dispose()
+    stats = database.pool_stats(engine)
+    assert stats["pool"] == "TimedQueuePool"
+    assert stats["checked_out"] == 0
+    assert stats["checkouts"] == 1
+    assert stats["max_wait_seconds"] >= 0
+
+
+def test_metrics_include_db_pool(client: TestClient):
+    """
+    The metrics endpoint exposes per-process pool statistics.
+    """
+    pools = client.get("/api/v1/metrics").json()["db_pool"]
+    assert "pool" in pools["sync"]
+
+
+def _seed_export_readings(client: TestClient, count: int):
+    csv_content = "field_id,sensor_type,value,unit,timestamp\n" + "".join(
+        f"1,temperature,{i},C,2023-01-01T00:{i // 60:02d}:{i % 60:02d}\n" for i in range(count)
+    )
+    client.post("/api/v1/sensors/bulk", files={"file": ("test.csv", csv_content, "text/csv")})
+
+
+def test_export_readings_csv_streams_all_pages(client: TestClient, monkeypatch):
+    """
+    CSV export walks every keyset page in (timestamp, id) order.
+    """
+    from app import export
+    monkeypatch.setattr(export, "EXPORT_PAGE_SIZE", 7)
+    _seed_export_readings(client, 30)
+
+    response = client.get("/api/v1/readings/export", params={"field_id": 1, "format": "csv"})
+    assert response.status_code == 200
+    lines = response.text.strip().splitlines()
+    assert lines[0] == "id,field_id,sensor_type,value,unit,timestamp"
+    assert [float(line.split(",")[3]) for line in lines[1:]] == [float(i) for i in range(30)]
+
+
+def test_export_readings_accepts_timezone_aware_ranges(client: TestClient):
+    """
+    Offset-suffixed export bounds are converted to UTC.
+    """
+    _seed_export_readings(client, 10)
+
+    params = {"format": "csv", "start": "2023-01-01T05:00:02+05:00", "end": "2023-01-01T00:00:05Z"}
+    lines = client.get("/api/v1/readings/export", params=params).text.strip().splitlines()
+    assert [float(line.split(",")[3]) for line in lines[1:]] == [2.0, 3.0, 4.0, 5.0]
+
+
+def test_export_readings_parquet(client: TestClient):
+    """
+    Parquet export round-trips through pyarrow.
+    """
+    pq = pytest.importorskip("pyarrow.parquet")
+    import io
+    _seed_export_readings(client, 12)
+
+    response = client.get("/api/v1/readings/export", params={"format": "parquet", "sensor_type": "temperature"})
+    assert response.status_code == 200
+    table = pq.read_table(io.BytesIO(response.content))
+    assert table.num_rows == 12
+    assert table.column("value").to_pylist() == [float(i) for i in range(12)]
+
+
+def test_export_readings_rejects_unknown_format(client: TestClient):
+    response = client.get("/api/v1/readings/export", params={"format": "xlsx"})
+    assert response.status_code == 400
+
+
+def test_advanced_analytics_endpoint(client: TestClient):
+    """
+    Advanced analytics return one entry per series with the requested percentiles.
+    """
+    _seed_export_readings(client, 20)
+
+    params = {"field_ids": [1], "sensor_types": ["temperature"], "start": "2023-01-01T00:00:00",
+              "end": "2023-01-02T00:00:00", "percentiles": [50, 95], "below": 5}
+    body = client.get("/api/v1/analytics/advanced", params=params).json()
+    assert len(body) == 1
+    assert body[0]["count"] == 20
+    assert body[0]["percentiles"] == {"p50": 9.5, "p95": pytest.approx(18.05)}
+    assert body[0]["breaches"]["count"] > 0
+
+    params["percentiles"] = [120]
+    assert client.get("/api/v1/analytics/advanced", params=params).status_code == 400
+
+    params.update(percentiles=[50], start="2023-01-01T05:00:00+05:00", end="2023-01-01T00:00:09Z")
+    assert client.get("/api/v1/analytics/advanced", params=params).json()[0]["count"] == 10
+
+
+def test_query_analytics_streams_json_lines(client: TestClient):
+    """
+    The fleet analytics query returns one JSON line per series.
+    """
+    import json
+    _seed_export_readings(client, 10)
+    client.post("/api/v1/sensors/", json={"field_id": 2, "sensor_type": "humidity", "value": 40.0,
+                                          "unit": "%", "timestamp": "2023-01-01T00:00:30"})
+
+    body = {"start": "2023-01-01T00:00:00", "end": "2023-01-02T00:00:00"}
+    response = client.post("/api/v1/analytics/query", json=body)
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [(line["field_id"], line["sensor_type"], line["count"]) for line in lines] == [
+        (1, "temperature", 10), (2, "humidity", 1),
+    ]
+    assert lines[0]["avg"] == 4.5
+
+    response = client.post("/api/v1/analytics/query", json={**body, "field_ids": [2], "sensor_types": "all"})
+    assert len(response.text.splitlines()) == 1
+
+
+def test_analytics_accept_timezone_aware_ranges(client: TestClient):
+    """
+    Z-suffixed and offset bounds are treated as UTC by single-series and fleet analytics.
+    """
+    import json
+    _seed_export_readings(client, 10)
+
+    params = {"field_id": 1, "sensor_type": "temperature", "start": "2023-01-01T00:00:00Z", "end": "2023-01-01T01:00:00+01:00"}
+    response = client.get("/api/v1/analytics", params=params)
+    assert response.status_code == 200
+    assert response.json()["count"] == 1
+
+    response = client.post("/api/v1/analytics/query", json={"start": "2023-01-01T00:00:00Z", "end": "2023-01-02T00:00:00Z"})
+    assert response.status_code == 200
+    assert [json.loads(line)["count"] for line in response.text.splitlines()] == [10]
+
+
+def test_list_readings_keyset_pagination(client: TestClient):
+    """
+    Following next_cursor visits every reading once, in (timestamp, id) order.
+    """
+    _seed_export_readings(client, 25)
+
+    values, cursor, pages = [], None, 0
+    while True:
+        params = {"field_id": 1, "sensor_type": "temperature", "limit": 10}
+        if cursor:
+            params["cursor"] = cursor
+        body = client.get("/api/v1/readings", params=params).json()
+        values += [item["value"] for item in body["items"]]
+        pages += 1
+        cursor = body["next_cursor"]
+        if cursor is None:
+            break
+    assert pages == 3
+    assert values == [float(i) for i in range(25)]
+
+    assert client.get("/api/v1/readings", params={"cursor": "not-a-cursor"}).status_code == 400
+
+
+def test_list_readings_accepts_timezone_aware_ranges(client: TestClient):
+    """
+    Offset-suffixed bounds are converted to UTC before filtering readings.
+    """
+    _seed_export_readings(client, 10)
+
+    params = {"field_id": 1, "start": "2023-01-01T05:00:00+05:00"}
+    assert len(client.get("/api/v1/readings", params=params).json()["items"]) == 10
+
+    params["end"] = "2023-01-01T05:00:04+05:00"
+    assert [item["value"] for item in client.get("/api/v1/readings", params=params).json()["items"]] == [0, 1, 2, 3, 4]
+
+
+def test_prometheus_metrics(client: TestClient):
+    """
+    /metrics exposes per-route request latency, SQL statement timings and the
+    cache counters in the Prometheus text format.
+    """
+    client.get("/api/v1/readings", params={"field_id": 1})
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert 'http_request_duration_seconds_count{method="GET",route="/api/v1/readings",status="200"}' in response.text
+    assert 'db_statement_duration_seconds_count{operation="SELECT"}' in response.text
+    assert "cache_hits_total" in response.text
+
+
+def test_slow_query_log(db_session, monkeypatch, caplog):
+    """
+    Statements slower than SLOW_QUERY_SECONDS are logged with their parameters.
+    """
+    import logging
+    from app import crud, instrumentation
+    monkeypatch.setattr(instrumentation, "SLOW_QUERY_SECONDS", 1e-9)
+
+    with caplog.at_level(logging.WARNING, logger="app.slow_query"):
+        crud.get_readings_page(db_session, field_id=4242).all()
+    assert any("Slow query" in r.message and "4242" in r.message for r in caplog.records)
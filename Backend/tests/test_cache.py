@@ -0,0 +1,48 @@
+from datetime import datetime
+
+from fastapi.testclient import TestClient
+
+from app.cache import MemoryBackend, ResponseCache, cache, window_end
+
+
+def test_window_end_rounds_up():
+    """
+    Test that polls inside the same window share an end time.
+    """
+    assert window_end(datetime(2024, 1, 1, 10, 0, 1)) == window_end(datetime(2024, 1, 1, 10, 0, 59))
+    assert window_end(datetime(2024, 1, 1, 10, 1, 0)) == datetime(2024, 1, 1, 10, 1, 0)
+
+
+def test_memory_backend_evicts_least_recently_used():
+    """
+    Test that the in-process backend keeps at most `max_entries` values.
+    """
+    response_cache = ResponseCache(MemoryBackend(max_entries=2))
+    calls = []
+    for params in ((1,), (2,), (1,), (3,), (1,), (2,)):
+        response_cache.get_or_compute("chart", 1, ["temperature"], params, lambda: calls.append(params) or params)
+    assert calls == [(1,), (2,), (3,), (2,)]
+    assert response_cache.hits == 2
+
+
+def test_analytics_cache_invalidated_by_ingest(client: TestClient):
+    """
+    Test that cached analytics are served until a new reading for the series arrives.
+    """
+    client.post("/api/v1/sensors", json={"field_id": 1, "sensor_type": "temperature", "value": 20, "unit": "C"})
+
+    assert client.get("/api/v1/analytics?field_id=1&sensor_type=temperature").json()["count"] == 1
+    hits = cache.hits
+    assert client.get("/api/v1/analytics?field_id=1&sensor_type=temperature").json()["count"] == 1
+    assert cache.hits == hits + 1
+
+    client.post("/api/v1/sensors", json={"field_id": 1, "sensor_type": "humidity", "value": 70, "unit": "%"})
+    client.get("/api/v1/analytics?field_id=1&sensor_type=temperature")
+    assert cache.hits == hits + 2
+
+    client.post("/api/v1/sensors", json={"field_id": 1, "sensor_type": "temperature", "value": 30, "unit": "C"})
+    assert client.get("/api/v1/analytics?field_id=1&sensor_type=temperature").json()["count"] == 2
+
+    stats = client.get("/api/v1/metrics").json()["cache"]
+    assert stats["backend"] == "MemoryBackend"
+    assert stats["hits"] == cache.hits
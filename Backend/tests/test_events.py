@@ -0,0 +1,49 @@
+import asyncio
+import threading
+from datetime import datetime
+
+from app import events
+
+
+def test_memory_broker_delivers_readings_per_field(monkeypatch):
+    """
+    Readings published from another thread reach subscribers of their field only.
+    """
+    broker = events.MemoryBroker()
+    monkeypatch.setattr(events, "broker", broker)
+    monkeypatch.setattr(events, "EVENTS_MAX_READINGS", 2)
+    rows = [
+        {"field_id": 1, "sensor_type": "temperature", "value": 20.0, "unit": "C", "timestamp": datetime(2024, 1, 1, 0, i)}
+        for i in range(3)
+    ] + [{"field_id": 2, "sensor_type": "temperature", "value": 5.0, "unit": "C", "timestamp": datetime(2024, 1, 1)}]
+
+    async def run():
+        async with broker.subscribe([events.field_channel(2)]) as field_two, \
+                broker.subscribe([events.field_channel(1)]) as field_one:
+            publisher = threading.Thread(target=events.publish_readings, args=(rows,))
+            publisher.start()
+            publisher.join()
+            return await field_one.get(1), await field_two.get(1), await field_two.get(0.05)
+
+    summary, readings, nothing = asyncio.run(run())
+    assert summary["type"] == "readings_summary"
+    assert summary["count"] == 3
+    assert readings["type"] == "readings"
+    assert readings["readings"][0]["value"] == 5.0
+    assert nothing is None
+
+
+def test_subscription_drops_oldest_when_full():
+    async def run():
+        subscription = events.Subscription(queue_size=2)
+        for i in range(3):
+            subscription.put({"type": "task", "n": i})
+        return subscription.dropped, (await subscription.get(1))["n"]
+
+    assert asyncio.run(run()) == (1, 1)
+
+
+def test_format_sse():
+    assert events.format_sse({"type": "task", "state": "PROGRESS"}) == (
+        'event: task\ndata: {"type": "task", "state": "PROGRESS"}\n\n'
+    )
@@ -0,0 +1,67 @@
+from io import BytesIO
+
+from app import ingest, models
+
+
+def test_ingest_skips_invalid_rows(db_session):
+    """
+    Test that rejected rows are counted and reported without aborting the run.
+    """
+    data = b"field_id,sensor_type,value,unit\n1,temperature,22,C\n1,temperature,hot,C\n2,soil_moisture,40,%\n"
+    lines = ingest.ByteCountingLines(BytesIO(data))
+    seen = []
+
+    result = ingest.ingest_csv(db_session, lines, batch_size=1, on_batch=lambda p: seen.append(lines.bytes_read), skip_invalid=True)
+
+    assert result.rows == 2
+    assert result.rejected == 1
+    assert result.errors[0].startswith("Row 3:")
+    assert lines.bytes_read == len(data)
+    assert seen == sorted(seen) and seen[-1] == len(data)
+    assert db_session.query(models.SensorReading).count() == 2
+    assert db_session.query(models.Field).count() == 2
+
+
+def test_progress_throttle_by_rows():
+    """
+    Test that progress is only due once enough rows have been processed.
+    """
+    throttle = ingest.ProgressThrottle(every_rows=100, every_seconds=3600)
+    assert not throttle.due(50)
+    assert throttle.due(100)
+    assert not throttle.due(150)
+    assert throttle.due(200)
+
+
+def test_plan_chunks_splits_on_line_boundaries(db_session, tmp_path):
+    """
+    Test that byte-range chunks of a CSV with a BOM cover every row exactly
+    once and report invalid rows by their line in the whole file.
+    """
+    path = tmp_path / "readings.csv"
+    rows = [f"{i % 3 + 1},temperature,{i},C" for i in range(50)]
+    rows[40] = "1,temperature,warm,C"
+    path.write_bytes(("\ufefffield_id,sensor_type,value,unit\n" + "\n".join(rows) + "\n").encode("utf-8"))
+
+    fieldnames, ranges = ingest.plan_chunks(str(path), chunk_bytes=64)
+
+    assert fieldnames == ["field_id", "sensor_type", "value", "unit"]
+    assert len(ranges) > 1
+    assert all(prev_end == start for (_, prev_end, _), (start, _, _) in zip(ranges, ranges[1:]))
+    assert ranges[0][2] == 2
+
+    total = 0
+    errors = []
+    for start, end, first_line in ranges:
+        with open(path, "rb") as f:
+            lines = ingest.ByteRangeLines(f, start, end)
+            result = ingest.ingest_csv(db_session, lines, fieldnames=fieldnames, skip_invalid=True, first_line=first_line)
+            total += result.rows
+            errors += result.errors
+            assert lines.bytes_read == end - start
+    assert total == 49
+    assert len(errors) == 1 and errors[0].startswith("Row 42:")
+
+    with open(path, "rb") as f:
+        assert ingest.ingest_csv(db_session, ingest.iter_lines(f), skip_invalid=True).errors == errors
+    assert db_session.query(models.SensorReading).count() == 98
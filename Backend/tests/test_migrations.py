@@ -0,0 +1,37 @@
+from sqlalchemy import create_engine, inspect, text
+
+from app import migrations
+
+
+def test_migrations_upgrade_existing_tables(tmp_path):
+    """
+    Test that pending migrations add the new indexes to tables created by an
+    older schema, dedupe hourly rollups, add the rollup sum columns, and are
+    only applied once.
+    """
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE fields (id INTEGER PRIMARY KEY, name VARCHAR)"))
+        conn.execute(text(
+            "CREATE TABLE sensor_readings (id INTEGER PRIMARY KEY, field_id INTEGER, sensor_type VARCHAR, "
+            "value FLOAT, unit VARCHAR, timestamp DATETIME)"
+        ))
+        conn.execute(text(
+            "CREATE TABLE hourly_analytics (id INTEGER PRIMARY KEY, field_id INTEGER, sensor_type VARCHAR, "
+            "hour_timestamp DATETIME, min_value FLOAT, max_value FLOAT, avg_value FLOAT, reading_count INTEGER)"
+        ))
+        for _ in range(2):
+            conn.execute(text(
+                "INSERT INTO hourly_analytics (field_id, sensor_type, hour_timestamp, avg_value, reading_count) "
+                "VALUES (1, 'temperature', '2024-01-01 00:00:00', 2.5, 2)"
+            ))
+
+    assert migrations.run_migrations(engine) == [1, 2, 4]
+    assert migrations.run_migrations(engine) == []
+
+    inspector = inspect(engine)
+    assert "ix_sensor_readings_field_sensor_time" in {i["name"] for i in inspector.get_indexes("sensor_readings")}
+    assert "uq_hourly_analytics_field_sensor_hour" in {i["name"] for i in inspector.get_indexes("hourly_analytics")}
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT COUNT(*) FROM hourly_analytics")).scalar() == 1
+        assert conn.execute(text("SELECT sum_value FROM hourly_analytics")).scalar() == 5.0
@@ -0,0 +1,89 @@
+from datetime import datetime, timedelta
+
+from app import crud, ingest, models, retention, rollups
+
+
+def _seed(db, start, days):
+    """Insert one temperature reading every 10 minutes for field 1."""
+    rows = [
+        {
+            'field_id': 1,
+            'sensor_type': 'temperature',
+            'value': float(i % 17),
+            'unit': 'C',
+            'timestamp': start + timedelta(minutes=10 * i),
+        }
+        for i in range(days * 144)
+    ]
+    ingest.upsert_fields(db, [1])
+    ingest.insert_readings(db, rows)
+    db.commit()
+    return rows
+
+
+def _raw_count(db, start, end):
+    reading = models.SensorReading
+    return db.query(reading).filter(reading.timestamp >= start, reading.timestamp < end).count()
+
+
+def test_retention_prunes_only_covered_days(db_session, monkeypatch):
+    """
+    Test that raw readings are pruned day by day only once their rollups cover
+    them, that analytics keep answering from the rollups, and that late data
+    behind the pruned horizon never replaces the final rollups.
+    """
+    monkeypatch.setattr(retention, "RETENTION_RAW_DAYS_BY_SENSOR", {'temperature': 1})
+    monkeypatch.setattr(retention, "RETENTION_BATCH_SIZE", 50)
+    start = datetime(2024, 1, 1)
+    now = start + timedelta(days=3, minutes=30)
+    rows = _seed(db_session, start, days=3)
+    day_one = [r['value'] for r in rows if r['timestamp'] < start + timedelta(days=1)]
+
+    # Nothing is pruned before the rollups have caught up.
+    assert retention.prune_raw(db_session, 'temperature', now) == 0
+    rollups.run_incremental(db_session, now=now)
+    rollups.mark_dirty(db_session, [(1, 'temperature', start + timedelta(days=1, hours=5))])
+    db_session.commit()
+
+    assert retention.apply_retention(db_session, now)['raw_deleted'] == {'temperature': 144}
+    assert _raw_count(db_session, start, start + timedelta(days=1)) == 0
+    assert _raw_count(db_session, start + timedelta(days=1), now) == 288
+    assert rollups.get_raw_horizons(db_session) == {'temperature': start + timedelta(days=1)}
+
+    result = crud.get_analytics(db_session, 1, 'temperature', start, start + timedelta(days=1) - timedelta(seconds=1))
+    assert result.count == len(day_one) and result.max == max(day_one)
+
+    # Once the dirty hour is recomputed the next day goes too, but not the one inside retention.
+    rollups.process_dirty_hours(db_session)
+    assert retention.prune_raw(db_session, 'temperature', now) == 144
+    assert rollups.get_raw_horizons(db_session) == {'temperature': start + timedelta(days=2)}
+    assert _raw_count(db_session, start + timedelta(days=2), now) == 144
+
+    late = "field_id,sensor_type,value,unit,timestamp\n1,temperature,99,C,2024-01-01T03:30:00\n"
+    ingest.ingest_csv(db_session, late.splitlines(keepends=True))
+    rollups.process_dirty_hours(db_session)
+    hour = db_session.query(models.HourlyAnalytics).filter_by(hour_timestamp=start + timedelta(hours=3)).one()
+    assert hour.reading_count == 6
+    assert retention.prune_raw(db_session, 'temperature', now) == 1
+
+
+def test_rollup_retention_and_planner_horizons(db_session, monkeypatch):
+    """Test that expired rollups are deleted and the planner stops using a tier before its horizon."""
+    monkeypatch.setattr(retention, "RETENTION_ROLLUP_DAYS", {'minute': 1, 'hour': None, 'day': None})
+    start = datetime(2024, 1, 1)
+    now = start + timedelta(days=2, minutes=30)
+    _seed(db_session, start, days=2)
+    rollups.run_incremental(db_session, now=now)
+
+    assert retention.prune_rollups(db_session, now) == {'minute': 144}
+    minute = models.MinuteAnalytics
+    assert db_session.query(minute).filter(minute.minute_timestamp < start + timedelta(days=1)).count() == 0
+
+    watermarks = rollups.get_watermarks(db_session)
+    ranges, raw = rollups.plan_ranges(
+        start + timedelta(minutes=5), start + timedelta(days=1, hours=1, minutes=30), watermarks, set(),
+        horizons=retention.rollup_horizons(now),
+    )
+    assert ranges['minute'] == [(start + timedelta(days=1, hours=1), start + timedelta(days=1, hours=1, minutes=30))]
+    assert ranges['hour'][0][0] == start + timedelta(hours=1)
+    assert raw[0] == (start + timedelta(minutes=5), start + timedelta(hours=1), False)
@@ -0,0 +1,83 @@
+import os
+import sys
+
+import pytest
+
+from app import database, events, models
+from tests.conftest import TestingSessionLocal
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "Worker"))
+tasks = pytest.importorskip("tasks")
+
+
+@pytest.fixture
+def eager_worker(monkeypatch):
+    """Run Celery tasks in-process against the test database, recording published task events."""
+    conf = tasks.celery_app.conf
+    previous = conf.task_always_eager, conf.task_store_eager_result, conf.result_backend
+    conf.update(task_always_eager=True, task_store_eager_result=True, result_backend="cache+memory://")
+    tasks.celery_app.__dict__.pop("backend", None)
+    monkeypatch.setattr(database, "SessionLocal", TestingSessionLocal)
+    published = []
+    monkeypatch.setattr(events, "publish_task", lambda task_id, state, meta=None: published.append((task_id, state, meta)))
+    yield published
+    conf.update(task_always_eager=previous[0], task_store_eager_result=previous[1], result_backend=previous[2])
+    tasks.celery_app.__dict__.pop("backend", None)
+
+
+def test_chunked_csv_import_reports_on_parent_channel(db_session, tmp_path, monkeypatch, eager_worker):
+    """
+    Test that a CSV split into a chord of chunks publishes combined progress
+    and the final result on the parent task's channel, and never reports the
+    dispatch itself as success.
+    """
+    monkeypatch.setattr(tasks, "PARALLEL_CHUNK_BYTES", 64)
+    rows = [f"1,temperature,{i},C,2024-01-01T00:{i:02d}:00" for i in range(30)]
+    rows[20] = "1,temperature,warm,C,2024-01-01T00:20:00"
+    path = tmp_path / "upload.csv"
+    path.write_text("field_id,sensor_type,value,unit,timestamp\n" + "\n".join(rows) + "\n")
+
+    dispatch = tasks.process_csv_file.apply(args=(str(path),), task_id="parent").result
+
+    assert dispatch["status"] == "Dispatched" and len(dispatch["chunks"]) > 1
+    parent = [(state, meta) for task_id, state, meta in eager_worker if task_id == "parent"]
+    states = [state for state, _ in parent]
+    assert states[-1] == "SUCCESS" and set(states[:-1]) == {"PROGRESS"}
+    assert parent[-2][1]["chunks_done"] == len(dispatch["chunks"])
+
+    result = parent[-1][1]
+    assert result["rows_accepted"] == 29 and result["rows_rejected"] == 1
+    assert result["errors"][0].startswith("Row 22:")
+    assert db_session.query(models.SensorReading).count() == 29
+    assert not path.exists()
+
+
+def test_failed_chunk_reports_rows_committed_before_the_error(db_session, tmp_path, monkeypatch, eager_worker):
+    """
+    Test that a chunk failing partway through still counts the batches it
+    committed, so the import summary matches what was stored.
+    """
+    from app import ingest
+
+    monkeypatch.setattr(tasks, "PARALLEL_CHUNK_BYTES", 256)
+    monkeypatch.setattr(ingest, "DEFAULT_BATCH_SIZE", 2)
+    write_batch = ingest.write_batch
+
+    def failing_write_batch(db, batch):
+        if any(row['value'] == 5 for row in batch):
+            raise RuntimeError("connection lost")
+        write_batch(db, batch)
+
+    monkeypatch.setattr(ingest, "write_batch", failing_write_batch)
+    rows = [f"1,temperature,{i},C,2024-01-01T00:{i:02d}:00" for i in range(30)]
+    path = tmp_path / "upload.csv"
+    path.write_text("field_id,sensor_type,value,unit,timestamp\n" + "\n".join(rows) + "\n")
+
+    tasks.process_csv_file.apply(args=(str(path),), task_id="parent")
+
+    result = [meta for task_id, state, meta in eager_worker if task_id == "parent" and state == "SUCCESS"][0]
+    stored = db_session.query(models.SensorReading).count()
+    assert result["failed_chunks"] == 1 and result["status"] == "Completed with errors"
+    assert 0 < stored < 30
+    assert result["rows_accepted"] == stored
+    assert "connection lost" in result["errors"][0]
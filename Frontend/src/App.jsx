@@ -38,24 +38,30 @@ function App() {
   const fetchData = useCallback(async () => {
     setLoading({ stats: true, chart: true });
     try {
-      const tempResponse = await api.getAnalytics(1, 'temperature');
-      setStats(prev => ({ ...prev, temp: tempResponse.data }));
-    } catch (err) { console.log("No temp data"); setStats(prev => ({ ...prev, temp: null })); }
-    try {
-      const moistureResponse = await api.getAnalytics(1, 'soil_moisture');
-      setStats(prev => ({ ...prev, moisture: moistureResponse.data }));
-    } catch (err) { console.log("No moisture data"); setStats(prev => ({ ...prev, moisture: null })); }
+      const series = await api.queryAnalytics({ fieldIds: [1], sensorTypes: ['temperature', 'soil_moisture'] });
+      const byType = Object.fromEntries(series.map(row => [row.sensor_type, row]));
+      setStats({ temp: byType.temperature || null, moisture: byType.soil_moisture || null });
+    } catch (err) { console.log("No analytics data"); setStats({ temp: null, moisture: null }); }
     finally { setLoading(prev => ({ ...prev, stats: false })); }
 
     try {
-      const chartResponse = await api.getChartData(1, 24);
-      setChartData(chartResponse.data);
+      setChartData(await api.getChartData(1, 24));
     } catch (err) { console.log("No chart data"); setChartData([]); }
     finally { setLoading(prev => ({ ...prev, chart: false })); }
   }, []);
 
   useEffect(() => { fetchData(); }, [fetchData]);
 
+  // Refresh when new readings for the field are pushed, at most once every 2s.
+  useEffect(() => {
+    let timer = null;
+    const refresh = () => {
+      if (!timer) timer = setTimeout(() => { timer = null; fetchData(); }, 2000);
+    };
+    const close = api.subscribe({ fieldId: 1 }, { readings: refresh, readings_summary: refresh });
+    return () => { close(); clearTimeout(timer); };
+  }, [fetchData]);
+
   return (
     <div className="bg-neutral-50 min-h-screen font-sans text-neutral-800">
       <Toaster position="top-center" reverseOrder={false} />
@@ -11,21 +11,26 @@ const BulkUpload = ({ onNewData }) => {
     setSelectedFile(event.target.files[0]);
   };
 
+  const handleTaskUpdate = (taskId, data) => {
+    if (data.status === 'SUCCESS') {
+      toast.success('File processed successfully!', { id: taskId });
+      onNewData(); // Refresh dashboard
+      return true;
+    } else if (data.status === 'FAILURE') {
+      toast.error('File processing failed.', { id: taskId });
+      return true;
+    } else if (data.status === 'PROGRESS' && data.result) {
+      const progress = (data.result.current / data.result.total) * 100;
+      toast.loading(`Processing... ${Math.round(progress)}%`, { id: taskId });
+    }
+    return false;
+  };
+
   const pollTaskStatus = (taskId) => {
     const interval = setInterval(async () => {
       try {
         const { data } = await api.getTaskStatus(taskId);
-        if (data.status === 'SUCCESS') {
-          clearInterval(interval);
-          toast.success('File processed successfully!', { id: taskId });
-          onNewData(); // Refresh dashboard
-        } else if (data.status === 'FAILURE') {
-          clearInterval(interval);
-          toast.error('File processing failed.', { id: taskId });
-        } else if (data.status === 'PROGRESS' && data.result) {
-          const progress = (data.result.current / data.result.total) * 100;
-          toast.loading(`Processing... ${Math.round(progress)}%`, { id: taskId });
-        }
+        if (handleTaskUpdate(taskId, data)) clearInterval(interval);
       } catch (error) {
         clearInterval(interval);
         toast.error('Could not get task status.', { id: taskId });
@@ -33,6 +38,19 @@ const BulkUpload = ({ onNewData }) => {
     }, 2000);
   };
 
+  // Progress is pushed over the event stream; fall back to polling if it drops.
+  const watchTask = (taskId) => {
+    const close = api.subscribe(
+      { taskId },
+      { task: (event) => { if (handleTaskUpdate(taskId, { status: event.state, result: event.result })) close(); } },
+      () => { close(); pollTaskStatus(taskId); }
+    );
+    // The task may have finished before the stream connected.
+    api.getTaskStatus(taskId)
+      .then(({ data }) => { if (handleTaskUpdate(taskId, data)) close(); })
+      .catch(() => {});
+  };
+
   const handleUpload = async () => {
     if (!selectedFile) return;
 
@@ -45,7 +63,7 @@ const BulkUpload = ({ onNewData }) => {
       const { data } = await api.createBulkReadings(formData);
       toast.dismiss(toastId);
       toast.loading('File sent for processing...', { id: data.task_id });
-      pollTaskStatus(data.task_id);
+      watchTask(data.task_id);
     } catch (error) {
       toast.error('Upload failed. Please check the file format.');
       toast.dismiss(toastId);
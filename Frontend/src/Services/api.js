@@ -30,6 +30,17 @@ export default {
     return apiClient.get(`/api/v1/analytics?${params.toString()}`);
   },
 
+  // Analytics of many series in one request. `fieldIds` / `sensorTypes` default
+  // to "all"; resolves to one object per series that has data.
+  async queryAnalytics({ fieldIds = 'all', sensorTypes = 'all', start, end } = {}) {
+    const response = await apiClient.post(
+      '/api/v1/analytics/query',
+      { field_ids: fieldIds, sensor_types: sensorTypes, start, end },
+      { responseType: 'text' },
+    );
+    return response.data.split('\n').filter(Boolean).map((line) => JSON.parse(line));
+  },
+
   createSensorReading(readingData) {
     return apiClient.post('/api/v1/sensors', readingData, {
       headers: { 'Content-Type': 'application/json' },
@@ -42,14 +53,40 @@ export default {
     });
   },
 
-  getChartData(fieldId, hours) {
-    return apiClient.get(`/api/v1/readings/chart?field_id=${fieldId}&hours=${hours}`);
+  // Chart points for the last `hours`. The API sends one array per column
+  // (`t` in Unix seconds); resolves to one object per bucket for recharts.
+  async getChartData(fieldId, hours, sensorTypes) {
+    const params = new URLSearchParams({ field_id: fieldId, hours });
+    (sensorTypes || []).forEach((type) => params.append('sensor_types', type));
+    const { data: columns } = await apiClient.get(`/api/v1/readings/chart?${params.toString()}`);
+    return columns.t.map((t, i) => {
+      const timestamp = new Date(t * 1000).toISOString();
+      const point = { time: timestamp.slice(11, 16), timestamp };
+      Object.keys(columns).forEach((key) => { if (key !== 't') point[key] = columns[key][i]; });
+      return point;
+    });
   },
 
   getTaskStatus(taskId) {
     return apiClient.get(`/api/v1/tasks/${taskId}`);
   },
 
+  // Server-Sent Events for new readings of a field and/or progress of a task.
+  // `handlers` maps event types (readings, readings_summary, task) to callbacks
+  // receiving the parsed message; `onError` fires when the connection drops.
+  // Returns a function that closes the stream.
+  subscribe({ fieldId, taskId }, handlers, onError) {
+    const params = new URLSearchParams();
+    if (fieldId != null) params.append('field_id', fieldId);
+    if (taskId)          params.append('task_id',  taskId);
+    const source = new EventSource(`${baseURL}/api/v1/stream?${params.toString()}`);
+    Object.entries(handlers).forEach(([type, handler]) => {
+      source.addEventListener(type, (event) => handler(JSON.parse(event.data)));
+    });
+    if (onError) source.onerror = onError;
+    return () => source.close();
+  },
+
   // Generic wrappers
   post(url, data) {
     return apiClient.post(url, data);
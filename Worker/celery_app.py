@@ -1,6 +1,8 @@
 
 from celery import Celery
+from celery.signals import before_task_publish
 import os
+import time
 
 redis_url = os.getenv("CELERY_BROKER_URL", "redis://redis:6379/0")
 
@@ -14,3 +16,10 @@ celery_app = Celery(
 celery_app.conf.update(
     task_track_started=True,
 )
+
+
+@before_task_publish.connect
+def stamp_publish_time(headers=None, **kwargs):
+    """Record when each task was published, so workers can measure queue wait."""
+    if headers is not None:
+        headers['published_at'] = time.time()
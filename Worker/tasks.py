@@ -1,138 +1,328 @@
 from celery_app import celery_app
-from sqlalchemy import create_engine, func
-from sqlalchemy.orm import sessionmaker
+from celery import chord, group
+from celery.signals import task_postrun, task_prerun, worker_init, worker_process_init
+from celery.utils import uuid
 import os
-import csv
-import io
-from datetime import datetime, timedelta
-
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey
-from pantic import BaseModel
-
-Base = declarative_base()
-
-class Field(Base):
-    __tablename__ = "fields"
-    id = Column(Integer, primary_key=True)
-    name = Column(String, unique=True)
-
-class SensorReading(Base):
-    __tablename__ = "sensor_readings"
-    id = Column(Integer, primary_key=True)
-    field_id = Column(Integer, ForeignKey("fields.id"))
-    sensor_type = Column(String)
-    value = Column(Float)
-    unit = Column(String)
-    timestamp = Column(DateTime, default=datetime.utcnow)
-
-class HourlyAnalytics(Base):
-    __tablename__ = "hourly_analytics"
-    id = Column(Integer, primary_key=True)
-    field_id = Column(Integer)
-    sensor_type = Column(String)
-    hour_timestamp = Column(DateTime)
-    min_value = Column(Float)
-    max_value = Column(Float)
-    avg_value = Column(Float)
-    reading_count = Column(Integer)
-
-class SensorReadingCreate(BaseModel):
-    field_id: int
-    sensor_type: str
-    value: float
-    unit: str
-    timestamp: datetime = None
-
-SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", "postgresql://user:password@db/field_insights_db")
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+import time
+from datetime import datetime
 
+from app import database, events, ingest, instrumentation, migrations, retention, rollups, staging
+
+PARALLEL_CHUNK_BYTES = int(os.getenv("PARALLEL_CHUNK_BYTES", str(64 * 1024 * 1024)))
+ROLLUP_SCHEDULE_SECONDS = float(os.getenv("ROLLUP_SCHEDULE_SECONDS", "60"))
+WORKER_METRICS_PORT = int(os.getenv("WORKER_METRICS_PORT", "0"))
+
+instrumentation.instrument_sqlalchemy()
+_task_started = {}
+
+
+@worker_init.connect
+def start_metrics_server(**kwargs):
+    """
+    Serve the metrics of every worker process on WORKER_METRICS_PORT from the
+    main process, starting from an empty multiprocess directory.
+    """
+    if not WORKER_METRICS_PORT:
+        return
+    instrumentation.clear_multiprocess_dir()
+    instrumentation.start_metrics_server(WORKER_METRICS_PORT)
+
+
+@worker_process_init.connect
+def dispose_inherited_pools(**kwargs):
+    """
+    Prefork children inherit the parent's pooled connections; drop them
+    without closing so each child opens its own.
+    """
+    database.dispose_after_fork()
+
+
+@task_prerun.connect
+def record_queue_wait(task_id=None, task=None, **kwargs):
+    """Observe how long the task waited in the queue and start timing its run."""
+    _task_started[task_id] = time.perf_counter()
+    published = getattr(task.request, 'published_at', None) or (task.request.headers or {}).get('published_at')
+    if published:
+        instrumentation.TASK_QUEUE_WAIT_SECONDS.labels(task.name).observe(max(time.time() - published, 0))
+
+
+@task_postrun.connect
+def record_runtime(task_id=None, task=None, state=None, **kwargs):
+    started = _task_started.pop(task_id, None)
+    if started is not None:
+        instrumentation.TASK_RUNTIME_SECONDS.labels(task.name, state or "UNKNOWN").observe(time.perf_counter() - started)
+
+
+@task_postrun.connect
+def publish_final_state(task_id=None, state=None, retval=None, **kwargs):
+    """
+    Push the final state of every task to its stream channel. A CSV import
+    dispatched as a chord is still running, so nothing is sent for it here;
+    its chunks and `finalize_csv_import` publish on its channel instead.
+    """
+    if isinstance(retval, dict) and retval.get('status') == 'Dispatched':
+        return
+    events.publish_task(task_id, state, retval if isinstance(retval, dict) else None)
+
+
+def chunk_progress(dispatch, overrides=None):
+    """
+    Combined progress of a parallel CSV import from the states of its chunk
+    tasks. `overrides` maps chunk ids to `(info, ready)` known to the caller
+    but possibly not in the result backend yet.
+    """
+    overrides = overrides or {}
+    current = chunks_done = rows_accepted = rows_rejected = 0
+    for chunk_id in dispatch['chunks']:
+        if chunk_id in overrides:
+            info, ready = overrides[chunk_id]
+        else:
+            chunk = celery_app.AsyncResult(chunk_id)
+            info, ready = chunk.info, chunk.ready()
+        info = info if isinstance(info, dict) else {}
+        chunks_done += ready
+        current += info.get('current', 0)
+        rows_accepted += info.get('rows_accepted', 0)
+        rows_rejected += info.get('rows_rejected', 0)
+    return {
+        'current': current,
+        'total': dispatch['total'],
+        'chunks': len(dispatch['chunks']),
+        'chunks_done': chunks_done,
+        'rows_accepted': rows_accepted,
+        'rows_rejected': rows_rejected,
+    }
+
+
+def _ingest_staged(
+    task, staged_path: str, start: int, end: int, fieldnames=None, first_line: int = 2, publish=None, committed=None
+):
+    """
+    Ingest the `[start, end)` byte range of a staged CSV, whose first row is
+    line `first_line` of the file, recording throttled progress on `task`
+    and returning the import summary. Progress is published on the task's
+    channel, or passed to `publish` when given. The `committed` dict, when
+    given, is kept up to date with the progress of every committed batch,
+    so it still holds what was stored if a later batch fails.
+    """
+    db = database.SessionLocal()
+    try:
+        throttle = ingest.ProgressThrottle()
+        with open(staged_path, 'rb') as staged:
+            lines = ingest.ByteRangeLines(staged, start, end)
+
+            def report_progress(progress):
+                meta = {
+                    'current': lines.bytes_read,
+                    'total': end - start,
+                    'rows_accepted': progress.rows,
+                    'rows_rejected': progress.rejected,
+                }
+                if committed is not None:
+                    committed.update(meta)
+                if throttle.due(progress.rows + progress.rejected):
+                    task.update_state(state='PROGRESS', meta=meta)
+                    if publish is None:
+                        events.publish_task(task.request.id, 'PROGRESS', meta)
+                    else:
+                        publish(meta)
+
+            result = ingest.ingest_csv(
+                db, lines, on_batch=report_progress, skip_invalid=True, fieldnames=fieldnames, first_line=first_line
+            )
+        return {
+            'current': end - start,
+            'total': end - start,
+            'status': 'Completed!',
+            **result.summary(),
+        }
+    finally:
+        db.close()
 
 
 @celery_app.task(bind=True)
-def process_csv_file(self, csv_content: str):
+def process_csv_file(self, staged_path: str):
     """
-    Celery task to process a CSV file's content in the background, with progress updates.
+    Celery task to process a staged CSV upload in the background, with progress updates.
+    The file is streamed from disk in a single pass and removed once processing finishes.
+    Progress is reported as bytes consumed and published at most every
+    PROGRESS_EVERY_ROWS rows or PROGRESS_EVERY_SECONDS seconds.
+
+    Files larger than PARALLEL_CHUNK_BYTES are split into byte-range chunks
+    that run as a chord of `process_csv_chunk` tasks; this task then returns
+    the chunk and callback task ids so the status endpoint can combine them.
+    The chunks publish their combined progress, and `finalize_csv_import`
+    the final result, on this task's channel.
     """
-    db = SessionLocal()
+    dispatched = False
     try:
-        buffer = io.StringIO(csv_content)
-        # Read once to get total for progress tracking
-        total_rows = sum(1 for row in csv.DictReader(io.StringIO(csv_content)))
-        buffer.seek(0)
-        csv_reader = csv.DictReader(buffer)
-        
-        processed_rows = 0
-        for row in csv_reader:
-            field_id = int(row['field_id'])
-            db_field = db.query(Field).filter(Field.id == field_id).first()
-            if not db_field:
-                db.add(Field(id=field_id, name=f"Field {field_id}"))
-                db.commit()
-
-            reading_dict = {k:v for k,v in row.items() if v}
-            reading = SensorReadingCreate(**reading_dict)
-            db_reading = SensorReading(**reading.model_dump())
-            db.add(db_reading)
-            db.commit()
-            
-            processed_rows += 1
-            self.update_state(state='PROGRESS', meta={'current': processed_rows, 'total': total_rows})
-
-        return {'current': total_rows, 'total': total_rows, 'status': 'Completed!'}
+        total_bytes = os.path.getsize(staged_path)
+        if total_bytes > PARALLEL_CHUNK_BYTES:
+            fieldnames, ranges = ingest.plan_chunks(staged_path, PARALLEL_CHUNK_BYTES)
+            dispatch = {
+                'status': 'Dispatched',
+                'task_id': self.request.id,
+                'current': 0,
+                'total': total_bytes,
+                'chunks': [uuid() for _ in ranges],
+                'callback_id': uuid(),
+            }
+            chord(
+                process_csv_chunk.s(staged_path, start, end, fieldnames, first_line, dispatch).set(task_id=chunk_id)
+                for chunk_id, (start, end, first_line) in zip(dispatch['chunks'], ranges)
+            )(finalize_csv_import.s(staged_path, total_bytes, time.time(), dispatch['task_id']).set(
+                task_id=dispatch['callback_id']
+            ))
+            dispatched = True
+            return dispatch
+        return _ingest_staged(self, staged_path, 0, total_bytes)
     except Exception as e:
         self.update_state(state='FAILURE', meta={'exc_type': type(e).__name__, 'exc_message': str(e)})
         return {'status': 'Failed'}
     finally:
-        db.close()
+        if not dispatched:
+            staging.discard(staged_path)
+
+
+@celery_app.task(bind=True)
+def process_csv_chunk(self, staged_path: str, start: int, end: int, fieldnames, first_line: int = 2, dispatch=None):
+    """
+    Celery task to ingest one byte range of a staged CSV upload.
+    Failures are returned rather than raised so the chord callback always runs,
+    counting the batches committed before the failure.
+    With the parent's `dispatch`, progress of the whole import is published
+    on the parent task's channel.
+    """
+    def publish(meta, ready=False):
+        if dispatch is not None:
+            events.publish_task(
+                dispatch['task_id'], 'PROGRESS', chunk_progress(dispatch, {self.request.id: (meta, ready)})
+            )
+
+    committed = {'current': 0, 'total': end - start, 'rows_accepted': 0, 'rows_rejected': 0}
+    try:
+        result = _ingest_staged(
+            self, staged_path, start, end, fieldnames, first_line, publish=publish, committed=committed
+        )
+    except Exception as e:
+        result = {
+            **committed,
+            'status': 'Failed',
+            'errors': [f"Bytes {start}-{end}: {type(e).__name__}: {e}"],
+        }
+    publish(result, ready=True)
+    return result
+
+
+@celery_app.task
+def finalize_csv_import(chunk_results, staged_path: str, total_bytes: int, started_at: float, parent_id: str = None):
+    """
+    Chord callback combining the chunk summaries of a parallel CSV import,
+    and publishing the result as the final state of the `parent_id` task.
+    """
+    try:
+        elapsed = time.time() - started_at
+        rows_accepted = sum(r.get('rows_accepted', 0) for r in chunk_results)
+        errors = [error for r in chunk_results for error in r.get('errors', [])]
+        failed_chunks = sum(1 for r in chunk_results if r.get('status') == 'Failed')
+        result = {
+            'current': total_bytes,
+            'total': total_bytes,
+            'status': 'Completed!' if not failed_chunks else 'Completed with errors',
+            'chunks': len(chunk_results),
+            'failed_chunks': failed_chunks,
+            'rows_accepted': rows_accepted,
+            'rows_rejected': sum(r.get('rows_rejected', 0) for r in chunk_results),
+            'rows_per_sec': round(rows_accepted / elapsed, 1) if elapsed > 0 else float(rows_accepted),
+            'elapsed': round(elapsed, 3),
+            'errors': errors[:ingest.MAX_REPORTED_ERRORS],
+        }
+        if parent_id is not None:
+            events.publish_task(parent_id, 'SUCCESS', result)
+        return result
+    finally:
+        staging.discard(staged_path)
 
 @celery_app.task
 def process_hourly_analytics():
     """
-    Celery task to calculate and store hourly analytics for all sensors.
+    Celery task to bring the minute, hourly and daily rollups up to date: rolls
+    up the buckets that closed since each tier's watermark, then recomputes
+    hours marked dirty by ingestion in every tier.
     """
-    db = SessionLocal()
+    db = database.SessionLocal()
     try:
-        one_hour_ago = datetime.utcnow() - timedelta(hours=1)
-        start_time = one_hour_ago.replace(minute=0, second=0, microsecond=0)
-        end_time = start_time + timedelta(hours=1)
-
-        results = db.query(
-            SensorReading.field_id,
-            SensorReading.sensor_type,
-            func.min(SensorReading.value).label("min_val"),
-            func.max(SensorReading.value).label("max_val"),
-            func.avg(SensorReading.value).label("avg_val"),
-            func.count(SensorReading.id).label("count_val")
-        ).filter(
-            SensorReading.timestamp >= start_time,
-            SensorReading.timestamp < end_time
-        ).group_by(
-            SensorReading.field_id,
-            SensorReading.sensor_type
-        ).all()
-
-        for res in results:
-            analytic = HourlyAnalytics(
-                field_id=res.field_id,
-                sensor_type=res.sensor_type,
-                hour_timestamp=start_time,
-                min_value=res.min_val,
-                max_value=res.max_val,
-                avg_value=res.avg_val,
-                reading_count=res.count_val
-            )
-            db.add(analytic)
-        
-        db.commit()
-        return f"Processed {len(results)} analytic records for hour {start_time}."
+        summary = rollups.run_incremental(db)
+        return (
+            f"Processed {summary['rows_written']} analytic records up to {summary['watermark']} "
+            f"and {summary['dirty_hours']} dirty hours."
+        )
+    finally:
+        db.close()
+
+@celery_app.task
+def rebuild_hourly_analytics(start: str, end: str):
+    """
+    Celery task to rebuild the rollups of every tier for one backfill chunk.
+    """
+    db = database.SessionLocal()
+    try:
+        return rollups.rebuild(db, datetime.fromisoformat(start), datetime.fromisoformat(end))
+    finally:
+        db.close()
+
+@celery_app.task
+def backfill_hourly_analytics(start: str, end: str, chunk_hours: int = None):
+    """
+    Celery task to rebuild the rollups for an arbitrary date range by
+    fanning out one rebuild task per chunk across the worker pool.
+    """
+    chunks = rollups.backfill_chunks(datetime.fromisoformat(start), datetime.fromisoformat(end), chunk_hours)
+    result = group(
+        rebuild_hourly_analytics.s(chunk_start.isoformat(), chunk_end.isoformat())
+        for chunk_start, chunk_end in chunks
+    ).apply_async()
+    result.save()
+    return {'group_id': result.id, 'chunks': len(chunks)}
+
+@celery_app.task
+def maintain_partitions():
+    """
+    Celery task to create upcoming monthly partitions of sensor_readings.
+    Does nothing unless the table has been partitioned by the migrations.
+    """
+    with database.engine.begin() as conn:
+        created = migrations.ensure_partitions(conn)
+    return f"Created {created} sensor_readings partitions."
+
+@celery_app.task
+def apply_retention():
+    """
+    Celery task to drop expired raw readings, in batches or whole partitions,
+    once their rollups are verified, and to prune expired rollups.
+    """
+    db = database.SessionLocal()
+    try:
+        summary = retention.apply_retention(db)
+        return (
+            f"Dropped {len(summary['partitions_dropped'])} partitions, "
+            f"{sum(summary['raw_deleted'].values())} raw readings and "
+            f"{sum(summary['rollups_deleted'].values())} rollups."
+        )
     finally:
         db.close()
 
 celery_app.conf.beat_schedule = {
-    'run-hourly-analytics-every-hour': {
+    'run-rollups-every-minute': {
         'task': 'tasks.process_hourly_analytics',
-        'schedule': 3600.0, 
+        'schedule': ROLLUP_SCHEDULE_SECONDS,
+    },
+    'create-reading-partitions-daily': {
+        'task': 'tasks.maintain_partitions',
+        'schedule': 86400.0,
+    },
+    'apply-retention-daily': {
+        'task': 'tasks.apply_retention',
+        'schedule': 86400.0,
     },
 }